@@ -0,0 +1,135 @@
+"""
+Measures the orchestration overhead of molywood without VMD,
+Tachyon, ImageMagick or ffmpeg installed: synthetic movies of
+increasing length and number of panels are rendered with the
+stand-in tools from stubs.py, injected by overriding
+Script.setup_os_commands, and the time spent in each stage
+(parsing, TCL generation, VMD, figures, composition, encoding
+and cleanup) is reported, along with the overhead per frame
+
+usage: python benchmark/bench.py [--frames 10,100,1000] [--panels 1,4,16]
+                                 [--resolution 64,48] [--plots] [--output results.json]
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stubs
+from molywood import moly, image_io
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+STAGES = ['tcl', 'vmd', 'figures', 'compose', 'encode', 'cleanup']
+
+
+class StubScript(moly.Script):
+    """
+    Script that runs the stand-in tools instead of
+    looking for the real ones
+    """
+    tools = {}
+
+    def setup_os_commands(self):
+        self.remove = 'rm' if os.name == 'posix' else 'del'
+        self.vmd, self.tachyon, self.ffmpeg = self.tools['vmd'], self.tools['tachyon'], self.tools['ffmpeg']
+        self.convert, self.compose = self.tools['convert'], self.tools['composite']
+
+
+def synthetic_script(frames, panels, resolution, plots=False, extra=''):
+    """
+    A movie with a given number of frames, tiled from the
+    given number of panels; each scene animates the example
+    trajectory and then rotates and zooms, the first one
+    also shows a figure (and optionally a plot) as an overlay
+    :param frames: int, number of frames at 20 fps
+    :param panels: int, number of scenes
+    :param resolution: tuple, (width, height) of each scene
+    :param plots: bool, whether to add a matplotlib plot overlay
+    :param extra: str, additional global parameters
+    :return: str, the input script
+    """
+    columns = math.ceil(math.sqrt(panels))
+    rows = math.ceil(panels / columns)
+    half = frames // 2
+    code = '$ global fps=20 name=bench trace=t {}\n$ layout rows={} columns={}\n'.format(extra, rows, columns)
+    for n in range(panels):
+        code += '$ scene_{} structure={} trajectory={} position={},{} resolution={},{}\n' \
+                ''.format(n, os.path.join(EXAMPLES, 'tubulin.pdb'), os.path.join(EXAMPLES, 'tubulin_a.xtc'),
+                          n // columns, n % columns, *resolution)
+    for n in range(panels):
+        code += '\n# scene_{}\nanimate frames=0:100 t={}s smooth=1\n'.format(n, half / 20)
+        overlays = ';\n add_overlay figure=figure.png origin=0.05,0.05 relative_size=0.3' if n == 0 else ''
+        if n == 0 and plots:
+            overlays += ';\n add_overlay datafile={} origin=0.5,0.5 relative_size=0.4' \
+                        ''.format(os.path.join(EXAMPLES, 'with_plot', 'rmsd.dat'))
+        code += '{{ rotate axis=y angle=180 t={}s;\n zoom_in scale=1.5{} }}\n'.format((frames - half) / 20, overlays)
+    return code
+
+
+def run(frames, panels, resolution=(64, 48), plots=False, extra=''):
+    """
+    Renders a single synthetic movie in a temporary directory
+    :param frames: int, number of movie frames
+    :param panels: int, number of scenes
+    :param resolution: tuple, (width, height) of each scene
+    :param plots: bool, whether to add a matplotlib plot overlay
+    :param extra: str, additional global parameters (e.g. 'compositor=imagemagick')
+    :return: dict, seconds spent in each stage, in total and per frame
+    """
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='molywood_bench_')
+    try:
+        os.chdir(workdir)
+        StubScript.tools = stubs.install(workdir)
+        image_io.write_png('figure.png', np.full((300, 400, 3), 200, dtype=np.uint8))
+        with open('bench.txt', 'w') as out:
+            out.write(synthetic_script(frames, panels, resolution, plots, extra))
+        start = time.perf_counter()
+        script = StubScript('bench.txt')
+        parsed = time.perf_counter()
+        script.render()
+        end = time.perf_counter()
+        stages = script.tracer.summary()['stages']
+        result = {'frames': max(sc.total_frames for sc in script.scenes), 'panels': panels,
+                  'parse': parsed - start, 'total': end - start}
+        result.update({stage: stages[stage]['wall'] if stage in stages else 0.0 for stage in STAGES})
+        result['subprocesses'] = stages['render']['subprocesses']
+        result['per_frame'] = result['total'] / result['frames']
+        return result
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def report(results):
+    columns = ['frames', 'panels', 'parse'] + STAGES + ['total', 'per_frame', 'subprocesses']
+    print(' '.join('{:>9}'.format(col) for col in columns))
+    for result in results:
+        print(' '.join('{:>9}'.format(result[col]) if isinstance(result[col], int) else
+                       '{:>9.4f}'.format(result[col]) for col in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks molywood with stand-in external tools')
+    parser.add_argument('--frames', default='10,100,1000', help='comma-separated movie lengths')
+    parser.add_argument('--panels', default='1,4,16', help='comma-separated numbers of panels')
+    parser.add_argument('--resolution', default='64,48', help='width,height of each panel')
+    parser.add_argument('--plots', action='store_true', help='add a matplotlib plot overlay')
+    parser.add_argument('--globals', default='', help="extra global parameters, e.g. 'compositor=imagemagick'")
+    parser.add_argument('--output', help='JSON file to save the results to')
+    args = parser.parse_args()
+    results = [run(nframes, npanels, tuple(int(x) for x in args.resolution.split(',')), args.plots, args.globals)
+               for npanels in [int(x) for x in args.panels.split(',')]
+               for nframes in [int(x) for x in args.frames.split(',')]]
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2)
@@ -0,0 +1,121 @@
+"""
+Lightweight stand-ins for the external programs molywood
+drives (VMD, Tachyon, ImageMagick's convert/composite and
+ffmpeg); they produce files of the right kind and size as
+fast as possible, so that bench.py only measures our own
+orchestration overhead
+"""
+import os
+import re
+import sys
+import zlib
+import shutil
+import struct
+
+
+def write_tga(filename, width, height, value):
+    header = struct.pack('<BBB5sHHHHBB', 0, 0, 2, b'\x00' * 5, 0, 0, width, height, 24, 0)
+    with open(filename, 'wb') as tga:
+        tga.write(header + bytes([value % 256, 128, 255 - value % 256]) * (width * height))
+
+
+def write_png(filename, width, height):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b''.join(b'\x00' + b'\xff' * 3 * width for _ in range(height))
+    with open(filename, 'wb') as png:
+        png.write(b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+                  chunk(b'IDAT', zlib.compress(rows, 1)) + chunk(b'IEND', b''))
+
+
+def rendered_frames(tcl):
+    """
+    Frames a generated script would render: each action
+    sets the starting frame and loops over its frames,
+    optionally restricted to a range or a set of frames
+    :param tcl: str, TCL code produced by Scene.tcl
+    :return: list of ints
+    """
+    frames = []
+    for block in tcl.split('\nset fr ')[1:]:
+        loop = re.search(r'for \{set i (\d+)\} \{\$i < (\d+)\}', block)
+        if loop:
+            first = int(block.split('\n')[0])
+            frames.extend(range(first, first + int(loop.group(2)) - int(loop.group(1))))
+    first = re.search(r'set render_first (\d+)', tcl)
+    last = re.search(r'set render_last (\d+)', tcl)
+    subset = re.search(r'array set render_frames \{(.*)\}', tcl)
+    if first and last:
+        frames = [fr for fr in frames if int(first.group(1)) <= fr < int(last.group(1))]
+    if subset:
+        frames = [fr for fr in frames if fr in {int(x) for x in subset.group(1).split()[::2]}]
+    return frames
+
+
+def vmd(args):
+    tcl = open(args[args.index('-e') + 1]).read()
+    scene = re.search(r'render (?:Tachyon|snapshot) (\S+)-\$fr', tcl)
+    size = re.search(r'-res (\d+) (\d+)', tcl) or re.search(r'display resize (\d+) (\d+)', tcl)
+    if not scene or not size:
+        return 0
+    width, height = int(size.group(1)), int(size.group(2))
+    for fr in rendered_frames(tcl):
+        name = '{}-{}'.format(scene.group(1), fr)
+        if 'dat.part' in tcl:  # scene files for the Tachyon queue
+            with open(name + '.dat.part', 'w') as dat:
+                dat.write('{} {}\n'.format(width, height))
+            os.replace(name + '.dat.part', name + '.dat')
+        else:
+            open(name + '.dat', 'w').close()
+            write_tga(name + '.tga', width, height, fr)
+    return 0
+
+
+def tachyon(args):
+    res = args.index('-res')
+    write_tga(args[args.index('-o') + 1], int(args[res + 1]), int(args[res + 2]), len(args[args.index('-o') + 1]))
+    return 0
+
+
+def imagemagick(args):
+    """
+    convert and composite: the first existing input file
+    is copied to the output, text labels become blank images
+    """
+    sources = [arg for arg in args[:-1] if os.path.isfile(arg)]
+    if sources:
+        shutil.copy(sources[0], args[-1])
+    else:
+        size = args[args.index('-size') + 1].split('x') if '-size' in args else ['1', '1']
+        write_png(args[-1], int(float(size[0])), int(float(size[1])))
+    return 0
+
+
+def ffmpeg(args):
+    if args[args.index('-i') + 1] == '-':  # raw frames are streamed through stdin
+        while sys.stdin.buffer.read(2**20):
+            pass
+    with open(args[-1], 'wb') as out:
+        out.write(b'\x00' * 64)
+    return 0
+
+
+TOOLS = {'vmd': vmd, 'tachyon': tachyon, 'convert': imagemagick, 'composite': imagemagick, 'ffmpeg': ffmpeg}
+
+
+def install(directory):
+    """
+    Writes an executable wrapper for each of the tools
+    :param directory: str, where to put the executables
+    :return: dict, tool name: path to the executable
+    """
+    paths = {}
+    for tool in TOOLS:
+        paths[tool] = os.path.join(directory, tool)
+        with open(paths[tool], 'w') as out:
+            out.write('#!{}\nimport sys\nsys.path.insert(0, {!r})\nimport stubs\n'
+                      'sys.exit(stubs.TOOLS[{!r}](sys.argv[1:]))\n'.format(sys.executable,
+                                                                           os.path.dirname(os.path.abspath(__file__)),
+                                                                           tool))
+        os.chmod(paths[tool], 0o755)
+    return paths
@@ -1 +1 @@
-from .pyvmd import *
+from .moly import *
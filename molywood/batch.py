@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import argparse
+
+if __package__:
+    from . import moly
+    from . import frame_cache
+    from . import graphics_actions
+    from . import vmd_pool
+else:
+    import moly
+    import frame_cache
+    import graphics_actions
+    import vmd_pool
+
+TOOLS = ['vmd', 'remove', 'compose', 'convert', 'tachyon', 'ffmpeg']
+
+
+class Batch:
+    """
+    Renders a queue of movie scripts in a single process;
+    each script is parsed into its own Script instance and
+    rendered in its own directory, one after another, while
+    the resources that are expensive to set up are shared
+    by all jobs: paths to the external programs, a pool of
+    warm VMD processes, the frame cache, resized figures
+    and parsed data files; VMD workers and composition
+    processes of every job are drawn from a common budget
+    """
+    def __init__(self, scriptfiles, workers=1, jobs=None, cache=True, cache_size=2048, pool=True):
+        """
+        :param scriptfiles: list of str, paths to the input scripts
+        :param workers: int, number of VMD processes available to each job (and size of the VMD pool)
+        :param jobs: int, number of processes composing frames, plotting and converting images
+        :param cache: bool, whether all jobs share a frame cache (scripts with cache=t always use it)
+        :param cache_size: float, size limit of the shared frame cache in MB
+        :param pool: bool, whether VMD processes are kept running between scenes and jobs
+        """
+        self.scriptfiles = [os.path.abspath(scriptfile) for scriptfile in scriptfiles]
+        self.workers = workers
+        self.jobs = jobs or os.cpu_count() or 1
+        self.cache, self.cache_size, self.use_pool = cache, cache_size, pool
+        self.directory = os.path.abspath('.molywood_cache')  # shared caches live next to where the batch started
+        self.tools = None  # attribute: path, discovered once unless set by the caller
+        self.frame_cache, self.vmd_pool = None, None
+        self.results = {}  # script file: None if rendered, otherwise the error
+
+    def setup(self, script):
+        """
+        Hands the shared resources and the worker
+        budget to a freshly parsed script; explicit
+        workers/jobs settings of the script are kept
+        as long as they fit within the budget
+        :param script: Script instance, the job to be rendered
+        :return: None
+        """
+        for tool in TOOLS:
+            setattr(script, tool, self.tools[tool])
+        settings = script.directives.get('global', {})
+        script.workers = min(script.workers, self.workers) if 'workers' in settings else self.workers
+        script.jobs = min(script.jobs, self.jobs) if 'jobs' in settings else self.jobs
+        script.tachyon_jobs = min(script.tachyon_jobs, self.jobs)
+        if self.cache or script.cache:
+            if self.frame_cache is None:
+                self.frame_cache = frame_cache.FrameCache(os.path.join(self.directory, 'frames'),
+                                                          self.cache_size * 2**20)
+            script.cache, script.frame_cache = True, self.frame_cache
+        if self.use_pool and not script.draft:
+            if self.vmd_pool is None:
+                self.vmd_pool = vmd_pool.VMDPool(self.tools['vmd'], self.workers)
+            script.vmd_pool = self.vmd_pool
+
+    def run_job(self, scriptfile):
+        """
+        Parses and renders a single script in its
+        own directory, so that intermediate files
+        and movies of different jobs never collide
+        :param scriptfile: str, absolute path to the input script
+        :return: None
+        """
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(scriptfile))
+        try:
+            script = moly.Script(os.path.basename(scriptfile))
+            self.setup(script)
+            script.render()
+        finally:
+            os.chdir(cwd)
+
+    def render(self):
+        """
+        Renders all scripts in order; a failing job
+        is reported and does not stop the others
+        :return: dict, script file: None if rendered, otherwise the error message
+        """
+        if self.tools is None:
+            script = moly.Script()
+            script.setup_os_commands()
+            self.tools = {tool: getattr(script, tool) for tool in TOOLS}
+        figures = graphics_actions.figure_cache
+        graphics_actions.figure_cache = os.path.join(self.directory, 'figures')  # figures are resized only once
+        try:
+            for scriptfile in self.scriptfiles:
+                start = time.time()
+                try:
+                    self.run_job(scriptfile)
+                except Exception as err:
+                    self.results[scriptfile] = '{}: {}'.format(type(err).__name__, str(err).strip())
+                    print('{} failed: {}'.format(scriptfile, self.results[scriptfile]))
+                else:
+                    self.results[scriptfile] = None
+                    print('{} rendered in {:.1f} s'.format(scriptfile, time.time() - start))
+        finally:
+            graphics_actions.figure_cache = figures
+            if self.vmd_pool is not None:
+                self.vmd_pool.close()
+                self.vmd_pool = None
+        return self.results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Renders several movie scripts in one process, sharing tools, '
+                                                 'warm VMD processes and caches between them')
+    parser.add_argument('scripts', nargs='+', help='input scripts; each movie is rendered in its own directory')
+    parser.add_argument('--workers', type=int, default=1, help='VMD processes (size of the VMD pool)')
+    parser.add_argument('--jobs', type=int, help='processes used for composition, plots and conversion')
+    parser.add_argument('--no-cache', action='store_true', help='only use the frame cache for scripts with cache=t')
+    parser.add_argument('--no-pool', action='store_true', help='start a new VMD process for every scene')
+    args = parser.parse_args()
+    results = Batch(args.scripts, args.workers, args.jobs, not args.no_cache, pool=not args.no_pool).render()
+    failed = [scriptfile for scriptfile, error in results.items() if error]
+    print('{} of {} movies rendered'.format(len(results) - len(failed), len(results)))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,319 @@
+import os
+import shutil
+from collections import deque
+
+if __package__:
+    from . import image_io
+else:
+    import image_io
+
+
+def fit_size(width, height, box_width, box_height):
+    """
+    Size of an image scaled to fit into a box while preserving
+    its aspect ratio, same as ImageMagick's '-resize WxH'
+    :param width: int, original width
+    :param height: int, original height
+    :param box_width: float, width of the bounding box
+    :param box_height: float, height of the bounding box
+    :return: tuple, (new width, new height)
+    """
+    scale = min(box_width / width, box_height / height)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def resample_matrix(n_in, n_out):
+    """
+    Weights that map n_in pixels onto n_out pixels along
+    one dimension: area averaging when downscaling, linear
+    interpolation when upscaling
+    :param n_in: int, number of input pixels
+    :param n_out: int, number of output pixels
+    :return: numpy.array, float32 array of shape (n_out, n_in)
+    """
+    import numpy as np
+    if n_out < n_in:
+        edges = np.linspace(0, n_in, n_out + 1)
+        pixels = np.arange(n_in)
+        low = np.maximum(edges[:-1, None], pixels[None, :])
+        high = np.minimum(edges[1:, None], pixels[None, :] + 1)
+        weights = np.clip(high - low, 0, None)
+    else:
+        centers = np.clip((np.arange(n_out) + 0.5) * n_in / n_out - 0.5, 0, n_in - 1)
+        left = np.minimum(np.floor(centers).astype(int), n_in - 1)
+        right = np.minimum(left + 1, n_in - 1)
+        frac = centers - left
+        weights = np.zeros((n_out, n_in))
+        np.add.at(weights, (np.arange(n_out), left), 1 - frac)
+        np.add.at(weights, (np.arange(n_out), right), frac)
+    return (weights / weights.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def resize(image, box_width, box_height):
+    """
+    Scales an image to fit into a box, preserving the aspect
+    ratio (colors are premultiplied by alpha, if present)
+    :param image: numpy.array, uint8 array of shape (height, width, channels)
+    :param box_width: float, width of the bounding box
+    :param box_height: float, height of the bounding box
+    :return: numpy.array, the resized uint8 array
+    """
+    import numpy as np
+    height, width, channels = image.shape
+    new_width, new_height = fit_size(width, height, box_width, box_height)
+    if (new_width, new_height) == (width, height):
+        return image
+    data = image.astype(np.float32)
+    if channels in [2, 4]:
+        data[:, :, :-1] *= data[:, :, -1:] / 255
+    data = np.tensordot(resample_matrix(height, new_height), data, axes=(1, 0))
+    data = np.tensordot(resample_matrix(width, new_width), data, axes=(1, 1)).transpose(1, 0, 2)
+    if channels in [2, 4]:
+        alpha = data[:, :, -1:]
+        data[:, :, :-1] = np.where(alpha > 0, data[:, :, :-1] * 255 / np.maximum(alpha, 1e-6), 0)
+    return np.clip(data + 0.5, 0, 255).astype(np.uint8)
+
+
+def overlay(base, ovl, origin_px, opacity=1.0):
+    """
+    Alpha-blends an overlay onto a base image in place,
+    equivalent to ImageMagick's 'composite -gravity SouthWest
+    -compose atop -geometry +x+y' (the base keeps its alpha)
+    :param base: numpy.array, uint8 array of shape (height, width, channels), modified in place
+    :param ovl: numpy.array, uint8 array of the overlay
+    :param origin_px: tuple, (x, y) offset of the overlay's bottom left corner from the base's bottom left corner
+    :param opacity: float, additional opacity factor applied to the overlay
+    :return: numpy.array, the modified base
+    """
+    import numpy as np
+    height, width = base.shape[:2]
+    oh, ow = ovl.shape[:2]
+    x, y = origin_px
+    top = height - y - oh
+    r0, r1 = max(top, 0), min(top + oh, height)
+    c0, c1 = max(x, 0), min(x + ow, width)
+    if r0 >= r1 or c0 >= c1:
+        return base
+    patch = ovl[r0 - top:r1 - top, c0 - x:c1 - x]
+    if patch.shape[2] in [2, 4]:
+        alpha = patch[:, :, -1:].astype(np.float32) / 255 * opacity
+        color = patch[:, :, :-1]
+    else:
+        alpha = np.full(patch.shape[:2] + (1,), opacity, dtype=np.float32)
+        color = patch
+    nbase = base.shape[2] - (1 if base.shape[2] in [2, 4] else 0)
+    if color.shape[2] != nbase:  # grayscale vs RGB
+        color = np.repeat(color[:, :, :1], nbase, axis=2) if nbase == 3 else color.mean(axis=2, keepdims=True)
+    region = base[r0:r1, c0:c1, :nbase].astype(np.float32)
+    base[r0:r1, c0:c1, :nbase] = (color * alpha + region * (1 - alpha) + 0.5).astype(np.uint8)
+    return base
+
+
+def link(source, target):
+    """
+    Makes target refer to the same image as source,
+    using a hardlink where possible (a copy otherwise)
+    :param source: str, path to an existing image
+    :param target: str, path to the frame file to be created
+    :return: None
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def tile(rows, background=255):
+    """
+    Arranges images in a grid, equivalent to ImageMagick's
+    '\\( a b +append \\) \\( c d +append \\) -append': images
+    are aligned top-left and gaps filled with the background
+    :param rows: list of lists of numpy.array (or None for empty cells)
+    :param background: int, gray level of the background (255 is white)
+    :return: numpy.array, uint8 RGB array with the composed image
+    """
+    import numpy as np
+    rows = [[image_io.to_rgb(im) if im is not None else None for im in row] for row in rows]
+    row_heights = [max([im.shape[0] for im in row if im is not None] + [0]) for row in rows]
+    row_widths = [sum(im.shape[1] for im in row if im is not None) for row in rows]
+    canvas = np.full((sum(row_heights), max(row_widths), 3), background, dtype=np.uint8)
+    top = 0
+    for row, row_height in zip(rows, row_heights):
+        left = 0
+        for im in row:
+            if im is not None:
+                canvas[top:top + im.shape[0], left:left + im.shape[1]] = im
+                left += im.shape[1]
+        top += row_height
+    return canvas
+
+
+class FrameCompositor:
+    """
+    Composes the final movie frames in memory: each scene
+    frame and each overlay is decoded once, overlays are
+    blended in, panels are tiled according to the layout,
+    and the result is encoded once (or streamed to ffmpeg);
+    only holds plain data, so that ranges of frames can be
+    composed in separate processes
+    """
+    def __init__(self, name, frames, overlays, layout, keepframes=False):
+        """
+        :param name: str, name of the movie (prefix of the output frames)
+        :param frames: dict, scene_name: number of frames in the scene
+        :param overlays: dict, scene_name: list of (overlay key, first frame, number of frames,
+                         whether the overlay is a static figure, origin in px, opacity array)
+        :param layout: list of lists of scene names ('' for empty cells)
+        :param keepframes: bool, whether to write {name}-{fr}.png files when streaming
+        """
+        self.name = name
+        self.frames = frames
+        self.overlays = overlays
+        self.layout = layout
+        self.keepframes = keepframes
+        self.static = {}  # decoded overlay figures shared by all frames of an action
+        self._last = {}  # scene_name: (frame, image), reused when shorter scenes are padded
+        self._previous = None  # (frame, inputs, image) of the last composed frame
+
+    def scene_frame(self, scene_name, frame):
+        """
+        Decodes a scene frame and blends in its overlays;
+        scenes shorter than the movie repeat their last frame
+        :param scene_name: str, name of the scene
+        :param frame: int, frame number in the movie
+        :return: numpy.array, uint8 image array
+        """
+        frame = min(frame, self.frames[scene_name] - 1)
+        if scene_name in self._last and self._last[scene_name][0] == frame:
+            return self._last[scene_name][1]
+        image = image_io.read_png('{}-{}.png'.format(scene_name, frame))
+        for spec in self.overlays.get(scene_name, []):
+            ovl, initframe, framenum, static, origin_px, opacity = spec
+            if initframe <= frame < initframe + framenum:
+                if image.shape[2] == 1:
+                    image = image_io.to_rgb(image)
+                overlay(image, self.overlay_image(scene_name, spec, frame), origin_px, opacity[frame - initframe])
+        self._last[scene_name] = (frame, image)
+        return image
+
+    def overlay_image(self, scene_name, spec, frame):
+        """
+        Decodes the overlay image for a given frame; static
+        figures are only decoded once per action
+        :param scene_name: str, name of the scene
+        :param spec: tuple, overlay specification (see __init__)
+        :param frame: int, frame number in the scene
+        :return: numpy.array, uint8 image array
+        """
+        ovl, initframe, _, static, _, _ = spec
+        key = (scene_name, ovl, initframe)
+        if key in self.static:
+            return self.static[key]
+        image = image_io.read_png('{}-{}-{}.png'.format(ovl, scene_name, frame))
+        if static:
+            self.static[key] = image
+        return image
+
+    def compose(self, frame):
+        """
+        Produces a single movie frame
+        :param frame: int, frame number in the movie
+        :return: numpy.array, uint8 image array
+        """
+        rows = [[self.scene_frame(name, frame) if name else None for name in row] for row in self.layout]
+        if len(rows) == 1 and len(rows[0]) == 1:
+            return rows[0][0]
+        return tile(rows)
+
+    def compose_range(self, frames, collect=False):
+        """
+        Composes a range of frames, writing them
+        to {name}-{fr}.png and/or returning them
+        :param frames: iterable of ints, frame numbers in the movie
+        :param collect: bool, whether to return the images (for streaming)
+        :return: list of numpy.array if collect, otherwise an empty list
+        """
+        images = []
+        for fr in frames:
+            inputs = self.inputs(fr)
+            previous = self._previous
+            if previous and previous[1] == inputs:  # e.g. do_nothing or padding: nothing changed
+                image = previous[2]
+                if not collect or self.keepframes:
+                    link('{}-{}.png'.format(self.name, previous[0]), '{}-{}.png'.format(self.name, fr))
+            else:
+                image = self.compose(fr)
+                if not collect or self.keepframes:
+                    image_io.write_png('{}-{}.png'.format(self.name, fr), image)
+            if collect:
+                images.append(image)
+            self._previous = (fr, inputs, image)
+        return images
+
+    def inputs(self, frame):
+        """
+        Identifies the files a movie frame is composed
+        from (and the overlay opacities), so that frames
+        made of the very same (e.g. hardlinked) inputs
+        are only composed once
+        :param frame: int, frame number in the movie
+        :return: tuple
+        """
+        files = []
+        for name in [name for row in self.layout for name in row if name]:
+            scene_frame = min(frame, self.frames[name] - 1)
+            stat = os.stat('{}-{}.png'.format(name, scene_frame))
+            files.append((stat.st_dev, stat.st_ino))
+            for ovl, initframe, framenum, _, _, opacity in self.overlays.get(name, []):
+                if initframe <= scene_frame < initframe + framenum:
+                    stat = os.stat('{}-{}-{}.png'.format(ovl, name, scene_frame))
+                    files.append((stat.st_dev, stat.st_ino, opacity[scene_frame - initframe]))
+        return tuple(files)
+
+    def run(self, stream=None, jobs=1, frames=None, on_frame=None):
+        """
+        Composes all frames of the movie, writing them
+        to {name}-{fr}.png and/or pushing them to the stream;
+        with jobs > 1, contiguous ranges of frames are
+        composed by a pool of processes, and streamed
+        frames are still pushed in order
+        :param stream: encoder.StreamingEncoder, if given, frames are pushed to it
+        :param jobs: int, number of processes
+        :param frames: list of ints, if given, only these movie frames are composed
+        :param on_frame: callable, if given, called as on_frame(fr) once a frame file has been written
+        :return: None
+        """
+        scene_name = self.layout[0][0]
+        nframes = max(self.frames.values())
+        todo = list(range(nframes)) if frames is None else list(frames)
+        if len(self.layout) == 1 and len(self.layout[0]) == 1 and not stream and not self.overlays.get(scene_name):
+            for fr in todo:
+                os.replace('{}-{}.png'.format(scene_name, fr), '{}-{}.png'.format(self.name, fr))
+                if on_frame:
+                    on_frame(fr)
+            return
+        if jobs < 2 or len(todo) < 2:
+            for fr in todo:
+                image = self.compose_range([fr], collect=bool(stream))
+                if stream:
+                    stream.push(fr, image[0])
+                if on_frame and (not stream or self.keepframes):
+                    on_frame(fr)
+            return
+        batch = 8 if stream else -(-len(todo) // jobs)  # streamed frames travel back, so keep batches small
+        ranges = [todo[first:first + batch] for first in range(0, len(todo), batch)]
+        pending = deque()
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for frames in ranges:
+                pending.append((frames, pool.submit(self.compose_range, frames, bool(stream))))
+                while len(pending) > 2 * jobs or (frames is ranges[-1] and pending):
+                    done_frames, future = pending.popleft()
+                    for fr, image in zip(done_frames, future.result()):
+                        stream.push(fr, image)
+                    if on_frame and (not stream or self.keepframes):
+                        for fr in done_frames:
+                            on_frame(fr)
@@ -0,0 +1,278 @@
+import os
+import json
+import hashlib
+import threading
+from subprocess import Popen, PIPE, call
+from concurrent.futures import ThreadPoolExecutor
+
+if __package__:
+    from . import image_io
+else:
+    import image_io
+
+
+class StreamingEncoder:
+    """
+    Keeps a single ffmpeg process open and feeds it raw
+    RGB frames through stdin as soon as they are ready;
+    frames can be pushed out of order (e.g. by concurrent
+    producers) and are kept in a bounded reorder buffer
+    until all preceding frames have been written
+    """
+    needs_files = False  # frames can be pushed as image arrays, nothing has to be written to disk
+
+    def __init__(self, ffmpeg, name, fps, buffer_size=64):
+        self.ffmpeg = ffmpeg
+        self.name = name
+        self.fps = fps
+        self.buffer_size = buffer_size
+        self.process = None
+        self.shape = None
+        self.next_frame = 0
+        self.buffer = {}
+        self.error = None  # set by abort(), makes pending and future pushes fail
+        self.condition = threading.Condition()
+
+    def start(self, width, height):
+        """
+        Launches ffmpeg reading rawvideo frames of a given size
+        :param width: int, frame width in pixels
+        :param height: int, frame height in pixels
+        :return: None
+        """
+        self.shape = (height, width, 3)
+        command = '{} -y -loglevel error -f rawvideo -pix_fmt rgb24 -s {}x{} -framerate {} -i - -profile:v high ' \
+                  '-crf 20 -pix_fmt yuv420p -vf "pad=ceil(iw/2)*2:ceil(ih/2)*2" {}.mp4'.format(self.ffmpeg, width,
+                                                                                              height, self.fps,
+                                                                                              self.name)
+        self.process = Popen(command, stdin=PIPE, shell=True)
+
+    def push(self, index, frame):
+        """
+        Adds a frame to the stream; blocks while the reorder
+        buffer is full and the frame is not the next one due,
+        and raises if the stream was aborted in the meantime
+        :param index: int, frame number in the final movie
+        :param frame: numpy.array or str, uint8 image array or path to an image file
+        :return: None
+        """
+        if isinstance(frame, str):
+            frame = image_io.read_image(frame)
+        frame = image_io.to_rgb(frame)
+        with self.condition:
+            while index != self.next_frame and len(self.buffer) >= self.buffer_size and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise RuntimeError('Frame {} was not encoded: {}'.format(index, self.error))
+            if self.process is None:
+                self.start(frame.shape[1], frame.shape[0])
+            if frame.shape != self.shape:
+                raise RuntimeError('Frame {} has a size of {}x{}, while the movie is {}x{}; all frames have to be '
+                                   'of equal size'.format(index, frame.shape[1], frame.shape[0], self.shape[1],
+                                                          self.shape[0]))
+            self.buffer[index] = frame
+            while self.next_frame in self.buffer:
+                self.process.stdin.write(self.buffer.pop(self.next_frame).tobytes())
+                self.next_frame += 1
+            self.condition.notify_all()
+
+    def abort(self, error):
+        """
+        Stops the stream when a frame will never arrive
+        (e.g. because it failed to render): producers
+        waiting for it are woken up and their pushes
+        raise, and ffmpeg is terminated
+        :param error: str, reason reported by pending and future pushes
+        :return: None
+        """
+        with self.condition:
+            if self.error is None:
+                self.error = error
+                self.buffer = {}
+                if self.process is not None:
+                    self.process.stdin.close()
+                    self.process.kill()
+                    self.process.wait()
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        Flushes the stream and waits for ffmpeg to finish
+        :return: None
+        """
+        if self.error is not None:
+            raise RuntimeError('The movie {}.mp4 was not encoded: {}'.format(self.name, self.error))
+        if self.buffer:
+            raise RuntimeError('Frames {} were never encoded as some of the preceding frames are '
+                               'missing'.format(', '.join(str(x) for x in sorted(self.buffer))))
+        if self.process is not None:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise RuntimeError('ffmpeg failed to encode the movie {}.mp4'.format(self.name))
+
+
+class SegmentedEncoder:
+    """
+    Encodes the movie from the pushed frame files in
+    fixed-length, GOP-aligned segments: each segment is
+    encoded by its own ffmpeg process as soon as all its
+    frames have been pushed, and stored in a cache keyed
+    by the contents of its frames, so that interrupted or
+    slightly edited movies only re-encode what changed;
+    segments are then joined with ffmpeg's concat demuxer
+    """
+    needs_files = True  # frames are pushed as paths to files, which have to be kept until close()
+    settings = '-profile:v high -crf 20 -pix_fmt yuv420p -vf "pad=ceil(iw/2)*2:ceil(ih/2)*2"'
+
+    def __init__(self, ffmpeg, name, fps, jobs=1, seconds=5, directory=os.path.join('.molywood_cache', 'segments'),
+                 max_size=2048 * 2**20):
+        """
+        :param ffmpeg: str, path to ffmpeg
+        :param name: str, name of the movie
+        :param fps: float, frames per second
+        :param jobs: int, number of concurrent ffmpeg processes
+        :param seconds: int, length of a segment in seconds (rounded to full GOPs of 1 s)
+        :param directory: str, where encoded segments are stored
+        :param max_size: float, size limit of the stored segments in bytes
+        """
+        self.ffmpeg = ffmpeg
+        self.max_size = max_size
+        self.name = name
+        self.fps = fps
+        self.gop = max(1, int(round(fps)))
+        self.length = seconds * self.gop
+        self.threads = max(1, (os.cpu_count() or 1) // jobs)
+        self.directory = directory
+        self.frames = {}
+        self.segments = {}  # first frame: future returning the path to the encoded segment
+        self.encoded = 0
+        self._lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        os.makedirs(directory, exist_ok=True)
+
+    def push(self, index, frame):
+        """
+        Registers a finished movie frame; once all frames
+        of a segment are there, it is submitted for encoding
+        :param index: int, frame number in the final movie
+        :param frame: str, path to the image file
+        :return: None
+        """
+        self.frames[index] = frame
+        first = index - index % self.length
+        if first not in self.segments and all(fr in self.frames for fr in range(first, first + self.length)):
+            self.submit(first, self.length)
+
+    def submit(self, first, length):
+        self.segments[first] = self.pool.submit(self.encode, first, [self.frames[fr] for fr in
+                                                                     range(first, first + length)])
+
+    def encode(self, first, frames):
+        """
+        Encodes a single segment, unless an identical
+        one is already present in the cache
+        :param first: int, number of the first frame of the segment
+        :param frames: list of str, paths to the frames of the segment
+        :return: str, path to the encoded segment
+        """
+        sha = hashlib.sha1('{} {} {}'.format(self.settings, self.fps, self.gop).encode())
+        for frame in frames:
+            with open(frame, 'rb') as data:
+                sha.update(hashlib.sha1(data.read()).digest())
+        segment = os.path.join(self.directory, sha.hexdigest() + '.mp4')
+        if os.path.isfile(segment):
+            os.utime(segment)  # marks it as recently used
+            return segment
+        partial = '{}.{}.part.mp4'.format(segment, threading.get_ident())
+        command = '{} -y -loglevel error -f image2pipe -framerate {} -i - {} -g {} -threads {} ' \
+                  '{}'.format(self.ffmpeg, self.fps, self.settings, self.gop, self.threads, partial)
+        process = Popen(command, stdin=PIPE, shell=True)
+        try:  # the pushed files are piped as they are, whatever their names
+            for frame in frames:
+                with open(frame, 'rb') as data:
+                    process.stdin.write(data.read())
+            process.stdin.close()
+        except BrokenPipeError:  # ffmpeg quit early, which is reported below
+            pass
+        if process.wait() != 0 or not os.path.isfile(partial):
+            raise RuntimeError('ffmpeg failed to encode frames {}-{} of the movie {}'.format(first, first + len(frames)
+                                                                                          - 1, self.name))
+        os.replace(partial, segment)
+        with self._lock:
+            self.encoded += 1
+        return segment
+
+    def close(self):
+        """
+        Encodes the remaining (last, possibly shorter)
+        segment, waits for all segments and joins them
+        into {name}.mp4; segments of the previous version
+        of the movie are removed unless they are still
+        used by this or any other movie in the cache, and
+        the least recently used ones are evicted once the
+        cache exceeds its size limit
+        :return: None
+        """
+        nframes = len(self.frames)
+        if sorted(self.frames) != list(range(nframes)):
+            raise RuntimeError('Frames {} were never encoded as some of the preceding frames are '
+                               'missing'.format(', '.join(str(x) for x in sorted(self.frames) if x >= nframes)))
+        for first in range(0, nframes, self.length):
+            if first not in self.segments:
+                self.submit(first, min(self.length, nframes - first))
+        try:
+            segments = [self.segments[first].result() for first in sorted(self.segments)]
+        finally:
+            self.pool.shutdown()
+        if not segments:
+            return
+        print('{} of {} movie segments encoded, {} reused from the cache'.format(self.encoded, len(segments),
+                                                                                len(segments) - self.encoded))
+        with open('{}-segments.txt'.format(self.name), 'w') as out:
+            out.write(''.join("file '{}'\n".format(os.path.abspath(seg)) for seg in segments))
+        code = call('{} -y -loglevel error -f concat -safe 0 -i {}-segments.txt -c copy '
+                    '{}.mp4'.format(self.ffmpeg, self.name, self.name), shell=True)
+        os.remove('{}-segments.txt'.format(self.name))
+        if code != 0:
+            raise RuntimeError('ffmpeg failed to join the segments of the movie {}.mp4'.format(self.name))
+        index_file = os.path.join(self.directory, '{}.json'.format(os.path.basename(self.name)))
+        try:
+            with open(index_file) as index:
+                previous = json.load(index)
+        except (OSError, ValueError):
+            previous = []
+        with open(index_file, 'w') as index:
+            json.dump(segments, index)
+        used = set()
+        for other in [x for x in os.listdir(self.directory) if x.endswith('.json')]:
+            try:
+                with open(os.path.join(self.directory, other)) as index:
+                    used.update(json.load(index))
+            except (OSError, ValueError):
+                return  # better keep stale segments than remove ones that are still in use
+        for segment in set(previous).difference(used):
+            if os.path.isfile(segment):
+                os.remove(segment)
+        self.evict(segments)
+
+    def evict(self, keep=()):
+        """
+        Removes the least recently used segments (e.g. of
+        renamed or abandoned movies) until the stored
+        segments fit within the size limit
+        :param keep: iterable of str, segments that are never removed (those of the current movie)
+        :return: None
+        """
+        keep = {os.path.abspath(seg) for seg in keep}
+        entries = []
+        for f in os.listdir(self.directory):
+            path = os.path.join(self.directory, f)
+            if f.endswith('.mp4') and not f.endswith('.part.mp4') and os.path.abspath(path) not in keep:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries) + sum(os.path.getsize(seg) for seg in keep)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
@@ -0,0 +1,202 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+CACHE_VERSION = 1  # bump whenever the TCL/rendering code changes the appearance of frames
+
+# these only change the camera, materials or the trajectory frame, all of which are captured by
+# the absolute FrameState; parameters of other actions (highlights, labels, centering...) are hashed
+STATE_ACTIONS = {'do_nothing', 'animate', 'rotate', 'zoom_in', 'zoom_out', 'make_transparent', 'make_opaque'}
+# sub-actions of a SimultaneousAction that keep their own parameters (action.parameters only holds the merged ones)
+SUB_ACTIONS = ['highlights', 'transp_changes', 'rots', 'overlays']
+
+
+class FrameCache:
+    """
+    Persistent, content-addressed store of rendered
+    scene frames: each frame is keyed by a hash of
+    everything that determines its appearance, so that
+    reruns only have to render frames that changed;
+    the total size is bounded by evicting the least
+    recently used frames
+    """
+    def __init__(self, directory, max_size):
+        """
+        :param directory: str, where cached frames are stored
+        :param max_size: float, maximum total size of the cache in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.digests_file = os.path.join(directory, 'digests.json')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.digests_file) as digests:
+                self.digests = json.load(digests)
+        except (OSError, ValueError):
+            self.digests = {}
+
+    def file_digest(self, filename):
+        """
+        SHA-1 of a file's contents, memoized by path,
+        size and modification time so that large
+        trajectories are only hashed once
+        :param filename: str, path to the file
+        :return: str, hex digest (or None if the file does not exist)
+        """
+        if not filename or not os.path.isfile(filename):
+            return None
+        stat = os.stat(filename)
+        path = os.path.abspath(filename)
+        with self._lock:
+            known = self.digests.get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            return known[2]
+        sha = hashlib.sha1()
+        with open(filename, 'rb') as data:
+            for block in iter(lambda: data.read(1 << 20), b''):
+                sha.update(block)
+        with self._lock:
+            self.digests[path] = [stat.st_size, stat.st_mtime, sha.hexdigest()]
+            with open(self.digests_file + '.part', 'w') as digests:
+                json.dump(self.digests, digests)
+            os.replace(self.digests_file + '.part', self.digests_file)
+        return sha.hexdigest()
+
+    def scene_inputs(self, scene):
+        """
+        Digests of all input files of a scene: the
+        visualization state, files it loads with
+        'mol new/addfile', structure and trajectory
+        :param scene: Scene instance, the scene to be described
+        :return: list of (path, digest) tuples
+        """
+        files = [scene.visualization, scene.structure, scene.trajectory]
+        if scene.visualization:
+            for line in open(scene.visualization):
+                words = line.split()
+                if len(words) > 2 and words[0] == 'mol' and words[1] in ['new', 'addfile']:
+                    files.append(words[2])
+        return [(f, self.file_digest(f)) for f in files if f]
+
+    def frame_keys(self, scene):
+        """
+        Computes the cache key of every frame of a scene
+        (scene.keyframes have to be computed beforehand)
+        :param scene: Scene instance, the scene to be described
+        :return: list of str, one hex digest per frame
+        """
+        common = repr((CACHE_VERSION, self.scene_inputs(scene), tuple(scene.resolution),
+                       'tachyon -aasamples 12 -format TARGA'))
+        return [hashlib.sha1(repr((common,) + state).encode()).hexdigest() for state in frame_states(scene)]
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.png')
+
+    def fetch(self, key, target):
+        """
+        Restores a cached frame (as a hardlink
+        where possible) and marks it as recently used
+        :param key: str, cache key of the frame
+        :param target: str, path to the frame file to be created
+        :return: bool, whether the frame was found
+        """
+        cached = self.path(key)
+        if not os.path.isfile(cached):
+            return False
+        os.utime(cached)
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            os.link(cached, target)
+        except OSError:
+            shutil.copyfile(cached, target)
+        return True
+
+    def store(self, key, source):
+        """
+        Adds a freshly rendered frame to the cache
+        :param key: str, cache key of the frame
+        :param source: str, path to the rendered frame
+        :return: None
+        """
+        cached = self.path(key)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        partial = '{}.{}.part'.format(cached, threading.get_ident())
+        try:
+            os.link(source, partial)
+        except OSError:
+            shutil.copyfile(source, partial)
+        os.replace(partial, cached)
+
+    def evict(self):
+        """
+        Removes the least recently used frames until
+        the cache fits within its size limit
+        :return: None
+        """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for f in files:
+                if f.endswith('.png'):
+                    stat = os.stat(os.path.join(root, f))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, f)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
+
+
+def frame_states(scene):
+    """
+    Describes every frame of a scene by the parameters
+    of persistent actions applied so far and its absolute
+    state, so that frames that look the same compare equal
+    (scene.keyframes have to be computed beforehand)
+    :param scene: Scene instance, the scene to be described
+    :return: list of tuples, one per frame
+    """
+    states = []
+    for fr in range(scene.total_frames):
+        persistent = [action_parameters(action) for action in scene.actions if action.initframe <= fr
+                      and set(action.action_type).difference(STATE_ACTIONS)]
+        states.append((persistent, plain(scene.keyframes[fr].key())))
+    return states
+
+
+def action_parameters(action, ignore=('t',)):
+    """
+    Describes an action by its types and parameters,
+    including the separate parameters of each highlight,
+    transparency change, rotation or overlay combined
+    in a simultaneous action (the merged action.parameters
+    drop e.g. selections and keep the last color only)
+    :param action: Action or SimultaneousAction instance
+    :param ignore: tuple, names of parameters that are left out
+    :return: tuple
+    """
+    def items(parameters):
+        return tuple(sorted((k, v) for k, v in parameters.items() if k not in ignore))
+    subactions = tuple((kind, tuple(sorted((name, items(prm)) for name, prm in getattr(action, kind, {}).items())))
+                       for kind in SUB_ACTIONS)
+    return tuple(sorted(action.action_type)), items(action.parameters), subactions
+
+
+def plain(obj):
+    """
+    Converts numpy scalars in (nested) tuples to
+    Python floats, so that keys do not depend on
+    how numpy represents its types
+    :param obj: tuple or scalar
+    :return: tuple or scalar
+    """
+    import numpy as np
+    if isinstance(obj, tuple):
+        return tuple(plain(x) for x in obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
@@ -1,8 +1,22 @@
 import os
-import numpy as np
+import shutil
+import hashlib
+import threading
+
+if __package__:
+    from . import compositor
+    from . import image_io
+else:
+    import compositor
+    import image_io
+
+# rc settings are global within a process, so plot setup of concurrent scenes is serialized
+plot_lock = threading.Lock()
+figure_cache = os.path.join('.molywood_cache', 'figures')  # resized static figures, reused across runs
+datafiles, datafiles_lock = {}, threading.Lock()  # parsed data files, see read_datafile
 
 # TODO add text labels generated on-the-fly
-def postprocessor(script):
+def postprocessor(script, stream=None):
     """
     This is the key function that controls composition
     of the previously rendered scenes. It first applies
@@ -12,12 +26,44 @@ def postprocessor(script):
     into movie_name...png files that can then
     be merged into a file using ffmpeg.
     :param script: Script instance, the master object controlling the movie layout
+    :param stream: encoder.StreamingEncoder or SegmentedEncoder, composed frames are pushed to it once ready
     :return: None
     """
     try:
         layout_dirs = script.directives['layout']  # layout controls composition of panels
     except KeyError:
         layout_dirs = None
+    segments = None
+    if stream is not None and stream.needs_files:  # frame files are pushed once written, and encoded meanwhile
+        segments, stream = stream, None
+    if script.compositor == 'numpy':
+        overlays = {}
+        for scene in script.scenes:
+            for action in scene.actions:
+                if 'add_overlay' in action.action_type:
+                    opacity = overlay_opacity(action)
+                    overlays.setdefault(scene.name, []).extend((ovl, action.initframe, action.framenum,
+                                                                'figure' in action.overlays[ovl].keys(),
+                                                                overlay_origin(action, ovl), opacity)
+                                                               for ovl in action.overlays.keys())
+        frames = {sc.name: sc.total_frames for sc in script.scenes}
+        on_frame = None
+        if script.journal or segments:  # composed frames are journaled, so that an interrupted job can be resumed
+            def on_frame(fr):
+                if script.journal:
+                    script.journal.record('compose', script.name, fr, '{}-{}.png'.format(script.name, fr))
+                if segments:
+                    segments.push(fr, '{}-{}.png'.format(script.name, fr))
+        if segments and script.dirty_frames is not None and (len(script.scenes) == 1 or layout_dirs):
+            for fr in sorted(set(range(max(frames.values()))).difference(script.dirty_frames)):  # kept from before
+                segments.push(fr, '{}-{}.png'.format(script.name, fr))
+        if len(script.scenes) == 1:
+            compositor.FrameCompositor(script.name, frames, overlays, [[script.scenes[0].name]],
+                                       script.keepframes).run(stream, script.jobs, script.dirty_frames, on_frame)
+        elif layout_dirs and len(script.scenes) > 1:
+            compositor.FrameCompositor(script.name, frames, overlays, layout_matrix(script),
+                                       script.keepframes).run(stream, script.jobs, script.dirty_frames, on_frame)
+        return
     for scene in script.scenes:
         for action in scene.actions:
             if 'add_overlay' in action.action_type:
@@ -26,30 +72,22 @@ def postprocessor(script):
     if len(script.scenes) == 1:  # simplest case: one scene
         scene = script.scenes[0].name
         for fr in range(script.scenes[0].total_frames):
-            os.system('mv {}-{}.png {}-{}.png'.format(scene, fr, script.name, fr))
+            if stream:
+                stream.push(fr, '{}-{}.png'.format(scene, fr))
+            if not stream or script.keepframes:
+                os.system('mv {}-{}.png {}-{}.png'.format(scene, fr, script.name, fr))
+            if segments:
+                segments.push(fr, '{}-{}.png'.format(script.name, fr))
             
     elif layout_dirs and len(script.scenes) > 1:  # here we parse multiple scenes: insets should go earlier!
         # if one has less frames than the other, copy last frame (N-n) times to make counts equal:
         if not all([sc.total_frames == script.scenes[0].total_frames for sc in script.scenes]):
             equalize_frames(script)
-        nrows = int(layout_dirs['rows'])
-        ncols = int(layout_dirs['columns'])
-        labels_matrix = [[] for _ in range(nrows)]
-        all_scenes = [sc.name for sc in script.scenes]
-        positions = {}
-        for scene in all_scenes:
-            try:
-                positions[tuple(int(x) for x in script.directives[scene]['position'].split(','))] = scene
-            except KeyError:
-                raise ValueError('The position for scene {} in the global layout is not specified'.format(scene))
-        for r in range(nrows):
-            for c in range(ncols):
-                try:
-                    scene_name = positions[(r, c)]
-                except KeyError:
-                    labels_matrix[r].append('')
-                else:
-                    labels_matrix[r].append(scene_name)
+        labels_matrix = layout_matrix(script)
+        nrows, ncols = len(labels_matrix), len(labels_matrix[0])
+        for fr in range(script.scenes[0].total_frames):  # never write through a hardlink kept from earlier runs
+            if os.path.lexists('{}-{}.png'.format(script.name, fr)):
+                os.remove('{}-{}.png'.format(script.name, fr))
         convert_command = ''
         for r in range(nrows):
             convert_command += ' \( '
@@ -57,9 +95,80 @@ def postprocessor(script):
                 convert_command += str(labels_matrix[r][c]) + '-{}.png '
             convert_command += ' +append \) '
         convert_command += ' -append '
+        run_frames(script, os.system, [(script.convert + ' ' + convert_command.format(*[fr] * (nrows*ncols)) +
+                                        '{}-{}.png'.format(script.name, fr),)
+                                       for fr in range(script.scenes[0].total_frames)])
         for fr in range(script.scenes[0].total_frames):
-            frames = [fr] * (nrows*ncols)
-            os.system(script.convert + ' ' + convert_command.format(*frames) + '{}-{}.png'.format(script.name, fr))
+            if stream:
+                stream.push(fr, '{}-{}.png'.format(script.name, fr))
+                if not script.keepframes:
+                    os.remove('{}-{}.png'.format(script.name, fr))
+            if segments:
+                segments.push(fr, '{}-{}.png'.format(script.name, fr))
+
+
+def run_frames(script, func, tasks):
+    """
+    Runs func(*task) for each of the tasks, which
+    should be independent of each other (e.g. each
+    writing its own set of frame files); with
+    script.jobs > 1, tasks are distributed over a pool
+    of processes, so that each worker has its own
+    matplotlib state, and results keep the task order
+    :param script: Script instance, the master object controlling the movie layout
+    :param func: callable, a module-level function (has to be picklable)
+    :param tasks: list of tuples, positional arguments for each call
+    :return: list, return values of func in the order of tasks
+    """
+    if func is os.system or func is run_commands:  # shell commands are counted by the tracer, if any
+        script.count(sum(1 if func is os.system else len(task[0]) for task in tasks))
+    if script.jobs > 1 and len(tasks) > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(script.jobs, len(tasks)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            return list(pool.map(func, *zip(*tasks), chunksize=max(1, len(tasks) // (4 * script.jobs))))
+    return [func(*task) for task in tasks]
+
+
+def run_commands(commands):
+    """
+    Runs a sequence of shell commands that have
+    to be executed in order (e.g. steps on one frame)
+    :param commands: list of str, the commands
+    :return: None
+    """
+    for command in commands:
+        os.system(command)
+
+
+def layout_matrix(script):
+    """
+    Arranges scene names according to the global
+    layout and their 'position' directives
+    :param script: Script instance, the master object controlling the movie layout
+    :return: list of lists of str, scene names in rows/columns ('' for empty cells)
+    """
+    layout_dirs = script.directives['layout']
+    nrows = int(layout_dirs['rows'])
+    ncols = int(layout_dirs['columns'])
+    labels_matrix = [[] for _ in range(nrows)]
+    all_scenes = [sc.name for sc in script.scenes]
+    positions = {}
+    for scene in all_scenes:
+        try:
+            positions[tuple(int(x) for x in script.directives[scene]['position'].split(','))] = scene
+        except KeyError:
+            raise ValueError('The position for scene {} in the global layout is not specified'.format(scene))
+    for r in range(nrows):
+        for c in range(ncols):
+            try:
+                scene_name = positions[(r, c)]
+            except KeyError:
+                labels_matrix[r].append('')
+            else:
+                labels_matrix[r].append(scene_name)
+    return labels_matrix
             
 
 def gen_fig(action):
@@ -72,21 +181,23 @@ def gen_fig(action):
     :param action: Action, object to extract info from
     :return: None
     """
-    convert = action.scene.script.convert
+    import numpy as np
+    script = action.scene.script
+    convert = script.convert
     if 'show_figure' in action.action_type:
         if 'figure' in action.parameters.keys():
             fig_file = action.parameters['figure']
             fig_file = action.scene.script.check_path(fig_file)
-            for fr in range(action.initframe, action.initframe + action.framenum):
-                os.system('{} {} -resize {}x{} {}-{}.png'.format(convert, fig_file, *action.scene.resolution,
-                                                                 action.scene.name, fr))
+            link_frames(cached_figure(action.scene.script, fig_file, action.scene.resolution),
+                        ['{}-{}.png'.format(action.scene.name, fr) for fr in
+                         range(action.initframe, action.initframe + action.framenum)])
         elif 'datafile' in action.parameters.keys():
             df = action.parameters['datafile']
             df = action.scene.script.check_path(df)
             data_simple_plot(action, df, 'spl')
-            for fr in range(action.initframe, action.initframe + action.framenum):
-                fig_file = '{}-{}.png'.format(action.scene.name, fr)
-                os.system('{} spl-{} -resize {}x{} {}'.format(convert, fig_file, *action.scene.resolution, fig_file))
+            frames = range(action.initframe, action.initframe + action.framenum)
+            resize_frames(script, ['spl-{}-{}.png'.format(action.scene.name, fr) for fr in frames],
+                          ['{}-{}.png'.format(action.scene.name, fr) for fr in frames], action.scene.resolution)
             
     if 'add_overlay' in action.action_type:
         frames = range(action.initframe, action.initframe + action.framenum)
@@ -103,16 +214,14 @@ def gen_fig(action):
             if 'figure' in action.overlays[ovl].keys():
                 fig_file = action.overlays[ovl]['figure']
                 fig_file = action.scene.script.check_path(fig_file)
-                for fr in frames:
-                    ovl_file = '{}-{}-{}.png'.format(ovl, scene, fr)
-                    os.system('{} {} -resize {}x{} {}'.format(convert, fig_file, *overlay_res, ovl_file))
+                link_frames(cached_figure(action.scene.script, fig_file, overlay_res),
+                            ['{}-{}-{}.png'.format(ovl, scene, fr) for fr in frames])
             elif 'datafile' in action.overlays[ovl].keys():
                 df = action.overlays[ovl]['datafile']
                 df = action.scene.script.check_path(df)
                 data_simple_plot(action, df, ovl)
-                for fr in frames:
-                    fig_file = '{}-{}-{}.png'.format(ovl, scene, fr)
-                    os.system('{} {} -resize {}x{} {}'.format(convert, fig_file, *overlay_res, fig_file))
+                files = ['{}-{}-{}.png'.format(ovl, scene, fr) for fr in frames]
+                resize_frames(script, files, files, overlay_res)
             elif 'text' in action.overlays[ovl].keys():
                 text = action.overlays[ovl]['text']
                 try:
@@ -124,14 +233,105 @@ def gen_fig(action):
                     arr = np.linspace(animation_frames[0], animation_frames[1], action.framenum)
                 except KeyError:
                     arr = np.arange(action.framenum)
+                commands = []
                 for fr in frames:
                     newtext = text.replace('[]', '{:.3f}').format(arr[fr-action.initframe])
                     fig_file = '{}-{}-{}.png'.format(ovl, scene, fr)
-                    os.system('{} -size {}x{} xc:transparent -font "AvantGarde-Book" -pointsize {} '
-                              '-gravity SouthWest -fill black -annotate +0+0 "{}" '
-                              '{}'.format(convert, *res, tsize, newtext, fig_file))
+                    commands.append(('{} -size {}x{} xc:transparent -font "AvantGarde-Book" -pointsize {} '
+                                     '-gravity SouthWest -fill black -annotate +0+0 "{}" '
+                                     '{}'.format(convert, *res, tsize, newtext, fig_file),))
+                run_frames(script, os.system, commands)
                 
 
+def resize_figure(source, target, resolution, backend='numpy', convert='convert'):
+    """
+    Scales an image to fit into a given resolution
+    :param source: str, path to the original image
+    :param target: str, path to the resized image (can be the same as source)
+    :param resolution: list of floats, width and height of the bounding box
+    :param backend: str, 'numpy' or 'imagemagick' (see Script.compositor)
+    :param convert: str, path to ImageMagick's convert
+    :return: None
+    """
+    if backend == 'numpy':
+        image_io.write_png(target, compositor.resize(image_io.read_png(source), *resolution))
+    else:
+        os.system('{} {} -resize {}x{} {}'.format(convert, source, *resolution, target))
+
+
+def resize_frames(script, sources, targets, resolution):
+    """
+    Scales a series of frames (e.g. plots); consecutive
+    sources that are links to the same image are resized
+    only once, and their targets linked to the result
+    :param script: Script instance, the master object controlling the movie layout
+    :param sources: list of str, paths to the original images
+    :param targets: list of str, paths to the resized images (can be the same as sources)
+    :param resolution: list of floats, width and height of the bounding box
+    :return: None
+    """
+    runs = []
+    for source, target in zip(sources, targets):
+        if runs and os.path.samefile(runs[-1][0], source):
+            runs[-1][2].append(target)
+        else:
+            runs.append((source, target, []))
+    run_frames(script, resize_figure, [(source, target, resolution, script.compositor, script.convert)
+                                       for source, target, _ in runs])
+    for _, target, repeats in runs:
+        link_frames(target, repeats)
+
+
+def cached_figure(script, source, resolution):
+    """
+    Resizes a static figure only once: the result is
+    stored in the figure cache, keyed by the content
+    hash of the source file, the target resolution and
+    the compositor, so that repeated runs reuse it too
+    :param script: Script instance, the master object controlling the movie layout
+    :param source: str, path to the original image
+    :param resolution: list of floats, width and height of the bounding box
+    :return: str, path to the resized image in the cache
+    """
+    with open(source, 'rb') as src:
+        digest = hashlib.sha1(src.read()).hexdigest()
+    cached = os.path.join(figure_cache, '{}-{}x{}-{}.png'.format(digest, *[int(round(r)) for r in resolution],
+                                                                 script.compositor))
+    if not os.path.isfile(cached):
+        os.makedirs(figure_cache, exist_ok=True)
+        partial = '{}-{}-{}.png'.format(cached[:-4], os.getpid(), threading.get_ident())
+        resize_figure(source, partial, resolution, script.compositor, script.convert)
+        if not os.path.isfile(partial):
+            raise RuntimeError('Could not resize the figure {}'.format(source))
+        os.replace(partial, cached)  # atomic, so that concurrently rendered scenes never see a partial file
+    return cached
+
+
+def link_frames(source, targets):
+    """
+    Makes a set of frame files refer to a single image,
+    using hardlinks where possible (and copies otherwise)
+    :param source: str, path to the image to be shared
+    :param targets: list of str, paths to the frame files
+    :return: None
+    """
+    for target in targets:
+        compositor.link(source, target)
+
+
+def detach(filename):
+    """
+    Gives a hardlinked frame file its own copy of
+    the data, so that it can be modified in place
+    without affecting other frames or the cache
+    :param filename: str, path to the file
+    :return: None
+    """
+    if os.path.isfile(filename) and os.stat(filename).st_nlink > 1:
+        shutil.copyfile(filename, filename + '.tmp')
+        os.replace(filename + '.tmp', filename)
+
+
 def equalize_frames(script):
     """
     If individual scenes have different frame counts,
@@ -145,11 +345,8 @@ def equalize_frames(script):
     highest = max(nframes)
     for n, nf in enumerate(nframes):
         if nf < highest:
-            for i in range(nf, highest):
-                if os.name == 'posix':
-                    os.system('cp {}-{}.png {}-{}.png'.format(names[n], nf-1, names[n], i))
-                else:
-                    os.system('copy {}-{}.png {}-{}.png'.format(names[n], nf - 1, names[n], i))
+            link_frames('{}-{}.png'.format(names[n], nf - 1), ['{}-{}.png'.format(names[n], i)
+                                                               for i in range(nf, highest)])
 
 
 def compose_overlay(action):
@@ -163,7 +360,34 @@ def compose_overlay(action):
     assert hasattr(action, 'overlays') and isinstance(action.overlays, dict)
     frames = range(action.initframe, action.initframe + action.framenum)
     scene = action.scene.name
-    res = action.scene.resolution
+    opacity = overlay_opacity(action)
+    commands = {fr: [] for fr in frames}  # overlays of a single frame are applied in order, frames in parallel
+    for ovl in action.overlays.keys():
+        origin_px = overlay_origin(action, ovl)
+        for fr, opa in zip(frames, opacity):
+            fig_file = '{}-{}-{}.png'.format(ovl, scene, fr)
+            target_fig = '{}-{}.png'.format(scene, fr)
+            detach(fig_file)
+            detach(target_fig)
+            if opa != 1:
+                commands[fr].append('{} {} -alpha set -channel a -evaluate multiply {} '
+                                    '+channel {}'.format(action.scene.script.convert, fig_file, opa, fig_file))
+            commands[fr].append('{} -gravity SouthWest -compose atop -geometry +{}+{} '
+                                '{} {} {}'.format(action.scene.script.compose, *origin_px, fig_file, target_fig,
+                                                  target_fig))
+    print('composing overlays for frames {}-{} of scene {}'.format(action.initframe, action.initframe +
+                                                                  action.framenum - 1, scene))
+    run_frames(action.scene.script, run_commands, [(commands[fr],) for fr in frames])
+
+
+def overlay_opacity(action):
+    """
+    Per-frame opacity of the overlays of an action,
+    with a sigmoid fade-in and fade-out if requested
+    :param action: Action or SimultaneousAction, object to extract data from
+    :return: numpy.array, opacity values, one per frame
+    """
+    import numpy as np
     try:
         sigmoid = action.parameters['sigmoid']
     except KeyError:
@@ -177,21 +401,22 @@ def compose_overlay(action):
         opacity = np.concatenate((sgm, np.ones(action.framenum - 2 * sgm_frames), sgm[::-1]))
     else:
         opacity = np.ones(action.framenum)
-    for ovl in action.overlays.keys():
-        try:
-            origin_frac = [float(x) for x in action.overlays[ovl]['origin'].split(',')]
-        except KeyError:
-            origin_frac = [0, 0]
-        origin_px = [int(r*o) for r, o in zip(res, origin_frac)]
-        for fr, opa in zip(frames, opacity):
-            print('composing frame {}'.format(fr))
-            fig_file = '{}-{}-{}.png'.format(ovl, scene, fr)
-            target_fig = '{}-{}.png'.format(scene, fr)
-            if opa != 1:
-                os.system('{} {} -alpha set -channel a -evaluate multiply {} '
-                          '+channel {}'.format(action.scene.script.convert, fig_file, opa, fig_file))
-            os.system('{} -gravity SouthWest -compose atop -geometry +{}+{} '
-                      '{} {} {}'.format(action.scene.script.compose, *origin_px, fig_file, target_fig, target_fig))
+    return opacity
+
+
+def overlay_origin(action, ovl):
+    """
+    Position of the bottom left corner of an overlay,
+    in pixels from the bottom left corner of the scene
+    :param action: Action or SimultaneousAction, object to extract data from
+    :param ovl: str, overlay key (e.g. 'overlay0')
+    :return: list of ints, (x, y) offset in pixels
+    """
+    try:
+        origin_frac = [float(x) for x in action.overlays[ovl]['origin'].split(',')]
+    except KeyError:
+        origin_frac = [0, 0]
+    return [int(r*o) for r, o in zip(action.scene.resolution, origin_frac)]
 
 
 def data_simple_plot(action, datafile, basename):
@@ -199,23 +424,77 @@ def data_simple_plot(action, datafile, basename):
     Creates a set of simple 1D line plots
     based on a provided data file
     to e.g. accompany the display of an
-    animated trajectory
+    animated trajectory; the static part of the
+    plot is rendered only once per worker, and for
+    each frame only the moving marker is blitted onto
+    a copy of the background
     :param action: Action or SimultaneousAction, object to extract data from
     :param datafile: str, file containing the data to be plotted
     :param basename: str, base name of the image to be produced (e.g. 'overlay1')
     :return: None
     """
-    import matplotlib.pyplot as plt
-    font = {'size': 18}
-    plt.rc('font', **font)
-    plt.rc('axes', linewidth=2)
+    import numpy as np
     res = action.scene.resolution
+    options = getattr(action, 'overlays', {}).get(basename, action.parameters)  # show_figure uses parameters
     try:
         asp_ratio = float(action.parameters['aspect_ratio'])
     except KeyError:
         asp_ratio = res[0]/res[1]
-    plt.rcParams['figure.figsize'] = [4.8 * asp_ratio, 4.8]
     draw_point = True
+    data, labels, mpl_kw = read_datafile(datafile)
+    if 'xlim' not in mpl_kw.keys():
+        xmin, xmax = np.min(data[:, 0]), np.max(data[:, 0])
+    else:
+        xmin, xmax = mpl_kw['xlim']
+    if 'ylim' not in mpl_kw.keys():
+        ymin, ymax = np.min(data[:, 1]), np.max(data[:, 1])
+    else:
+        ymin, ymax = mpl_kw['ylim']
+    try:
+        animation_frames = [int(x) for x in options['dataframes'].split(':')]
+        arr = np.linspace(animation_frames[0], animation_frames[1], action.framenum).astype(int)
+    except KeyError:
+        try:
+            animation_frames = [int(x) for x in action.parameters['frames'].split(':')]
+            arr = np.linspace(animation_frames[0], animation_frames[1], action.framenum).astype(int)
+        except (KeyError, AttributeError):
+            draw_point = False
+    spec = {'data': data, 'labels': labels, 'mpl_kw': mpl_kw, 'asp_ratio': asp_ratio,
+            'limits': (xmin, xmax, ymin, ymax),
+            'hexbin': '2D' in options.keys() and options['2D'].lower() in ['t', 'y', 'true', 'yes']}
+    files = ['{}-{}-{}.png'.format(basename, action.scene.name, fr)
+             for fr in range(action.initframe, action.initframe + action.framenum)]
+    if not draw_point:  # all frames are identical, encode once and link the rest
+        render_plot(spec, files[:1], [None])
+        link_frames(files[0], files[1:])
+        return
+    # consecutive frames that mark the same data point are only drawn once
+    unique = [count for count in range(action.framenum) if count == 0 or arr[count] != arr[count - 1]]
+    points = [data[arr[count]] for count in unique]
+    # starting a worker costs roughly as much as blitting a few dozen frames, so chunks are not too small
+    chunks = np.array_split(np.arange(len(unique)), min(action.scene.script.jobs, -(-len(unique) // 20)))
+    run_frames(action.scene.script, render_plot, [(spec, [files[unique[i]] for i in chunk],
+                                                   [points[i] for i in chunk]) for chunk in chunks if len(chunk)])
+    for n, count in enumerate(unique):
+        link_frames(files[count], files[count + 1:unique[n + 1] if n + 1 < len(unique) else action.framenum])
+
+
+def read_datafile(datafile):
+    """
+    Reads the data points, axis labels ('#' line) and
+    matplotlib keywords ('!' line) of a data file; the
+    result is kept in memory (keyed by path, size and
+    modification time), so that movies rendered by the
+    same process only parse each file once
+    :param datafile: str, file containing the data to be plotted
+    :return: tuple, (numpy.array of shape (N, 2), list of str, dict)
+    """
+    import numpy as np
+    stat = os.stat(datafile)
+    key = (os.path.abspath(datafile), stat.st_size, stat.st_mtime)
+    with datafiles_lock:
+        if key in datafiles:
+            return datafiles[key]
     data = np.loadtxt(datafile, comments=['!', '#'])
     assert data.shape[1] == 2
     try:
@@ -235,42 +514,56 @@ def data_simple_plot(action, datafile, basename):
                 mpl_kw[kw] = eval(mpl_kw[kw])
             except NameError:
                 pass
-    if 'xlim' not in mpl_kw.keys():
-        xmin, xmax = np.min(data[:, 0]), np.max(data[:, 0])
-    else:
-        xmin, xmax = mpl_kw['xlim']
-    if 'ylim' not in mpl_kw.keys():
-        ymin, ymax = np.min(data[:, 1]), np.max(data[:, 1])
-    else:
-        ymin, ymax = mpl_kw['ylim']
-    try:
-        animation_frames = [int(x) for x in action.overlays[basename]['dataframes'].split(':')]
-        arr = np.linspace(animation_frames[0], animation_frames[1], action.framenum).astype(int)
-    except KeyError:
-        try:
-            animation_frames = [int(x) for x in action.parameters['frames'].split(':')]
-            arr = np.linspace(animation_frames[0], animation_frames[1], action.framenum).astype(int)
-        except (KeyError, AttributeError):
-            draw_point = False
-    for fr in range(action.initframe, action.initframe + action.framenum):
-        count = fr - action.initframe
-        if '2D' in action.overlays[basename].keys() and action.overlays[basename]['2D'].lower() in ['t', 'y',
-                                                                                                    'true', 'yes']:
+    with datafiles_lock:
+        if len(datafiles) >= 64:  # the oldest entry goes, so that long-lived processes do not grow without bound
+            datafiles.pop(next(iter(datafiles)))
+        datafiles[key] = (data, labels, mpl_kw)
+    return data, labels, mpl_kw
+
+
+def render_plot(spec, files, points):
+    """
+    Renders the frames of a simple plot: the static
+    part is drawn once, and then for each frame the
+    marker is blitted onto a copy of the background;
+    rc settings are only applied within this function,
+    so that each worker process has its own state
+    :param spec: dict, data and plot settings prepared by data_simple_plot
+    :param files: list of str, names of the frame files to be written
+    :param points: list, (x, y) position of the marker for each frame (or None if no marker is drawn)
+    :return: None
+    """
+    import numpy as np
+    import matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    data, mpl_kw, asp_ratio = spec['data'], dict(spec['mpl_kw']), spec['asp_ratio']
+    xmin, xmax, ymin, ymax = spec['limits']
+    with plot_lock, matplotlib.rc_context({'font.size': 18, 'axes.linewidth': 2}):
+        fig = Figure(figsize=[4.8 * asp_ratio, 4.8])
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        if spec['hexbin']:
             grid_x = int(np.sqrt(len(data) * asp_ratio) / 2)
             grid_y = int(grid_x / asp_ratio)
             if 'gridsize' not in mpl_kw.keys():
                 mpl_kw.update({'gridsize': (grid_x, grid_y)})
-            plt.hexbin(*data.T, zorder=0, **mpl_kw)
+            ax.hexbin(*data.T, zorder=0, **mpl_kw)
         else:
             if 'lw' not in mpl_kw.keys() and 'linewidth' not in mpl_kw.keys():
                 mpl_kw.update({'lw': 3})
-            plt.plot(*data.T, zorder=0, **mpl_kw)
-            plt.xlim(1.1 * xmin, 1.1 * xmax)
-            plt.ylim(1.1 * ymin, 1.1 * ymax)
-        if draw_point:
-            plt.scatter(data[arr[count], 0], data[arr[count], 1], c='r', s=250, zorder=1)
-        plt.xlabel(labels[0])
-        plt.ylabel(labels[1])
-        plt.subplots_adjust(left=0.22, right=0.97, top=0.97, bottom=0.18)
-        plt.savefig('{}-{}-{}.png'.format(basename, action.scene.name, fr))
-        plt.clf()
+            ax.plot(*data.T, zorder=0, **mpl_kw)
+            ax.set_xlim(1.1 * xmin, 1.1 * xmax)
+            ax.set_ylim(1.1 * ymin, 1.1 * ymax)
+        ax.set_xlabel(spec['labels'][0])
+        ax.set_ylabel(spec['labels'][1])
+        fig.subplots_adjust(left=0.22, right=0.97, top=0.97, bottom=0.18)
+        marker = ax.scatter([], [], c='r', s=250, zorder=1, animated=True)  # excluded from the background
+        canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    for fig_file, point in zip(files, points):
+        canvas.restore_region(background)
+        if point is not None:
+            marker.set_offsets([point])
+            ax.draw_artist(marker)
+        image_io.write_png(fig_file, np.asarray(canvas.buffer_rgba()))
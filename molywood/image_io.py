@@ -0,0 +1,126 @@
+import os
+import struct
+import zlib
+
+
+def read_tga(filename):
+    """
+    Decodes a true-color or grayscale TGA file (as written
+    by Tachyon or VMD's snapshot renderer), either
+    uncompressed or run-length encoded
+    :param filename: str, path to the .tga file
+    :return: numpy.array, uint8 array of shape (height, width, channels), RGB(A) order
+    """
+    import numpy as np
+    with open(filename, 'rb') as tga:
+        data = tga.read()
+    idlength, cmaptype, imgtype = data[0], data[1], data[2]
+    width, height, depth, descriptor = struct.unpack('<HHBB', data[12:18])
+    if cmaptype != 0 or imgtype not in [2, 3, 10, 11]:
+        raise RuntimeError('{} is not a true-color or grayscale TGA file'.format(filename))
+    channels = depth // 8
+    offset = 18 + idlength
+    npix = width * height
+    if imgtype in [2, 3]:
+        pixels = np.frombuffer(data, dtype=np.uint8, count=npix * channels, offset=offset)
+    else:
+        pixels = np.empty(npix * channels, dtype=np.uint8)
+        pos, filled = offset, 0
+        while filled < npix:
+            count = (data[pos] & 0x7f) + 1
+            if data[pos] & 0x80:  # run-length packet: one pixel repeated count times
+                pixels[filled*channels:(filled+count)*channels] = np.tile(np.frombuffer(data, np.uint8, channels,
+                                                                                        pos + 1), count)
+                pos += 1 + channels
+            else:  # raw packet: count literal pixels
+                pixels[filled*channels:(filled+count)*channels] = np.frombuffer(data, np.uint8, count * channels,
+                                                                                pos + 1)
+                pos += 1 + count * channels
+            filled += count
+    image = pixels.reshape(height, width, channels)
+    if channels >= 3:
+        image = image[:, :, [2, 1, 0] + ([3] if channels == 4 else [])]  # BGR(A) to RGB(A)
+    if not descriptor & 0x20:  # bottom-left origin, the default one
+        image = image[::-1]
+    return np.ascontiguousarray(image)
+
+
+def write_png(filename, image, compression=6):
+    """
+    Encodes an 8-bit grayscale, RGB or RGBA array as PNG
+    (unfiltered scanlines, so that encoding is a single
+    zlib pass with no per-pixel Python overhead); the file
+    is replaced rather than overwritten in place
+    :param filename: str, path to the output .png file
+    :param image: numpy.array, uint8 array of shape (height, width) or (height, width, 1/3/4)
+    :param compression: int, zlib compression level (0-9)
+    :return: None
+    """
+    import numpy as np
+    image = np.asarray(image, dtype=np.uint8)
+    if image.ndim == 2:
+        image = image[:, :, None]
+    height, width, channels = image.shape
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+    raw = np.zeros((height, width * channels + 1), dtype=np.uint8)  # leading 0 = filter type None
+    raw[:, 1:] = image.reshape(height, width * channels)
+
+    def chunk(tag, payload):
+        return struct.pack('>I', len(payload)) + tag + payload + struct.pack('>I', zlib.crc32(tag + payload))
+
+    partial = filename + '.part'
+    with open(partial, 'wb') as png:
+        png.write(b'\x89PNG\r\n\x1a\n')
+        png.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)))
+        png.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), compression)))
+        png.write(chunk(b'IEND', b''))
+    os.replace(partial, filename)  # never writes through a hardlink shared with other frames
+
+
+def read_png(filename):
+    """
+    Decodes a PNG file using matplotlib's reader
+    :param filename: str, path to the .png file
+    :return: numpy.array, uint8 array of shape (height, width, channels)
+    """
+    import numpy as np
+    import matplotlib.image
+    image = matplotlib.image.imread(filename)
+    if image.dtype != np.uint8:
+        image = (image * 255 + 0.5).astype(np.uint8)
+    if image.ndim == 2:
+        image = image[:, :, None]
+    return image
+
+
+def read_image(filename):
+    """
+    Decodes an image, choosing the decoder
+    based on the file extension
+    :param filename: str, path to the .tga or .png file
+    :return: numpy.array, uint8 array of shape (height, width, channels)
+    """
+    if filename.lower().endswith('.tga'):
+        return read_tga(filename)
+    else:
+        return read_png(filename)
+
+
+def to_rgb(image, background=255):
+    """
+    Converts a grayscale or RGBA array to plain RGB,
+    flattening transparency onto a uniform background
+    :param image: numpy.array, uint8 array of shape (height, width, channels)
+    :param background: int, gray level of the background (255 is white)
+    :return: numpy.array, uint8 array of shape (height, width, 3)
+    """
+    import numpy as np
+    if image.ndim == 2:
+        image = image[:, :, None]
+    if image.shape[2] in [2, 4]:
+        alpha = image[:, :, -1:].astype(np.float32) / 255
+        color = image[:, :, :-1].astype(np.float32)
+        image = (color * alpha + background * (1 - alpha) + 0.5).astype(np.uint8)
+    if image.shape[2] == 1:
+        image = np.repeat(image, 3, axis=2)
+    return image
@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+
+if __package__:
+    from . import frame_cache
+else:
+    import frame_cache
+
+FIGURE_ACTIONS = {'show_figure', 'add_overlay'}
+
+
+def describe(script):
+    """
+    Summarizes the parsed script: global directives,
+    and for each scene its directives and actions
+    (with their frame ranges and parameters, also those
+    of each sub-action of simultaneous actions)
+    :param script: Script instance, the master object controlling the movie layout
+    :return: dict, JSON-serializable description
+    """
+    scenes = {}
+    for scene in script.scenes:
+        scenes[scene.name] = {'directives': script.directives.get(scene.name, {}),
+                              'total_frames': scene.total_frames,
+                              'actions': [dict({kind: getattr(action, kind, {}) for kind in frame_cache.SUB_ACTIONS},
+                                               action_type=sorted(action.action_type), parameters=action.parameters,
+                                               initframe=action.initframe, framenum=action.framenum)
+                                          for action in scene.actions]}
+    return {'global': {k: v for k, v in script.directives.items() if k in script.allowed_globals},
+            'scenes': scenes}
+
+
+def scene_fingerprints(script, scene):
+    """
+    Fingerprints of all frames of a scene, i.e. hashes
+    of everything that determines how a given frame
+    looks before composition: the rendered molecular
+    view (same as the frame cache key) and the figures,
+    plots or overlays shown in that frame
+    :param script: Script instance, the master object controlling the movie layout
+    :param scene: Scene instance, the scene to be described
+    :return: list of str, one hex digest per frame
+    """
+    cache = script.frame_cache
+    scene.tcl()  # sets up scene.keyframes and scene.run_vmd
+    if scene.run_vmd and scene.stateless:
+        rendered = cache.frame_keys(scene)
+    elif scene.run_vmd:  # fit_trajectory depends on history, so all actions up to the frame matter
+        inputs = cache.scene_inputs(scene)
+        rendered = [repr((inputs, tuple(scene.resolution), fr, [frame_cache.action_parameters(ac, ignore=())
+                                                               for ac in scene.actions if ac.initframe <= fr]))
+                    for fr in range(scene.total_frames)]
+    else:
+        rendered = [None] * scene.total_frames
+    fingerprints = []
+    for fr in range(scene.total_frames):
+        figures = []
+        for action in scene.actions:
+            if set(action.action_type).intersection(FIGURE_ACTIONS) and \
+                    action.initframe <= fr < action.initframe + action.framenum:
+                options = [action.parameters] + list(getattr(action, 'overlays', {}).values())
+                files = [opt[key] for opt in options for key in ['figure', 'datafile'] if key in opt]
+                figures.append((sorted(action.action_type), repr(options), action.initframe, action.framenum,
+                                [cache.file_digest(script.check_path(f)) for f in files]))
+        fingerprints.append(hashlib.sha1(repr((rendered[fr], tuple(scene.resolution),
+                                               figures)).encode()).hexdigest())
+    return fingerprints
+
+
+def movie_fingerprints(script, layout, fingerprints):
+    """
+    Fingerprints of the final (composed) movie frames
+    :param script: Script instance, the master object controlling the movie layout
+    :param layout: list of lists of scene names ('' for empty cells)
+    :param fingerprints: dict, scene_name: list of per-frame fingerprints
+    :return: list of str, one hex digest per movie frame
+    """
+    nframes = max(len(fps) for fps in fingerprints.values())
+    return [hashlib.sha1(repr((layout, script.compositor,
+                               [[fingerprints[name][min(fr, len(fingerprints[name]) - 1)] if name else None
+                                 for name in row] for row in layout])).encode()).hexdigest()
+            for fr in range(nframes)]
+
+
+def frame_ranges(frames):
+    """
+    Formats a sorted list of frames as ranges,
+    e.g. [0, 1, 2, 5] -> '0-2, 5'
+    :param frames: list of ints
+    :return: str
+    """
+    ranges = []
+    for fr in frames:
+        if ranges and ranges[-1][1] == fr - 1:
+            ranges[-1][1] = fr
+        else:
+            ranges.append([fr, fr])
+    return ', '.join(str(a) if a == b else '{}-{}'.format(a, b) for a, b in ranges)
+
+
+def plan(script, layout, manifest_file):
+    """
+    Compares the current script with the manifest left
+    by the previous run, and works out which movie frames
+    have to be composed again, and which scene frames
+    are needed to compose them
+    :param script: Script instance, the master object controlling the movie layout
+    :param layout: list of lists of scene names ('' for empty cells)
+    :param manifest_file: str, path to the manifest of the previous run
+    :return: tuple, (sorted list of dirty movie frames, dict scene_name: sorted list of needed scene frames,
+             the new manifest)
+    """
+    try:
+        with open(manifest_file) as manifest:
+            previous = json.load(manifest)
+    except (OSError, ValueError):
+        previous = {}
+    fingerprints = {scene.name: scene_fingerprints(script, scene) for scene in script.scenes}
+    frames = movie_fingerprints(script, layout, fingerprints)
+    old_frames = previous.get('frames', [])
+    dirty = [fr for fr in range(len(frames)) if fr >= len(old_frames) or old_frames[fr] != frames[fr]
+             or not os.path.isfile('{}-{}.png'.format(script.name, fr))]
+    needed = scene_frames(script, dirty)
+    old_scenes = previous.get('scenes', {})
+    new_manifest = dict(describe(script), frames=frames)
+    for name, scene in new_manifest['scenes'].items():
+        changed = [n for n, action in enumerate(scene['actions'])
+                   if name not in old_scenes or n >= len(old_scenes[name]['actions'])
+                   or json.dumps(old_scenes[name]['actions'][n], sort_keys=True, default=str)
+                   != json.dumps(action, sort_keys=True, default=str)]
+        if changed and name in old_scenes:
+            print('Scene {}: actions {} changed since the previous run'.format(name, ', '.join(str(n + 1)
+                                                                                              for n in changed)))
+    if previous:
+        print('Incremental mode: {} of {} frames have to be composed again{}'.format(
+            len(dirty), len(frames), ' ({})'.format(frame_ranges(dirty)) if dirty else ''))
+    return dirty, needed, new_manifest
+
+
+def scene_frames(script, frames):
+    """
+    Finds the scene frames needed to compose a set
+    of movie frames (shorter scenes repeat their last frame)
+    :param script: Script instance, the master object controlling the movie layout
+    :param frames: list of ints, movie frames
+    :return: dict, scene_name: sorted list of scene frames
+    """
+    return {scene.name: sorted({min(fr, scene.total_frames - 1) for fr in frames}) if scene.total_frames else []
+            for scene in script.scenes}
+
+
+def save(manifest, manifest_file):
+    """
+    Writes the manifest describing the current run
+    :param manifest: dict, as returned by plan
+    :param manifest_file: str, path to the manifest
+    :return: None
+    """
+    os.makedirs(os.path.dirname(manifest_file) or '.', exist_ok=True)
+    with open(manifest_file + '.part', 'w') as out:
+        json.dump(manifest, out, default=str)
+    os.replace(manifest_file + '.part', manifest_file)
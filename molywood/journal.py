@@ -0,0 +1,127 @@
+import os
+import json
+import threading
+
+SYNC_EVERY = 64  # entries are flushed right away, but only synced to disk in batches
+
+
+class Journal:
+    """
+    Append-only record of completed frames, per stage
+    ('render' for scene frames, 'compose' for movie frames)
+    and per scene, kept next to the movie so that an
+    interrupted job can be resumed; each entry stores
+    the size and modification time of the frame file,
+    so that files that were truncated or changed since
+    are not trusted
+    """
+    def __init__(self, filename):
+        """
+        :param filename: str, path to the journal file
+        """
+        self.filename = filename
+        self.valid = {}  # (stage, name): set of frames whose files match the journal
+        self._file = None
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+    def start(self, signature, resume=False):
+        """
+        Opens the journal: when resuming, entries left by
+        the interrupted run are validated and kept, otherwise
+        a new journal is started
+        :param signature: str, identifies the script, so that journals of other scripts are rejected
+        :param resume: bool, whether to continue an earlier run
+        :return: None
+        """
+        if resume and os.path.isfile(self.filename):
+            self.load(signature)
+            self._file = open(self.filename, 'a')
+        else:
+            if resume:
+                print('No journal ({}) was found, starting from scratch'.format(self.filename))
+            self._file = open(self.filename, 'w')
+            self.write({'script': signature})
+
+    def load(self, signature):
+        """
+        Reads an existing journal and checks every
+        recorded frame file by its size and modification time
+        :param signature: str, identifies the script
+        :return: None
+        """
+        entries = []
+        with open(self.filename) as journal:
+            for line in journal:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:  # the last line may be incomplete if the job was killed
+                    break
+        if not entries or entries[0].get('script') != signature:
+            raise RuntimeError('The journal {} was written for a different version of the script; run without '
+                               '--resume (or with --incremental) instead'.format(self.filename))
+        with open(self.filename + '.part', 'w') as journal:  # drops the incomplete line before appending
+            journal.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        os.replace(self.filename + '.part', self.filename)
+        for entry in entries[1:]:
+            frames = self.valid.setdefault((entry['stage'], entry['name']), set())
+            if os.path.isfile(entry['file']) and file_stamp(entry['file']) == (entry['size'], entry['mtime']):
+                frames.add(entry['frame'])
+            else:
+                frames.discard(entry['frame'])
+        for (stage, name), frames in sorted(self.valid.items()):
+            print('Resuming: {} {} frames of {} were completed by the interrupted run'.format(len(frames), stage,
+                                                                                              name))
+
+    def completed(self, stage, name):
+        """
+        :param stage: str, 'render' or 'compose'
+        :param name: str, name of the scene (or of the movie for 'compose')
+        :return: set of ints, frames that do not have to be produced again
+        """
+        return self.valid.get((stage, name), set())
+
+    def record(self, stage, name, frame, filename):
+        """
+        Adds a completed frame to the journal
+        :param stage: str, 'render' or 'compose'
+        :param name: str, name of the scene (or of the movie for 'compose')
+        :param frame: int, frame number
+        :param filename: str, path to the frame file
+        :return: None
+        """
+        size, mtime = file_stamp(filename)
+        self.write({'stage': stage, 'name': name, 'frame': frame, 'file': filename, 'size': size, 'mtime': mtime})
+
+    def write(self, entry):
+        """
+        Appends an entry; it is flushed at once (so it survives
+        the job being killed), while the costly fsync that also
+        protects it against a crash of the machine is only done
+        once per SYNC_EVERY entries
+        :param entry: dict, JSON-serializable
+        :return: None
+        """
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= SYNC_EVERY or 'script' in entry:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def close(self):
+        """
+        Removes the journal once the movie is complete
+        :return: None
+        """
+        if self._file:
+            self._file.close()
+            self._file = None
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+
+def file_stamp(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
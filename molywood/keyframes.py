@@ -0,0 +1,160 @@
+if __package__:
+    from . import tcl_actions
+else:
+    import tcl_actions
+
+
+class FrameState:
+    """
+    Absolute state of a scene at a single frame:
+    camera rotation and scale (relative to the initial
+    view), material opacities, trajectory frame,
+    smoothing, the set of labels and fitting progress;
+    does not depend on the way the frame was reached
+    """
+    def __init__(self):
+        import numpy as np
+        self.rotation = np.identity(4)
+        self.scale = 1.0
+        self.center = None  # selection defining the center of the view (center_view)
+        self.opacities = {}  # material (or highlight material variable): opacity
+        self.traj_frame = None
+        self.smooth = None
+        self.labels = ()  # (label type, alias) pairs
+        self.fit = None  # (selection, axis, fraction of the fit already applied)
+
+    def copy(self):
+        new = FrameState()
+        new.rotation = self.rotation.copy()
+        new.scale = self.scale
+        new.center = self.center
+        new.opacities = dict(self.opacities)
+        new.traj_frame = self.traj_frame
+        new.smooth = self.smooth
+        new.labels = self.labels
+        new.fit = self.fit
+        return new
+
+    def key(self, precision=6):
+        """
+        A hashable representation of the state, rounded
+        to a given precision, so that identical frames
+        can be identified
+        :param precision: int, number of decimal places to keep
+        :return: tuple
+        """
+        import numpy as np
+        fit = None if self.fit is None else (self.fit[0], self.fit[1], round(self.fit[2], precision))
+        return (tuple(np.round(self.rotation, precision).ravel()), round(self.scale, precision), self.center,
+                tuple(sorted((k, round(v, precision)) for k, v in self.opacities.items())),
+                self.traj_frame, self.smooth, self.labels, fit)
+
+    def __eq__(self, other):
+        return isinstance(other, FrameState) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+def rotation_matrix(axis, angle):
+    """
+    4x4 matrix of a rotation about one of the screen
+    axes, consistent with VMD's 'rotate x/y/z by ...'
+    :param axis: str, 'x', 'y' or 'z'
+    :param angle: float, angle in degrees
+    :return: numpy.array, the 4x4 rotation matrix
+    """
+    import numpy as np
+    axis = axis.lower()
+    if axis not in ['x', 'y', 'z']:
+        raise RuntimeError("'axis' must be either 'x', 'y' or 'z', {} was given instead".format(axis))
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    i, j = {'x': (1, 2), 'y': (2, 0), 'z': (0, 1)}[axis]
+    mat = np.identity(4)
+    mat[i, i], mat[i, j], mat[j, i], mat[j, j] = c, -s, s, c
+    return mat
+
+
+def compute_keyframes(scene):
+    """
+    Goes through all actions of a scene and calculates
+    the absolute state for every frame index; as a side
+    effect, the state right after the instantaneous part
+    of each action is stored as action.setup_state
+    :param scene: Scene, the scene to be described
+    :return: list of FrameState instances, one per frame
+    """
+    states = []
+    state = FrameState()
+    for action in scene.actions:
+        arrays = tcl_actions.gen_arrays(action)
+        apply_setup(action, state)
+        action.setup_state = state.copy()
+        for i in range(action.framenum):
+            apply_frame(action, arrays, i, state)
+            states.append(state.copy())
+    return states
+
+
+def apply_setup(action, state):
+    """
+    Modifies the state according to the instantaneous
+    (setup) part of an action, mirroring tcl_actions.gen_setup
+    :param action: Action or SimultaneousAction, object to extract info from
+    :param state: FrameState, the state to be modified in place
+    :return: None
+    """
+    if 'center_view' in action.action_type:
+        state.center = action.parameters.get('selection')
+    if 'animate' in action.action_type and 'smooth' in action.parameters.keys():
+        state.smooth = int(action.parameters['smooth'])
+    for action_type, lab_type in [('add_label', 'Atoms'), ('add_distance', 'Bonds')]:
+        if action_type in action.action_type:
+            current = [lb for lb in state.labels if lb[0] == lab_type]
+            alias = action.parameters.get('alias', 'label{}'.format(len(current) + 1))
+            state.labels = state.labels + ((lab_type, alias),)
+    for action_type, lab_type in [('remove_label', 'Atoms'), ('remove_distance', 'Bonds')]:
+        if action_type in action.action_type:
+            if 'alias' in action.parameters.keys():
+                state.labels = tuple(lb for lb in state.labels if lb != (lab_type, action.parameters['alias']))
+            else:
+                state.labels = tuple(lb for lb in state.labels if lb[0] != lab_type)
+    if action.framenum == 0:
+        if 'rotate' in action.action_type:
+            tcl_actions.check_if_convertible(action.parameters['angle'], float, 'angle')
+            rot = rotation_matrix(action.parameters['axis'], float(action.parameters['angle']))
+            state.rotation = rot.dot(state.rotation)
+        if 'zoom_in' in action.action_type or 'zoom_out' in action.action_type:
+            tcl_actions.check_if_convertible(action.parameters['scale'], float, 'scale')
+            scale = float(action.parameters['scale'])
+            state.scale *= scale if 'zoom_in' in action.action_type else 1/scale
+        if 'fit_trajectory' in action.action_type:
+            state.fit = (action.parameters['selection'], action.parameters.get('axis'), 1.0)
+
+
+def apply_frame(action, arrays, index, state):
+    """
+    Modifies the state according to the per-frame
+    part of an action, mirroring tcl_actions.gen_command
+    :param action: Action or SimultaneousAction, object to extract info from
+    :param arrays: dict, per-frame values as returned by tcl_actions.gen_arrays
+    :param index: int, frame index counted from the beginning of the action
+    :param state: FrameState, the state to be modified in place
+    :return: None
+    """
+    for rkey in action.rots.keys():
+        if rkey in arrays.keys():
+            state.rotation = rotation_matrix(action.rots[rkey]['axis'], arrays[rkey][index]).dot(state.rotation)
+    for zkey in ['zin', 'zou']:
+        if zkey in arrays.keys():
+            state.scale *= arrays[zkey][index]
+    for t_ch in action.transp_changes.keys():
+        state.opacities[action.transp_changes[t_ch]['material']] = float(arrays[t_ch][index])
+    for lb in action.highlights.keys():
+        state.opacities['$mat{}'.format(lb)] = float(arrays[lb][index])
+    if 'ani' in arrays.keys():
+        state.traj_frame = int(arrays['ani'][index])
+    if 'ftr' in arrays.keys():
+        previous = state.fit[2] if index > 0 else 0.0
+        fraction = 1 - (1 - previous) * (1 - arrays['ftr'][index])
+        state.fit = (action.parameters['selection'], action.parameters.get('axis'), float(fraction))
@@ -1,13 +1,80 @@
 import sys
-from subprocess import call
+import json
+import hashlib
+import importlib.util
+from subprocess import call, Popen
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import os
 
-if __name__ == "__main__":
+if __package__:
+    from . import tcl_actions
+    from . import graphics_actions
+    from . import keyframes
+    from . import render_queue
+    from . import encoder
+    from . import frame_cache
+    from . import incremental
+    from . import image_io
+    from . import journal
+    from . import trajectory
+    from . import vmd_pool
+    from . import tracing
+    from . import planner
+else:
     import tcl_actions
     import graphics_actions
-else:
-    import pyvmd_movies.tcl_actions as tcl_actions
-    import pyvmd_movies.graphics_actions as graphics_actions
+    import keyframes
+    import render_queue
+    import encoder
+    import frame_cache
+    import incremental
+    import image_io
+    import journal
+    import trajectory
+    import vmd_pool
+    import tracing
+    import planner
+
+
+TOOLS = os.path.join(os.path.expanduser('~'), '.molywood_cache', 'tools.json')
+
+
+def windows_tools():
+    """
+    Looks for VMD (and the Tachyon executable shipped
+    with it) in the Program Files directories, and checks
+    that ffmpeg and ImageMagick are on the system path;
+    the result is stored in TOOLS and reused by later
+    runs for as long as the executables still exist
+    :return: dict, paths to 'vmd' and 'tachyon' (None if not found)
+    """
+    try:
+        with open(TOOLS) as cache:
+            tools = json.load(cache)
+        if os.path.isfile(tools['vmd']) and (tools['tachyon'] is None or os.path.isfile(tools['tachyon'])):
+            return tools
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    import pathlib
+    tools = {'vmd': None, 'tachyon': None}
+    for pfiles in [x for x in os.listdir('C:\\') if x.startswith('Program Files')]:
+        for file in pathlib.Path('C:\\{}'.format(pfiles)).glob('**/vmd.exe'):
+            tools['vmd'] = str(file)
+    if not tools['vmd']:
+        raise RuntimeError("VMD was not found in any of the Program Files directories, check your installation")
+    tachyons = list(pathlib.Path(tools['vmd']).parent.glob('**/tachyon*.exe'))
+    tools['tachyon'] = str(tachyons[0]) if tachyons else None
+    if call('where ffmpeg') != 0:
+        raise RuntimeError('ffmpeg not found, please make sure it was added to the system path during '
+                           'installation (see README)')
+    if call('where magick') != 0:
+        raise RuntimeError('imagemagick not found, please make sure it was added to the system path during '
+                           'installation (see README)')
+    os.makedirs(os.path.dirname(TOOLS), exist_ok=True)
+    with open(TOOLS, 'w') as cache:
+        json.dump(tools, cache)
+    return tools
 
 
 class Script:
@@ -17,19 +84,34 @@ class Script:
     panels, overlays etc.)
     """
     allowed_globals = ['global', 'layout']
-    allowed_params = {'global': ['fps', 'keepframes', 'draft', 'name', 'render'],
+    allowed_params = {'global': ['fps', 'keepframes', 'draft', 'name', 'render', 'workers',
+                                 'tachyon_jobs', 'tachyon_threads', 'stream', 'compositor', 'jobs',
+                                 'cache', 'cache_size', 'vmd_pool', 'trace'],
                       'layout': ['columns', 'rows'],
                       '_default': ['visualization', 'structure', 'trajectory', 'position', 'resolution', 'pdb_code']}
     
     def __init__(self, scriptfile=None):
         self.name = 'movie'
         self.scenes = []
+        # scene names become allowed directives of this script only, the class-level lists are the defaults
+        self.allowed_globals = list(Script.allowed_globals)
+        self.allowed_params = dict(Script.allowed_params)
         self.directives = {}
         self.fps = 20
+        self.workers = 1
+        self.jobs = os.cpu_count() or 1
+        self.tachyon_jobs, self.tachyon_threads = 0, None
         self.draft, self.do_render, self.keepframes = False, True, False
+        self.stream, self.encoder = False, None
+        self.compositor = 'numpy'
+        self.cache, self.cache_size, self.frame_cache = False, 2048, None
+        self.incremental, self.dirty_frames, self.needed_frames = False, None, None
+        self.resume, self.journal = False, None
+        self.use_pool, self.vmd_pool = False, None
+        self.trace, self.tracer = False, None
+        self.precompute_dir = None  # where arrays precomputed for the scenes are stored, set once rendering starts
         self.scriptfile = scriptfile
-        self.vmd, self.remove, self.compose, self.convert = 4 * [None]
-        self.setup_os_commands()
+        self.vmd, self.remove, self.compose, self.convert, self.tachyon, self.ffmpeg = 6 * [None]
         if self.scriptfile:
             self.from_file()
 
@@ -40,61 +122,428 @@ class Script:
         ffmpeg to assemble the movie frame by frame)
         :return: None
         """
-        # the part below controls TCL/VMD rendering
-        for scene in self.scenes:
-            tcl_script = scene.tcl()  # this generates the TCL code, below we save it as a script and run VMD
-            if scene.run_vmd:
-                with open('script_{}.tcl'.format(scene.name), 'w') as out:
-                    out.write(tcl_script)
-                ddev = '-dispdev none' if not self.draft else ''
-                if not self.do_render and not self.draft:
-                    raise RuntimeError("render=false is only compatible with draft=true")
-                os.system('{} {} -e script_{}.tcl -startup ""'.format(self.vmd, ddev, scene.name))
-                if self.do_render:
-                    if os.name == 'posix':
-                        os.system('for i in $(ls {}-*tga); do convert $i $(echo $i | sed "s/tga/png/g"); '
-                                  'rm $i; done'.format(scene.name))
-                    else:
-                        to_convert = [x for x in os.listdir('.') if x.startswith(scene.name) and x.endswith('tga')]
-                        for tgafile in to_convert:
-                            pngfile = tgafile.replace('tga', 'png')
-                            call('{} {} {}'.format(self.convert, tgafile, pngfile))
-                if not self.draft:
-                    if os.name == 'posix':
-                        os.system('for i in $(ls {}-*png); do rm $(echo $i | sed "s/png/dat/g"); '
-                                  'done'.format(scene.name))
-                    else:
-                        os.system('del {}*dat'.format(scene.name))
-            for action in scene.actions:
-                action.generate_graph()  # here we generate matplotlib figs on-the-fly
+        # stages are always timed, so that measured costs can be added to the history used by planner.plan;
+        # with trace=t, the spans are also saved to {name}.trace.json and {name}.summary.json
+        self.tracer = tracing.Tracer()
+        self.precompute_dir = self.cache_path('precompute')
+        if self.remove is None:  # external programs are only looked up when they are needed
+            self.setup_os_commands()
+        try:
+            with self.span('render'):
+                self.render_movie()
+            if self.dirty_frames is None:  # partial (incremental or resumed) runs would skew the per-frame costs
+                planner.record(self)
+        finally:
+            if self.trace:
+                self.tracer.save(self.name, max([sc.total_frames for sc in self.scenes] + [0]))
+
+    def render_movie(self):
+        """
+        Runs all stages of rendering: planning (cache,
+        incremental mode, journal), VMD rendering of
+        the scenes, composition, encoding and cleanup
+        :return: None
+        """
+        manifest = None
+        with self.span('plan'):
+            if self.incremental and self.do_render and not self.draft:
+                self.cache = True  # unchanged scene frames needed to compose changed movie frames come from the cache
+            if self.cache and self.do_render and not self.draft and self.frame_cache is None:
+                # rendered frames are reused across runs (a cache set by the caller can be shared by several movies)
+                self.frame_cache = frame_cache.FrameCache(os.path.join('.molywood_cache', 'frames'),
+                                                          self.cache_size * 2**20)
+            if self.incremental and self.frame_cache:
+                if self.compositor != 'numpy':
+                    print('Incremental mode requires compositor=numpy, all frames will be composed again')
+                else:
+                    layout = [[self.scenes[0].name]] if len(self.scenes) == 1 else graphics_actions.layout_matrix(self)
+                    self.dirty_frames, self.needed_frames, manifest = incremental.plan(self, layout,
+                                                                                       self.manifest_file())
+                    fr = len(manifest['frames'])
+                    while os.path.isfile('{}-{}.png'.format(self.name, fr)):  # left over by a longer previous version
+                        os.remove('{}-{}.png'.format(self.name, fr))
+                        fr += 1
+            if self.do_render and not self.draft:  # completed frames are journaled, so that the job can be resumed
+                self.journal = journal.Journal('{}.journal'.format(self.name))
+                self.journal.start(hashlib.sha1(json.dumps(incremental.describe(self), sort_keys=True,
+                                                           default=str).encode()).hexdigest(), self.resume)
+                if self.resume and self.compositor == 'numpy' and self.dirty_frames is None:
+                    composed = self.journal.completed('compose', self.name)
+                    self.dirty_frames = [fr for fr in range(max(sc.total_frames for sc in self.scenes))
+                                         if fr not in composed]
+                    self.needed_frames = incremental.scene_frames(self, self.dirty_frames)
+            if self.stream and self.do_render and self.dirty_frames is None:
+                # frames will be piped to a single ffmpeg process as they become ready
+                self.encoder = encoder.StreamingEncoder(self.ffmpeg, self.name, self.fps)
+        own_pool = self.use_pool and self.vmd_pool is None and not self.draft
+        if own_pool:  # warm VMD processes are kept for all scenes (a pool set by the caller outlives the movie)
+            self.vmd_pool = vmd_pool.VMDPool(self.vmd, self.workers)
+        # the part below controls TCL/VMD rendering; independent scenes can be processed concurrently
+        parallel = min(self.workers, len(self.scenes)) if not self.draft else 1
+        try:
+            if parallel > 1:
+                with ThreadPoolExecutor(max_workers=parallel) as pool:
+                    futures = [pool.submit(self.render_scene, scene, self.workers // parallel)
+                               for scene in self.scenes]
+                    for future in futures:
+                        future.result()
+            else:
+                for scene in self.scenes:
+                    self.render_scene(scene, self.workers)
+        finally:
+            if own_pool:
+                self.vmd_pool.close()
+                self.vmd_pool = None
         # at this stage, each scene should have all its initial frames rendered
+        skipped = sum(len(dups) for sc in self.scenes for dups in sc.repeats.values())
+        if skipped:
+            print('{} frames were identical to the preceding ones and were linked instead of being '
+                  'rendered'.format(skipped))
         if self.do_render:
-            graphics_actions.postprocessor(self)
-            os.system('ffmpeg -y -framerate {} -i {}-%d.png -profile:v high -crf 20 -pix_fmt yuv420p '
-                      '-vf "pad=ceil(iw/2)*2:ceil(ih/2)*2" {}.mp4'.format(self.fps, self.name, self.name))
-        if not self.keepframes:
-            for sc in self.scenes:
-                if '/' in sc.name or '\\' in sc.name or '~' in sc.name:
+            nframes = max(sc.total_frames for sc in self.scenes)
+            if self.encoder:
+                with self.span('compose'):
+                    if not self.streams_directly():
+                        graphics_actions.postprocessor(self, self.encoder)
+                    elif self.keepframes:  # frames were already encoded, only movie-...png files are left to write
+                        graphics_actions.postprocessor(self)
+                    self.count(files=['{}-{}.png'.format(self.name, fr) for fr in range(nframes)])
+                with self.span('encode'):
+                    self.encoder.close()
+                    self.count(1, ['{}.mp4'.format(self.name)])
+                self.encoder = None
+            else:
+                # GOP-aligned segments are encoded while the remaining frames are being composed,
+                # and reused when their frames did not change
+                segments = encoder.SegmentedEncoder(self.ffmpeg, self.name, self.fps, self.jobs,
+                                                    max_size=self.cache_size * 2**20)
+                with self.span('compose'):
+                    graphics_actions.postprocessor(self, segments)
+                    self.count(files=['{}-{}.png'.format(self.name, fr) for fr in range(nframes)])
+                with self.span('encode'):
+                    segments.close()
+                    self.count(segments.encoded + 1, ['{}.mp4'.format(self.name)])
+            if manifest:
+                incremental.save(manifest, self.manifest_file())
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        with self.span('cleanup'):
+            if not self.keepframes:
+                for sc in self.scenes:
+                    if '/' in sc.name or '\\' in sc.name or '~' in sc.name:
+                        raise RuntimeError('For security reasons, cleanup of scenes that contain path-like elements '
+                                           '(slashes, backslashes, tildes) is prohibited.\n\n'
+                                           'Error triggered by: {}'.format(sc.name))
+                    else:
+                        if any([x for x in os.listdir('.') if x.startswith(sc.name) and x.endswith('png')]):
+                            os.system('{} {}-[0-9]*.png'.format(self.remove, sc.name))
+                        if any([x for x in os.listdir('.') if x.startswith('overlay') and x.endswith('png')
+                                and sc.name in x]):
+                            os.system('{} overlay[0-9]*-{}-[0-9]*.png'.format(self.remove, sc.name))
+                        if os.path.isfile('script_{}.tcl'.format(sc.name)):
+                            os.system('{} script_{}.tcl'.format(self.remove, sc.name))
+                        if any([x for x in os.listdir('.') if x.startswith('script_{}_'.format(sc.name))
+                                and x.endswith('tcl')]):
+                            os.system('{} script_{}_[0-9]*.tcl'.format(self.remove, sc.name))
+                if '/' in self.name or '\\' in self.name or '~' in self.name:
                     raise RuntimeError('For security reasons, cleanup of scenes that contain path-like elements '
                                        '(slashes, backslashes, tildes) is prohibited.\n\n'
-                                       'Error triggered by: {}'.format(sc.name))
-                else:
-                    if any([x for x in os.listdir('.') if x.startswith(sc.name) and x.endswith('png')]):
-                        os.system('{} {}-[0-9]*.png'.format(self.remove, sc.name))
-                    if any([x for x in os.listdir('.') if x.startswith('overlay') and x.endswith('png')
-                            and sc.name in x]):
-                        os.system('{} overlay[0-9]*-{}-[0-9]*.png'.format(self.remove, sc.name))
-                    if any([x for x in os.listdir('.') if x.startswith('script') and x.endswith('tcl')
-                            and sc.name in x]):
-                        os.system('{} script_{}.tcl'.format(self.remove, sc.name))
-            if '/' in self.name or '\\' in self.name or '~' in self.name:
-                raise RuntimeError('For security reasons, cleanup of scenes that contain path-like elements '
-                                   '(slashes, backslashes, tildes) is prohibited.\n\n'
-                                   'Error triggered by: {}'.format(self.name))
-            else:
-                if any([x for x in os.listdir('.') if x.startswith(self.name) and x.endswith('png')]):
-                    os.system('{} {}-[0-9]*.png'.format(self.remove, self.name))
+                                       'Error triggered by: {}'.format(self.name))
+                elif not manifest:  # in incremental mode, movie frames are reused by the next run
+                    if any([x for x in os.listdir('.') if x.startswith(self.name) and x.endswith('png')]):
+                        os.system('{} {}-[0-9]*.png'.format(self.remove, self.name))
     
+    def render_scene(self, scene, workers=1):
+        """
+        Produces the initial frames of a single scene,
+        i.e. runs VMD (possibly split into several
+        workers) and converts its output, then generates
+        external figures and matplotlib plots
+        :param scene: Scene instance, the scene to be rendered
+        :param workers: int, number of VMD processes the scene can be split into
+        :return: None
+        """
+        with self.span('scene', 'scene', scene=scene.name):
+            scene.rendered = []
+            if self.needed_frames is not None and not self.needed_frames[scene.name]:
+                print('No frames of scene {} have to be rendered again'.format(scene.name))
+                return
+            if self.workers > 1:  # all concurrently running VMD processes share the available cores
+                scene.tachyon_threads = max(1, (os.cpu_count() or 1) // self.workers)
+            with self.span('tcl', scene=scene.name):
+                tcl_script = scene.tcl()  # this generates the TCL code, below we save it as a script and run VMD
+            if scene.run_vmd:
+                ddev = '-dispdev none' if not self.draft else ''
+                if not self.do_render and not self.draft:
+                    raise RuntimeError("render=false is only compatible with draft=true")
+                missing = self.fetch_cached(scene)  # frames that still have to be rendered
+                scene.repeats = self.find_repeats(scene, missing)
+                rendered = [fr for fr in missing if fr not in {dup for dups in scene.repeats.values() for dup in dups}]
+                scene.rendered = rendered
+                if 0 < len(rendered) < scene.total_frames:
+                    with self.span('tcl', scene=scene.name):
+                        tcl_script = scene.tcl((rendered[0], rendered[-1] + 1), rendered)
+                # TGA frames are converted to PNG in process, while VMD is still running
+                converter = render_queue.FrameConverter(self.jobs) if self.do_render and not \
+                    (self.streams_directly() and not self.keepframes) else None
+                if converter:
+                    converter.tracer = self.tracer
+                if converter and self.journal:
+                    converter.on_frame = lambda name, fr: self.journal.record('render', name, fr,
+                                                                              '{}-{}.png'.format(name, fr))
+                with self.span('vmd', scene=scene.name):
+                    try:
+                        if not missing:
+                            print('All frames of scene {} are already available'.format(scene.name))
+                        elif workers > 1 and not self.draft and len(rendered) > 1:
+                            ranges = scene.frame_ranges(workers, rendered)
+                            self.wait_vmd(scene, self.run_workers(scene, ranges, rendered), converter,
+                                          [[fr for fr in rendered if first <= fr < last] for first, last in ranges])
+                        else:
+                            with open('script_{}.tcl'.format(scene.name), 'w') as out:
+                                out.write(vmd_pool.pooled_script(tcl_script) if self.pooled() else tcl_script)
+                            if self.pooled():
+                                self.wait_vmd(scene, [self.vmd_pool.submit('script_{}.tcl'.format(scene.name),
+                                                                           vmd_pool.script_context(tcl_script),
+                                                                           scene.stateless)], converter, [rendered])
+                            elif converter or (self.tachyon_jobs and not self.draft and self.do_render):
+                                self.wait_vmd(scene, [Popen('{} {} -e script_{}.tcl -startup ""'.format(self.vmd, ddev,
+                                                                                                      scene.name),
+                                                            shell=True)], converter, [rendered])
+                                self.count(1)
+                            else:
+                                os.system('{} {} -e script_{}.tcl -startup ""'.format(self.vmd, ddev, scene.name))
+                                self.count(1)
+                    finally:
+                        if converter:
+                            converter.finish()
+                for source, dups in scene.repeats.items():  # identical frames were rendered once
+                    if os.path.isfile('{}-{}.png'.format(scene.name, source)):
+                        graphics_actions.link_frames('{}-{}.png'.format(scene.name, source),
+                                                     ['{}-{}.png'.format(scene.name, fr) for fr in dups])
+                        for fr in dups:
+                            if self.journal:
+                                self.journal.record('render', scene.name, fr, '{}-{}.png'.format(scene.name, fr))
+                self.store_cached(scene, missing)
+            with self.span('figures', scene=scene.name):
+                for action in scene.actions:
+                    if self.needed_frames is None or any(action.initframe <= fr < action.initframe + action.framenum
+                                                         for fr in self.needed_frames[scene.name]):
+                        action.generate_graph()  # here we generate matplotlib figs on-the-fly
+
+    def uses_cache(self, scene):
+        """
+        Checks if frames of a scene can be taken from
+        (and stored in) the frame cache: the state of
+        every frame has to be absolute, so scenes with
+        fit_trajectory and draft snapshots are excluded
+        :param scene: Scene instance, the scene to be rendered
+        :return: bool
+        """
+        return bool(self.frame_cache) and scene.stateless and not self.draft and self.do_render
+
+    def fetch_cached(self, scene):
+        """
+        Restores the frames of a scene that are
+        already present in the frame cache (in incremental
+        mode, only frames needed by changed movie frames)
+        :param scene: Scene instance, the scene to be rendered
+        :return: list of ints, frames that still have to be rendered
+        """
+        frames = list(range(scene.total_frames)) if self.needed_frames is None else self.needed_frames[scene.name]
+        if self.resume and self.journal:  # frames completed before the job was interrupted
+            done = self.journal.completed('render', scene.name)
+            frames = [fr for fr in frames if fr not in done]
+        if not self.uses_cache(scene):
+            return frames
+        keys = self.frame_cache.frame_keys(scene)
+        missing = [fr for fr in frames if not self.frame_cache.fetch(keys[fr], '{}-{}.png'.format(scene.name, fr))]
+        print('Scene {}: {} of {} frames found in the cache'.format(scene.name, len(frames) - len(missing),
+                                                                     len(frames)))
+        return missing
+
+    def find_repeats(self, scene, frames):
+        """
+        Finds runs of consecutive frames that look exactly
+        the same (e.g. in do_nothing or at the end of a
+        transition), so that only the first one of each run
+        has to be rendered and the rest can be linked to it
+        :param scene: Scene instance, the scene to be rendered
+        :param frames: list of ints, frames that have to be rendered
+        :return: dict, first frame of a run: list of its repeats
+        """
+        if not scene.stateless or self.draft or not self.do_render:
+            return {}
+        states = frame_cache.frame_states(scene)
+        repeats, source = {}, None
+        for prev, fr in zip([None] + frames[:-1], frames):
+            if prev is not None and prev == fr - 1 and states[fr] == states[prev]:
+                repeats.setdefault(source, []).append(fr)
+            else:
+                source = fr
+        return repeats
+
+    def store_cached(self, scene, frames):
+        """
+        Adds freshly rendered frames of a scene to the
+        frame cache, and trims the cache to its size limit
+        :param scene: Scene instance, the scene that was rendered
+        :param frames: list of ints, frames that were rendered
+        :return: None
+        """
+        if not self.uses_cache(scene):
+            return
+        keys = self.frame_cache.frame_keys(scene)
+        for fr in frames:
+            if os.path.isfile('{}-{}.png'.format(scene.name, fr)):
+                self.frame_cache.store(keys[fr], '{}-{}.png'.format(scene.name, fr))
+        self.frame_cache.evict()
+
+    def cache_path(self, *path):
+        """
+        Path inside the .molywood_cache directory that sits
+        next to the input script (or in the working directory
+        if the script was not read from a file), so that it
+        does not depend on where molywood is started from
+        :param path: str, components of the path within the cache
+        :return: str
+        """
+        directory = os.path.dirname(self.scriptfile) if self.scriptfile else ''
+        return os.path.join(directory, '.molywood_cache', *path)
+
+    def manifest_file(self):
+        """
+        Path to the manifest describing the previous
+        run, used to find changes in incremental mode
+        :return: str
+        """
+        return os.path.join('.molywood_cache', 'manifest-{}.json'.format(self.name))
+
+    def streams_directly(self):
+        """
+        Checks if ray-traced frames can be sent to the encoder
+        right away, i.e. if a single scene without overlays or
+        figures is rendered in order by a single VMD process
+        (with tachyon_jobs, so that completed frames are known);
+        a resumed job skips the frames completed before, so
+        they are streamed from the frame files after rendering
+        :return: bool
+        """
+        return bool(self.encoder) and len(self.scenes) == 1 and self.scenes[0].run_vmd and self.tachyon_jobs \
+            and self.workers == 1 and not self.draft and not self.cache and not self.resume \
+            and not any(set(ac.action_type).intersection({'show_figure', 'add_overlay'})
+                        for ac in self.scenes[0].actions)
+
+    def span(self, name, category='stage', **args):
+        """
+        Times a stage of rendering (while rendering)
+        :param name: str, name of the stage
+        :param category: str, 'stage', 'scene' or 'frame'
+        :param args: extra information stored with the span (e.g. scene=...)
+        :return: context manager
+        """
+        return self.tracer.span(name, category, **args) if self.tracer else nullcontext()
+
+    def count(self, subprocesses=0, files=()):
+        """
+        Registers spawned subprocesses and written files
+        with the tracer, while rendering
+        :param subprocesses: int, number of subprocesses started
+        :param files: iterable of str, paths to the files written
+        :return: None
+        """
+        if self.tracer:
+            self.tracer.count(subprocesses, files)
+
+    def pooled(self):
+        """
+        Checks if VMD scripts are sent to the pool of warm
+        VMD processes rather than to a new VMD process each
+        :return: bool
+        """
+        return self.vmd_pool is not None and not self.draft
+
+    def run_workers(self, scene, ranges, frames=None):
+        """
+        Renders contiguous ranges of frames of a single
+        scene with separate VMD/Tachyon processes; every
+        worker replays the scene from the beginning
+        but only renders (and exits after) its own
+        range, so that the set of {scene}-{fr} files
+        is identical to the one produced serially
+        :param scene: Scene instance, the scene to be rendered
+        :param ranges: list of tuples, (first, last exclusive) frames rendered by each VMD process
+        :param frames: list of ints, if given, only these frames are rendered (e.g. cache misses)
+        :return: list of subprocess.Popen (or vmd_pool.PoolJob), the running VMD processes
+        """
+        processes = []
+        partial = frames is not None and len(frames) < scene.total_frames
+        for n, frame_range in enumerate(ranges):
+            tcl_script = scene.tcl(frame_range, frames if partial else None)
+            script_name = 'script_{}_{}.tcl'.format(scene.name, n)
+            with open(script_name, 'w') as out:
+                out.write(vmd_pool.pooled_script(tcl_script) if self.pooled() else tcl_script)
+            if self.pooled():
+                processes.append(self.vmd_pool.submit(script_name, vmd_pool.script_context(tcl_script),
+                                                      scene.stateless))
+            else:
+                processes.append(Popen('{} -dispdev none -e {} -startup ""'.format(self.vmd, script_name),
+                                       shell=True))
+                self.count(1)
+        return processes
+
+    def wait_vmd(self, scene, processes, converter=None, frames=None):
+        """
+        Waits for the VMD processes rendering a scene
+        to finish; if tachyon_jobs is set, the exported
+        scene files are meanwhile ray-traced by a pool
+        of Tachyon processes, and finished frames are
+        passed on to the encoder and/or the converter
+        :param scene: Scene instance, the scene being rendered
+        :param processes: list of subprocess.Popen, the running VMD processes
+        :param converter: render_queue.FrameConverter, converts finished TGA frames to PNG
+        :param frames: list of lists of ints, frames rendered by each process, in order (all frames by default)
+        :return: None
+        """
+        frames = frames if frames is not None else [range(scene.total_frames)]
+        if self.tachyon_jobs and not self.draft:
+            queue = render_queue.TachyonQueue(self.tachyon, self.tachyon_jobs, self.tachyon_threads)
+            queue.tracer = self.tracer
+            queue.on_frame = lambda name, fr: self.frame_ready(name, fr, converter)
+            if self.streams_directly():  # a missing frame would otherwise stall the encoder and its producers
+                queue.on_failure = lambda name, fr: self.encoder.abort('frame {}-{} could not be '
+                                                                       'rendered'.format(name, fr))
+            queue.run(scene, [fr for process_frames in frames for fr in process_frames], processes)
+            queue.report(scene.name)
+        elif converter:
+            converter.watch(scene.name, frames, processes)
+        for proc in processes:
+            proc.wait()
+        if any(proc.returncode != 0 for proc in processes):
+            raise RuntimeError('At least one of the VMD processes rendering scene {} did not finish '
+                               'successfully'.format(scene.name))
+
+    def frame_ready(self, scene_name, frame, converter=None):
+        """
+        Handles a frame once Tachyon has finished it: pushes
+        it to the encoder if frames are streamed directly,
+        and converts it to PNG unless it is no longer needed
+        :param scene_name: str, name of the scene
+        :param frame: int, frame number
+        :param converter: render_queue.FrameConverter, converts finished TGA frames to PNG
+        :return: None
+        """
+        tgafile = '{}-{}.tga'.format(scene_name, frame)
+        if self.streams_directly():
+            image = image_io.read_image(tgafile)
+            for fr in [frame] + self.scenes[0].repeats.get(frame, []):  # repeated frames reuse the same image
+                self.encoder.push(fr, image)
+        if converter:
+            converter.submit(scene_name, frame)
+        else:
+            os.remove(tgafile)
+
     def show_script(self):
         """
         Shows a sequence of scenes currently
@@ -141,9 +590,10 @@ class Script:
                     subscripts[current_sub].append(line)
         if multiline:
             raise RuntimeError("Error: not all curly brackets {} were closed, revise your input")
-        Script.allowed_globals.extend(list(subscripts.keys()))
+        # scene names become global directives; '_default' only if actions precede the first scene header
+        self.allowed_globals.extend([sc for sc in subscripts.keys() if sc != '_default' or subscripts[sc]])
         for sc in subscripts.keys():
-            Script.allowed_params[sc] = Script.allowed_params['_default']
+            self.allowed_params[sc] = self.allowed_params['_default']
         self.directives = self.parse_directives(master_setup)
         self.scenes = self.parse_scenes(subscripts)
         self.prepare()
@@ -153,34 +603,27 @@ class Script:
         Paths to VMD, imagemagick utilities, OS-specific
         versions of rm/del, ls/dir, which/where, ffmpeg etc.
         have to be determined to allow for Linux/OSX/Win
-        compatibility
+        compatibility; this is only done before rendering,
+        and the (slow) search on Windows is cached in TOOLS
         :return: None
         """
         if os.name == 'posix':
             self.remove = 'rm'
             self.vmd = 'vmd'
             self.compose, self.convert = 'composite', 'convert'
+            self.tachyon = os.environ.get('TACHYON_BIN', 'tachyon')
+            self.ffmpeg = 'ffmpeg'
         elif os.name == 'nt':
-            import pathlib
             self.remove = 'del'
-            for pfiles in [x for x in os.listdir('C:\\') if x.startswith('Program Files')]:
-                for file in pathlib.Path('C:\\{}'.format(pfiles)).glob('**/vmd.exe'):
-                    self.vmd = str(file)
-            if not self.vmd:
-                raise RuntimeError("VMD was not found in any of the Program Files directories, check your installation")
-            if call('where ffmpeg') != 0:
-                raise RuntimeError('ffmpeg not found, please make sure it was added to the system path during '
-                                   'installation (see README)')
-            if call('where magick') == 0:
-                self.compose, self.convert = 'magick composite', 'magick convert'
-            else:
-                raise RuntimeError('imagemagick not found, please make sure it was added to the system path during '
-                                   'installation (see README)')
+            tools = windows_tools()
+            self.vmd = tools['vmd']
+            self.tachyon = os.environ.get('TACHYON_BIN', tools['tachyon'] or 'tachyon')
+            self.ffmpeg = 'ffmpeg'
+            self.compose, self.convert = 'magick composite', 'magick convert'
         else:
             raise RuntimeError('OS type could not be detected')
         
-    @staticmethod
-    def parse_directives(directives):
+    def parse_directives(self, directives):
         """
         Reads global directives that affect
         the main object (layout, fps, draftmode
@@ -191,9 +634,9 @@ class Script:
         dirs = {}
         for directive in directives:
             entries = directive.split()
-            if entries[0] not in Script.allowed_globals:
+            if entries[0] not in self.allowed_globals:
                 raise RuntimeError("'{}' is not an allowed global directive. Allowed "
-                                   "global directives are: {}".format(entries[0], ", ".join(Script.allowed_globals)))
+                                   "global directives are: {}".format(entries[0], ", ".join(self.allowed_globals)))
             dirs[entries[0]] = {}
             for entry in entries[1:]:
                 try:
@@ -202,7 +645,7 @@ class Script:
                     raise RuntimeError("Entries should contain parameters formatted as 'key=value' pairs,"
                                        "'{}' in line '{}' does not follow that specification".format(entry, directive))
                 else:
-                    allowed = Script.allowed_params[entries[0]]
+                    allowed = self.allowed_params[entries[0]]
                     if key not in allowed:
                         raise RuntimeError("'{}' is not a parameter compatible with the directive {}. Allowed "
                                            "parameters include: {}".format(key, entries[0],
@@ -300,10 +743,65 @@ class Script:
                 else False
         except KeyError:
             pass
+        try:
+            self.stream = True if self.directives['global']['stream'].lower() in ['y', 't', 'yes', 'true'] else False
+        except KeyError:
+            pass
+        try:
+            self.use_pool = True if self.directives['global']['vmd_pool'].lower() in ['y', 't', 'yes', 'true'] \
+                else False
+        except KeyError:
+            pass
+        try:
+            self.trace = True if self.directives['global']['trace'].lower() in ['y', 't', 'yes', 'true'] else False
+        except KeyError:
+            pass
         try:
             self.name = self.directives['global']['name']
         except KeyError:
             pass
+        try:
+            self.cache = True if self.directives['global']['cache'].lower() in ['y', 't', 'yes', 'true'] else False
+        except KeyError:
+            pass
+        try:
+            self.cache_size = float(self.directives['global']['cache_size'])
+        except KeyError:
+            pass
+        except ValueError:
+            raise RuntimeError("'cache_size' must be a number (in MB), instead '{}' was "
+                               "given".format(self.directives['global']['cache_size']))
+        try:
+            self.compositor = self.directives['global']['compositor'].lower()
+        except KeyError:
+            pass
+        else:
+            if self.compositor not in ['numpy', 'imagemagick']:
+                raise RuntimeError("'compositor' must be either 'numpy' or 'imagemagick', instead '{}' was "
+                                   "given".format(self.directives['global']['compositor']))
+        # PNG decoding relies on matplotlib, otherwise we fall back to ImageMagick (checked without importing it)
+        if self.compositor == 'numpy' and importlib.util.find_spec('matplotlib') is None:
+            self.compositor = 'imagemagick'
+        for param in ['tachyon_jobs', 'tachyon_threads']:
+            try:
+                setattr(self, param, int(self.directives['global'][param]))
+            except KeyError:
+                pass
+            except ValueError:
+                raise RuntimeError("'{}' must be an integer, instead '{}' was "
+                                   "given".format(param, self.directives['global'][param]))
+        for param in ['workers', 'jobs']:
+            try:
+                setattr(self, param, int(self.directives['global'][param]))
+            except KeyError:
+                pass
+            except ValueError:
+                raise RuntimeError("'{}' must be a positive integer, instead '{}' was "
+                                   "given".format(param, self.directives['global'][param]))
+            else:
+                if getattr(self, param) < 1:
+                    raise RuntimeError("'{}' must be a positive integer, instead '{}' was "
+                                       "given".format(param, self.directives['global'][param]))
         for scene in self.scenes:
             scene.calc_framenum()
     
@@ -374,6 +872,15 @@ class Scene:
         self.run_vmd = False
         self.total_frames = 0
         self.tachyon = None
+        self.tachyon_threads = None
+        self.render_range = None
+        self.render_frames = None
+        self.traj_span = None  # (first, last, step) of the trajectory frames loaded, if not all of them
+        self.precompute = None  # trajectory.Precompute, if the molecule can be read in Python
+        self.fit_plan = None  # precomputed moves of fit_trajectory actions (see tcl_actions.fit_plan)
+        self.repeats = {}  # first frame: list of identical frames that follow it
+        self.rendered = []  # frames rendered by VMD in the last run
+        self.keyframes = []
         self.counters = {'hl': 0, 'overlay': 0, 'make_transparent': 0, 'make_opaque': 0, 'rot': 0}
         self.labels = {'Atoms': [], 'Bonds': []}
     
@@ -415,35 +922,80 @@ class Scene:
                 action.framenum = 0
             cumsum += action.framenum
         self.total_frames = cumsum
-            
-    def tcl(self):
+
+    @property
+    def stateless(self):
+        """
+        Whether every frame can be set up from its absolute
+        state alone; fit_trajectory modifies coordinates
+        incrementally, so it still requires replaying the scene
+        :return: bool
+        """
+        return not any('fit_trajectory' in action.action_type for action in self.actions)
+
+    def frame_ranges(self, nchunks, frames=None):
+        """
+        Splits the scene's frames into (at most) nchunks
+        contiguous, similarly sized ranges
+        :param nchunks: int, number of ranges (e.g. workers) requested
+        :param frames: list of ints, sorted subset of frames to be split (all frames by default)
+        :return: list of (first, last) tuples, last being exclusive
+        """
+        frames = list(range(self.total_frames)) if frames is None else frames
+        nchunks = max(1, min(nchunks, len(frames)))
+        bounds = [round(n * len(frames) / nchunks) for n in range(nchunks + 1)]
+        return [(frames[bounds[n]], frames[bounds[n+1] - 1] + 1) for n in range(nchunks) if bounds[n+1] > bounds[n]]
+
+    def tcl(self, render_range=None, render_frames=None):
         """
         This is the top-level function that produces
         an executable TCL script based on the corresponding
         action.generate() functions
+        :param render_range: tuple, (first, last) frames to be rendered (last exclusive); all frames are
+        rendered by default, while the remaining ones are only used to fast-forward the scene state
+        :param render_frames: iterable of ints, if given, only these frames are rendered (e.g. cache misses)
         :return: str, TCL code
         """
+        self.render_range = render_range
+        self.render_frames = None if render_frames is None else sorted(render_frames)
+        self.labels = {'Atoms': [], 'Bonds': []}
+        self.keyframes = keyframes.compute_keyframes(self)
+        self.traj_span = None
         if self.visualization or self.structure:
             self.run_vmd = True
+            span = tcl_actions.trajectory_span(self)  # only trajectory frames that are shown have to be loaded
+            if self.precompute is None:
+                self.precompute = trajectory.scene_precompute(self)
             if self.visualization:
                 code = [line for line in open(self.visualization, 'r').readlines() if not line.startswith('#')]
-                code = ''.join(code)
+                code, restricted = tcl_actions.restrict_trajectory(''.join(code), span)
+                self.traj_span = span if restricted else None
             else:
                 code = 'mol new {} type {} first 0 last -1 step 1 filebonds 1 ' \
                        'autobonds 1 waitfor all\n'.format(self.structure, self.structure.split('.')[-1])
-                if self.trajectory:
+                if self.trajectory and span:
+                    code += tcl_actions.load_trajectory(self.trajectory, self.trajectory.split('.')[-1], span)
+                    self.traj_span = span
+                elif self.trajectory:
                     code += 'mol addfile {} type {} first 0 last -1 step 1 filebonds 1 ' \
                             'autobonds 1 waitfor all\n'.format(self.trajectory, self.trajectory.split('.')[-1])
                 code += 'mol delrep 0 top\nmol representation NewCartoon 0.300000 10.000000 4.100000 0\n' \
                         'mol color Structure\nmol selection {all}\nmol material Opaque\nmol addrep top\n' \
                         'color Display Background white\n'
             code += 'axes location off\n'
+            code += tcl_actions.apply_view()
+            if self.render_range:
+                code += 'set render_first {}\nset render_last {}\n'.format(*self.render_range)
+            if self.render_frames is not None:
+                code += 'array set render_frames {{{}}}\n'.format(' '.join('{} 1'.format(fr)
+                                                                          for fr in self.render_frames))
             if not self.script.draft:
                 code += 'render options Tachyon \"$env(TACHYON_BIN)\" -aasamples 12 %s -format ' \
                         'TARGA -o %s.tga -res {} {}\n'.format(*self.resolution)
             else:
                 code += 'display resize {res}\nafter 100\ndisplay update\nafter 100\n' \
                         'display resize {res}'.format(res=' '.join(str(x) for x in self.resolution))
+            self.fit_plan = tcl_actions.fit_plan(self)
             action_code = ''
             for ac in self.actions:
                 action_code += ac.generate_tcl()
@@ -490,6 +1042,7 @@ class Action:
         self.parameters = {}  # will be a dict of action parameters
         self.initframe = None  # contains the initial frame number in the overall movie's numbering
         self.framenum = None  # total frames count for this action
+        self.setup_state = None  # absolute scene state after the instantaneous part of the action
         self.highlights, self.transp_changes, self.rots = {}, {}, {}
         self.parse(description)
     
@@ -676,6 +1229,14 @@ if __name__ == "__main__":
                     if sscene.run_vmd:
                         with open('script_{}.tcl'.format(sscene.name), 'w') as sout:
                             sout.write(stcl_script)
+            elif test_param == '--plan':  # dry run: reports frame counts, subprocesses, disk/memory use and time
+                print(planner.report(planner.plan(scr)))
+            elif test_param == '--incremental':  # only re-renders and re-composes what changed since the last run
+                scr.incremental = True
+                scr.render()
+            elif test_param == '--resume':  # continues an interrupted job, using its journal
+                scr.resume = True
+                scr.render()
             else:
                 print("\n\nWarning: parameters beyond the first will be ignored\n\n")
                 scr.render()
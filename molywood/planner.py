@@ -0,0 +1,267 @@
+import os
+import json
+import math
+import time
+
+if __package__:
+    from . import graphics_actions
+else:
+    import graphics_actions
+
+HISTORY = 'history.json'  # kept in the .molywood_cache directory next to the input script
+HISTORY_LENGTH = 50
+PNG_RATIO = 0.35  # PNG size relative to raw RGB data, until measured by a previous run
+DAT_BYTES = 2**22  # rough size of a Tachyon scene file exported by VMD
+STREAM_BUFFER = 64  # frames held by encoder.StreamingEncoder
+COSTS = {'tcl': 'scene_frames', 'vmd': 'rendered_mpx', 'figures': 'figure_frames', 'compose': 'movie_mpx',
+         'encode': 'movie_frames', 'plan': 'movie_frames', 'cleanup': 'movie_frames'}
+
+
+def movie_resolution(script):
+    """
+    Size of the composed movie frames, as tiled
+    by the compositor according to the layout
+    :param script: Script instance, the master object controlling the movie layout
+    :return: tuple, (width, height)
+    """
+    if len(script.scenes) == 1 or 'layout' not in script.directives:
+        return tuple(script.scenes[0].resolution)
+    resolutions = {sc.name: sc.resolution for sc in script.scenes}
+    rows = [[resolutions[name] for name in row if name] for row in graphics_actions.layout_matrix(script)]
+    return (max(sum(res[0] for res in row) for row in rows if row),
+            sum(max(res[1] for res in row) for row in rows if row))
+
+
+def figure_frames(scene):
+    """
+    Counts the frames of figures, plots and overlays
+    generated outside of VMD for a scene
+    :param scene: Scene instance
+    :return: dict, numbers of static figures, plotted and text frames, overlay frames and pixels
+    of the overlay frames written to disk (static figures are linked to a single file)
+    """
+    counts = {'static': 0, 'plots': 0, 'text': 0, 'overlay_frames': 0, 'overlay_pixels': 0}
+    width, height = scene.resolution
+    for action in scene.actions:
+        if 'show_figure' in action.action_type:
+            if 'figure' in action.parameters:
+                counts['static'] += 1
+            elif 'datafile' in action.parameters:
+                counts['plots'] += action.framenum
+        if 'add_overlay' in action.action_type:
+            for overlay in action.overlays.values():
+                scaling = float(overlay.get('relative_size', 1)) if 'text' not in overlay else 1
+                counts['overlay_frames'] += action.framenum
+                if 'figure' in overlay:
+                    counts['static'] += 1
+                    continue
+                elif 'datafile' in overlay:
+                    counts['plots'] += action.framenum
+                elif 'text' in overlay:
+                    counts['text'] += action.framenum
+                counts['overlay_pixels'] += action.framenum * width * height * scaling ** 2
+    return counts
+
+
+def quantities(script, rendered):
+    """
+    Amounts of work the per-frame costs are related to
+    :param script: Script instance, the master object controlling the movie layout
+    :param rendered: dict, scene_name: number of frames rendered by VMD
+    :return: dict
+    """
+    width, height = movie_resolution(script)
+    nframes = max(sc.total_frames for sc in script.scenes)
+    figures = [figure_frames(sc) for sc in script.scenes]
+    return {'scene_frames': sum(sc.total_frames for sc in script.scenes),
+            'rendered_mpx': sum(rendered[sc.name] * sc.resolution[0] * sc.resolution[1] for sc in script.scenes) / 1e6,
+            'figure_frames': sum(fig['plots'] + fig['text'] + fig['static'] for fig in figures),
+            'movie_frames': nframes, 'movie_mpx': nframes * width * height / 1e6}
+
+
+def load_history(filename):
+    try:
+        with open(filename) as history:
+            return json.load(history)
+    except (OSError, ValueError):
+        return []
+
+
+def record(script, filename=None):
+    """
+    Appends the measured per-frame costs of a finished
+    render (from the stages timed by script.tracer) to
+    the local history used to estimate wall times
+    :param script: Script instance, after rendering
+    :param filename: str, path to the history file (by default, in the cache next to the script)
+    :return: None
+    """
+    filename = filename or script.cache_path(HISTORY)
+    summary = script.tracer.summary()
+    amounts = quantities(script, {sc.name: len(sc.rendered) for sc in script.scenes})
+    entry = {'time': time.time(), 'settings': settings(script), 'quantities': amounts,
+             'stages': {stage: summary['stages'][stage]['wall'] for stage in COSTS if stage in summary['stages']}}
+    converted = summary['stages'].get('convert')
+    pixels = sum(len(sc.rendered) * sc.resolution[0] * sc.resolution[1] for sc in script.scenes)
+    if converted and pixels:
+        entry['png_ratio'] = converted['bytes_written'] / (3 * pixels)
+    history = load_history(filename)[-(HISTORY_LENGTH - 1):] + [entry]
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename + '.part', 'w') as out:
+        json.dump(history, out)
+    os.replace(filename + '.part', filename)
+
+
+def settings(script):
+    """
+    Settings that change how long rendering takes,
+    so that comparable runs are preferred in estimates
+    :param script: Script instance
+    :return: list
+    """
+    return [script.workers, script.tachyon_jobs, script.jobs, script.compositor, script.stream, script.draft]
+
+
+def median(values):
+    values = sorted(values)
+    return (values[(len(values) - 1) // 2] + values[len(values) // 2]) / 2
+
+
+def estimate(script, amounts, history):
+    """
+    Estimates the wall time of each stage from the median
+    cost per unit of work (frame or megapixel) measured in
+    previous runs, preferring runs with the same settings
+    :param script: Script instance
+    :param amounts: dict, as returned by quantities()
+    :param history: list, entries written by record()
+    :return: tuple, (dict stage: seconds or None if never measured, number of runs used)
+    """
+    similar = [entry for entry in history if entry['settings'] == settings(script)]
+    runs = similar or history
+    stages = {}
+    for stage, unit in COSTS.items():
+        costs = [entry['stages'][stage] / entry['quantities'][unit] for entry in runs
+                 if stage in entry['stages'] and entry['quantities'][unit] > 0]
+        if not amounts[unit]:
+            stages[stage] = 0.0
+        else:
+            stages[stage] = median(costs) * amounts[unit] if costs else None
+    return stages, len(runs)
+
+
+def plan(script, history_file=None):
+    """
+    Dry run: works out how many frames each scene and
+    each stage will process, how many subprocesses the
+    pipeline will spawn, how much intermediate data will
+    be kept on disk and in memory at most, and how long
+    it should take, without rendering anything
+    :param script: Script instance, the master object controlling the movie layout
+    :param history_file: str, path to the history of measured costs (by default, in the cache next to the script)
+    :return: dict, JSON-serializable
+    """
+    history_file = history_file or script.cache_path(HISTORY)
+    history = load_history(history_file)
+    ratios = [entry['png_ratio'] for entry in history if 'png_ratio' in entry]
+    png_ratio = median(ratios) if ratios else PNG_RATIO
+    parallel = min(script.workers, len(script.scenes)) if not script.draft else 1
+    scenes, rendered = {}, {}
+    for scene in script.scenes:
+        scene.tcl()  # sets up keyframes and run_vmd
+        frames = list(range(scene.total_frames))
+        repeats = script.find_repeats(scene, frames) if scene.run_vmd else {}
+        rendered[scene.name] = len(frames) - sum(len(dups) for dups in repeats.values()) if scene.run_vmd else 0
+        workers = script.workers // parallel
+        processes = 0
+        if rendered[scene.name]:
+            processes = len(scene.frame_ranges(workers, frames)) if workers > 1 and not script.draft else 1
+        scenes[scene.name] = {'frames': scene.total_frames, 'rendered': rendered[scene.name],
+                              'repeated': scene.total_frames - rendered[scene.name] if scene.run_vmd else 0,
+                              'resolution': list(scene.resolution), 'vmd_processes': processes,
+                              'figures': figure_frames(scene)}
+    amounts = quantities(script, rendered)
+    width, height = movie_resolution(script)
+    nframes = amounts['movie_frames']
+    total_rendered = sum(rendered.values())
+    figures = {key: sum(sc['figures'][key] for sc in scenes.values()) for key in scenes[script.scenes[0].name]
+               ['figures']}
+    stages = {'vmd': total_rendered, 'tachyon': 0 if script.draft else total_rendered, 'convert': total_rendered,
+              'figures': figures['plots'] + figures['text'] + figures['static'], 'compose': nframes,
+              'encode': nframes if script.do_render else 0}
+    # subprocesses
+    vmd = sum(sc['vmd_processes'] for sc in scenes.values())
+    if script.vmd_pool is not None or script.use_pool:
+        vmd = min(vmd, script.workers)
+    imagemagick = figures['text']
+    if script.compositor == 'imagemagick':
+        imagemagick += figures['overlay_frames'] + figures['plots'] + figures['static']  # composite and resize
+        imagemagick += nframes if len(script.scenes) > 1 else 0
+    if not script.do_render:
+        ffmpeg = 0
+    elif script.stream:
+        ffmpeg = 1
+    else:
+        ffmpeg = math.ceil(nframes / (5 * max(1, int(round(script.fps))))) + 1
+    subprocesses = {'vmd': vmd, 'tachyon': stages['tachyon'], 'imagemagick': imagemagick, 'ffmpeg': ffmpeg}
+    # intermediate files: scene and movie PNGs coexist until cleanup, TGA and .dat files only while in flight
+    inflight = min(total_rendered, script.workers + max(script.tachyon_jobs, script.jobs))
+    largest = max(sc.resolution[0] * sc.resolution[1] for sc in script.scenes)
+    single = len(script.scenes) == 1 and not figures['overlay_frames'] and script.compositor == 'numpy'
+    disk = {'tga': inflight * (3 * largest + 18),
+            'dat': inflight * DAT_BYTES if script.tachyon_jobs and not script.draft else 0,
+            'png': sum(rendered[sc.name] * 3 * sc.resolution[0] * sc.resolution[1] for sc in script.scenes)
+            * png_ratio,
+            'overlay': 3 * png_ratio * figures['overlay_pixels'],
+            'movie_png': 0 if single or (script.stream and not script.keepframes) else
+            nframes * 3 * width * height * png_ratio}
+    disk = {key: int(value) for key, value in disk.items()}
+    disk['peak'] = sum(disk.values())
+    # decoded images held by each compositor process (all panels and the composed frame), converter threads
+    # and the reorder buffer of the streaming encoder
+    frame_bytes = 3 * width * height
+    memory = max(script.jobs * (3 * sum(sc.resolution[0] * sc.resolution[1] for sc in script.scenes) + frame_bytes),
+                 script.jobs * 2 * 3 * largest) + (STREAM_BUFFER * frame_bytes if script.stream else 0)
+    wall, runs = estimate(script, amounts, history)
+    return {'name': script.name, 'fps': script.fps, 'frames': nframes, 'resolution': [width, height],
+            'scenes': scenes, 'stages': stages, 'subprocesses': subprocesses, 'disk': disk, 'memory': memory,
+            'wall': wall, 'wall_total': None if None in wall.values() else sum(wall.values()), 'history_runs': runs,
+            'history_file': history_file}
+
+
+def report(result):
+    """
+    Formats a plan for the console
+    :param result: dict, as returned by plan()
+    :return: str
+    """
+    def size(nbytes):
+        return '{:.1f} MB'.format(nbytes / 2**20)
+
+    lines = ["Plan for '{}': {} frames at {:g} fps, {}x{}".format(result['name'], result['frames'], result['fps'],
+                                                                  *result['resolution']),
+             '{:<20} {:>8} {:>9} {:>9} {:>11} {:>6}'.format('scene', 'frames', 'rendered', 'repeated', 'resolution',
+                                                            'VMDs')]
+    for name, scene in result['scenes'].items():
+        lines.append('{:<20} {:>8} {:>9} {:>9} {:>11} {:>6}'.format(name, scene['frames'], scene['rendered'],
+                                                                    scene['repeated'],
+                                                                    '{}x{}'.format(*scene['resolution']),
+                                                                    scene['vmd_processes']))
+    lines.append('Frames per stage: ' + ', '.join('{} {}'.format(*item) for item in result['stages'].items()))
+    lines.append('Subprocesses: ' + ', '.join('{} {}'.format(*item) for item in result['subprocesses'].items()) +
+                 ' ({} in total)'.format(sum(result['subprocesses'].values())))
+    lines.append('Peak intermediate disk usage: {} ('.format(size(result['disk']['peak'])) +
+                 ', '.join('{} {}'.format(key, size(value)) for key, value in result['disk'].items()
+                           if key != 'peak') + ')')
+    lines.append('Peak memory for images: {}'.format(size(result['memory'])))
+    if result['wall_total'] is not None:
+        lines.append('Estimated wall time: {:.1f} s, based on {} previous run(s) ('.format(result['wall_total'],
+                                                                                         result['history_runs']) +
+                     ', '.join('{} {:.1f} s'.format(*item) for item in result['wall'].items() if item[1]) + ')')
+    elif result['history_runs']:
+        lines.append('Estimated wall time: unknown for ' + ', '.join(stage for stage, wall in result['wall'].items()
+                                                                     if wall is None) + ', not measured before')
+    else:
+        lines.append('Estimated wall time: unknown, no previous runs were recorded in '
+                     '{}'.format(result['history_file']))
+    return '\n'.join(lines)
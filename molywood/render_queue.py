@@ -0,0 +1,229 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from subprocess import call
+
+if __package__:
+    from . import image_io
+else:
+    import image_io
+
+
+class TachyonQueue:
+    """
+    Feeds Tachyon scene descriptions (.dat files) exported
+    by VMD to a pool of concurrently running Tachyon
+    processes as soon as they appear on disk, so that
+    ray-tracing overlaps with the VMD export loop
+    """
+    def __init__(self, tachyon, jobs, threads=None, poll_interval=0.05):
+        self.tachyon = tachyon
+        self.jobs = jobs
+        self.threads = threads if threads else max(1, (os.cpu_count() or 1) // jobs)
+        self.poll_interval = poll_interval
+        self.on_frame = None  # optional callback, called as on_frame(scene_name, frame) once a .tga is ready
+        self.on_failure = None  # optional callback, called as on_failure(scene_name, frame) if a frame fails
+        self.vmd_time = [None, None]
+        self.intervals = []
+        self.failed = []
+        self.tracer = None  # optional tracing.Tracer, records a span for every ray-traced frame
+        self._lock = threading.Lock()
+
+    def command(self, scene, frame):
+        """
+        The shell command used to ray-trace a single frame
+        :param scene: Scene, the scene the frame belongs to
+        :param frame: int, frame number
+        :return: str, the command
+        """
+        return '"{}" -aasamples 12 -numthreads {} {sc}-{fr}.dat -format TARGA -o {sc}-{fr}.tga ' \
+               '-res {}'.format(self.tachyon, self.threads, ' '.join(str(x) for x in scene.resolution),
+                                sc=scene.name, fr=frame)
+
+    def trace(self, scene, frame):
+        """
+        Ray-traces a single frame and records the time
+        interval the Tachyon process was running
+        :param scene: Scene, the scene the frame belongs to
+        :param frame: int, frame number
+        :return: None
+        """
+        start = time.time()
+        with self.tracer.span('tachyon', 'frame', scene=scene.name, frame=frame) if self.tracer else nullcontext():
+            result = call(self.command(scene, frame), shell=True)
+            if self.tracer:
+                self.tracer.count(1, ['{}-{}.tga'.format(scene.name, frame)])
+        end = time.time()
+        error = None if result == 0 else 'Tachyon exited with code {}'.format(result)
+        if result == 0:
+            os.remove('{}-{}.dat'.format(scene.name, frame))
+            if self.on_frame:
+                try:
+                    self.on_frame(scene.name, frame)
+                except Exception as err:  # e.g. a truncated image or an encoder that quit; nobody else would see it
+                    error = '{}: {}'.format(type(err).__name__, err)
+        with self._lock:
+            self.intervals.append((start, end))
+            if error:
+                self.failed.append('{}-{} ({})'.format(scene.name, frame, error))
+        if error and self.on_failure:
+            self.on_failure(scene.name, frame)
+
+    def run(self, scene, frames, processes):
+        """
+        Watches the working directory for .dat files
+        of the requested frames while the VMD processes
+        are running, and submits them to the Tachyon pool
+        :param scene: Scene, the scene being rendered
+        :param frames: iterable of ints, frames that VMD is expected to export
+        :param processes: list of subprocess.Popen, the running VMD processes
+        :return: None
+        """
+        pending = set(frames)
+        self.vmd_time[0] = time.time()
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while pending:
+                vmd_running = any(proc.poll() is None for proc in processes)
+                if not vmd_running and self.vmd_time[1] is None:
+                    self.vmd_time[1] = time.time()
+                ready = [fr for fr in pending if os.path.isfile('{}-{}.dat'.format(scene.name, fr))]
+                for fr in sorted(ready):
+                    pending.discard(fr)
+                    futures.append(pool.submit(self.trace, scene, fr))
+                if not ready and not vmd_running:
+                    break
+                if not ready:
+                    time.sleep(self.poll_interval)
+        if self.vmd_time[1] is None:
+            self.vmd_time[1] = time.time()
+        for future in futures:  # errors outside of Tachyon and the callbacks
+            future.result()
+        if pending:
+            raise RuntimeError('VMD finished without exporting frames {} of scene '
+                               '{}'.format(', '.join(str(x) for x in sorted(pending)), scene.name))
+        if self.failed:
+            raise RuntimeError('The following frames could not be rendered: {}'.format(', '.join(self.failed)))
+
+    def overlap(self):
+        """
+        Calculates how much of the total Tachyon busy time
+        (the union of all ray-tracing intervals) overlapped
+        with the VMD export loop
+        :return: tuple, (Tachyon busy time, overlapping time, wall time), all in seconds
+        """
+        busy, overlapping, last_end = 0.0, 0.0, None
+        for start, end in sorted(self.intervals):
+            if last_end is not None and start < last_end:
+                start = last_end
+            if end <= start:
+                continue
+            busy += end - start
+            overlapping += max(0.0, min(end, self.vmd_time[1]) - max(start, self.vmd_time[0]))
+            last_end = end
+        wall = max([end for _, end in self.intervals] + [self.vmd_time[1]]) - self.vmd_time[0]
+        return busy, overlapping, wall
+
+    def report(self, scene_name):
+        """
+        Prints the overlap between VMD and Tachyon
+        achieved for a scene
+        :param scene_name: str, name of the scene
+        :return: None
+        """
+        busy, overlapping, wall = self.overlap()
+        vmd = self.vmd_time[1] - self.vmd_time[0]
+        print('Scene {}: VMD export {:.1f} s, Tachyon busy {:.1f} s ({} jobs x {} threads), {:.1f} s of which '
+              'overlapped with VMD ({:.0f}%); total wall time {:.1f} s'.format(scene_name, vmd, busy, self.jobs,
+                                                                               self.threads, overlapping,
+                                                                               100 * overlapping / busy if busy
+                                                                               else 0, wall))
+
+
+class FrameConverter:
+    """
+    Converts the TGA frames written by Tachyon (or VMD's
+    snapshot renderer) to PNG in a pool of threads, in
+    process, as soon as each frame is complete rather
+    than after the whole scene has been rendered
+    """
+    def __init__(self, jobs, compression=1, poll_interval=0.05):
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        self.compression = compression  # these are intermediate files, so speed matters more than size
+        self.poll_interval = poll_interval
+        self.on_frame = None  # optional callback, called as on_frame(scene_name, frame) once a .png is ready
+        self.tracer = None  # optional tracing.Tracer, records a span for every converted frame
+        self.futures = []
+
+    def convert(self, scene_name, frame):
+        """
+        Converts a single frame and removes the TGA file,
+        as well as the Tachyon scene file if still present
+        :param scene_name: str, name of the scene
+        :param frame: int, frame number
+        :return: None
+        """
+        tgafile = '{}-{}.tga'.format(scene_name, frame)
+        with self.tracer.span('convert', 'frame', scene=scene_name, frame=frame) if self.tracer else nullcontext():
+            image_io.write_png('{}-{}.png'.format(scene_name, frame), image_io.read_tga(tgafile), self.compression)
+            if self.tracer:
+                self.tracer.count(files=['{}-{}.png'.format(scene_name, frame)])
+        os.remove(tgafile)
+        if os.path.isfile('{}-{}.dat'.format(scene_name, frame)):
+            os.remove('{}-{}.dat'.format(scene_name, frame))
+        if self.on_frame:
+            self.on_frame(scene_name, frame)
+
+    def submit(self, scene_name, frame):
+        """
+        Schedules the conversion of a complete frame
+        :param scene_name: str, name of the scene
+        :param frame: int, frame number
+        :return: None
+        """
+        self.futures.append(self.pool.submit(self.convert, scene_name, frame))
+
+    def watch(self, scene_name, ranges, processes):
+        """
+        Converts frames rendered by VMD with inline Tachyon
+        while VMD is running: each process renders its range
+        in order, so a frame is complete once the scene file
+        of the following frame has been exported; remaining
+        frames are converted once the processes finish
+        :param scene_name: str, name of the scene
+        :param ranges: list of iterables of ints, frames rendered by each process, in order
+        :param processes: list of subprocess.Popen, the running VMD processes
+        :return: None
+        """
+        start = time.time() - 1  # ignores scene files left over by earlier runs
+        pending = [list(frames) for frames in ranges]
+
+        def exported(fr):
+            datfile = '{}-{}.dat'.format(scene_name, fr)
+            return os.path.isfile(datfile) and os.path.getmtime(datfile) >= start
+
+        while True:
+            running = any(proc.poll() is None for proc in processes)
+            for frames in pending:
+                while len(frames) > 1 and exported(frames[1]):
+                    self.submit(scene_name, frames.pop(0))
+            if not running:
+                break
+            time.sleep(self.poll_interval)
+        for frames in pending:
+            for fr in frames:
+                if os.path.isfile('{}-{}.tga'.format(scene_name, fr)):
+                    self.submit(scene_name, fr)
+
+    def finish(self):
+        """
+        Waits for all conversions to complete
+        :return: None
+        """
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.pool.shutdown()
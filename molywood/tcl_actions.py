@@ -1,4 +1,12 @@
-import numpy as np
+import re
+from functools import reduce
+from math import gcd
+
+
+if __package__:
+    from . import trajectory
+else:
+    import trajectory
 
 
 def sigmoid_increments(n_points, abruptness):
@@ -9,6 +17,7 @@ def sigmoid_increments(n_points, abruptness):
     :param abruptness: float, how fast the transition is
     :return: numpy.array, array of increments
     """
+    import numpy as np
     scale_range = (-5, 5)
     points = np.linspace(*scale_range, n_points)
     increments = logistic_deriv(points, abruptness)
@@ -23,6 +32,7 @@ def sigmoid_norm_sum(cumsum, n_points, abruptness=1):
     :param abruptness: float, how fast the transition is
     :return: numpy.array, array of increments
     """
+    import numpy as np
     increments = sigmoid_increments(n_points, abruptness)
     return cumsum*increments/np.sum(increments)
 
@@ -35,6 +45,7 @@ def sigmoid_norm_prod(cumprod, n_points, abruptness=1):
     :param abruptness: float, how fast the transition is
     :return: numpy.array, array of increments
     """
+    import numpy as np
     increments = np.array(1) + sigmoid_increments(n_points, abruptness)
     prod = np.prod(increments)
     exponent = np.log(cumprod)/np.log(prod)
@@ -55,6 +66,7 @@ def sigmoid_norm_sum_linear_mid(cumsum, n_points, abruptness=1, fraction_linear=
     :param fraction_linear: float, fraction of the action spent in the linear regime
     :return: numpy.array, array of increments
     """
+    import numpy as np
     n_points_sigm = int(n_points * (1-fraction_linear))
     n_points_linear = n_points - n_points_sigm
     increments = sigmoid_increments(n_points_sigm, abruptness)
@@ -73,6 +85,7 @@ def logistic(x, k):
     :param k: transition abruptness
     :return: numpy.array, values of the logistic fn
     """
+    import numpy as np
     return np.array(1/(1+np.exp(-k*x)))
 
 
@@ -84,6 +97,7 @@ def logistic_deriv(x, k):
     :param k: transition abruptness
     :return: numpy.array, values of the logistic fn derivative
     """
+    import numpy as np
     logi = logistic(x, k)
     return np.array(logi*(1-logi))
 
@@ -104,24 +118,38 @@ def gen_loop(action):
     iterators = gen_iterators(action)
     command = gen_command(action)
     cleanups = gen_cleanup(action)
-    code = "\n\nset fr {}\n".format(action.initframe)
+    start, first = 0, 0
+    code = ''
+    if action.scene.render_range and action.scene.stateless:
+        # since the state of each frame is absolute, frames preceding the range can be skipped altogether
+        first = action.scene.render_range[0]
+        start = min(max(first - action.initframe, 0), action.framenum)
+        if action.setup_state.traj_frame is not None and start > 0:
+            code += "\n" + goto(action.scene, action.setup_state.traj_frame)
+    code += "\n\nset fr {}\n".format(action.initframe + start)
     for act in setup.keys():
         code = code + setup[act]
-    for act in iterators.keys():
-        code += 'set {} [list {}]\n'.format(act, iterators[act])
-    if action.framenum > 0:
-        code += 'for {{set i 0}} {{$i < {}}} {{incr i}} {{\n'.format(action.framenum)
+    if 0 < first and action.initframe <= first < action.initframe + action.framenum:
+        # state carried over from the skipped frames
+        code += gen_state(action.scene.keyframes[first], action.scene)
+    if action.framenum > start:
+        for act in iterators.keys():
+            code += 'set {} [list {}]\n'.format(act, iterators[act])
+        code += 'for {{set i {}}} {{$i < {}}} {{incr i}} {{\n'.format(start, action.framenum)
+        if action.scene.render_range:
+            code += '  if {$fr >= $render_last} {exit}\n'
         for act in command.keys():
             code = code + '  ' + command[act]
         if action.scene.script.do_render:
-            code += '  puts "rendering frame: $fr"\n'
-            if action.scene.script.draft:
-                code += '  render snapshot {sc}-$fr.tga\n'.format(sc=action.scene.name)
+            conditions = []
+            if action.scene.render_range:
+                conditions.append('$fr >= $render_first')
+            if action.scene.render_frames is not None:  # only frames missing from the cache are rendered
+                conditions.append('[info exists render_frames($fr)]')
+            if conditions:
+                code += '  if {{{}}} {{\n{}  }}\n'.format(' && '.join(conditions), gen_render(action, '    '))
             else:
-                code += '  render Tachyon {sc}-$fr.dat\n  \"$env(TACHYON_BIN)\" ' \
-                        '-aasamples 12 {sc}-$fr.dat -format TARGA -o {sc}-$fr.tga -res {rs}' \
-                        '\n'.format(sc=action.scene.name, rs=' '.join(str(x) for x in action.scene.resolution),
-                                    tc=action.scene.tachyon)
+                code += gen_render(action)
         else:
             code += '  puts "frame: $fr"\n  after {}\n  display update\n'.format(str(int(1000/action.scene.script.fps)))
         code += '  incr fr\n}\n'
@@ -130,6 +158,30 @@ def gen_loop(action):
     return code
 
 
+def gen_render(action, indent='  '):
+    """
+    Produces the TCL code that renders a single frame
+    (either as a snapshot in draft mode, or through
+    Tachyon, optionally restricted to a number of threads)
+    :param action: Action or SimultaneousAction, object to extract info from
+    :param indent: str, indentation of the produced lines
+    :return: str, formatted TCL code
+    """
+    code = '{ind}puts "rendering frame: $fr"\n'.format(ind=indent)
+    if action.scene.script.draft:
+        code += '{ind}render snapshot {sc}-$fr.tga\n'.format(ind=indent, sc=action.scene.name)
+    elif action.scene.script.tachyon_jobs:  # ray-tracing is done outside of VMD, see render_queue.py
+        code += '{ind}render Tachyon {sc}-$fr.dat.part\n' \
+                '{ind}file rename -force {sc}-$fr.dat.part {sc}-$fr.dat\n'.format(ind=indent, sc=action.scene.name)
+    else:
+        threads = '-numthreads {} '.format(action.scene.tachyon_threads) if action.scene.tachyon_threads else ''
+        code += '{ind}render Tachyon {sc}-$fr.dat\n{ind}\"$env(TACHYON_BIN)\" ' \
+                '-aasamples 12 {th}{sc}-$fr.dat -format TARGA -o {sc}-$fr.tga -res {rs}' \
+                '\n'.format(ind=indent, sc=action.scene.name, th=threads,
+                            rs=' '.join(str(x) for x in action.scene.resolution))
+    return code
+
+
 def gen_setup(action):
     """
     Some actions (e.g. centering) require a setup step that
@@ -144,6 +196,9 @@ def gen_setup(action):
             new_center_selection = action.parameters['selection']
         except KeyError:
             raise ValueError('With center_view, you need to specify a selection (vmd-compatible syntax, in quot marks)')
+        center = precomputed_center(action, new_center_selection)
+        if center is not None:
+            setups['ctr'] = 'molinfo top set center [list {{{:.4f} {:.4f} {:.4f}}}]\n'.format(*center)
         else:
             setups['ctr'] = 'set csel [atomselect top "{}"]\nset gc [veczero]\nforeach coord [$csel get {{x y z}}] ' \
                             '{{\n  set gc [vecadd $gc $coord]\n}}\n' \
@@ -242,11 +297,13 @@ def gen_setup(action):
                          'label textsize {}\n' \
                          'label textthickness 3\n' \
                          'mol top 0\n\n'.format(alias, alias, label_color, tsize)
-        setups['add'] += reposition_dummies(sel1, sel2)
-        setups['add'] += 'set num_steps [molinfo top get numframes]\n' \
-                         'for {{set frame 0}} {{$frame < $num_steps}} {{incr frame}} {{\n' \
-                         '  animate goto $frame\n' \
-                         '  reposition_dummies $newmol{}}}\n\n'.format(alias)
+        positions = precomputed_dummies(action, sel1, sel2)
+        if positions is not None:
+            setups['add'] += load_dummies()
+            setups['add'] += 'load_dummies $newmol{} {{{}}}\n\n'.format(alias, positions)
+        else:
+            setups['add'] += reposition_dummies(sel1, sel2)
+            setups['add'] += 'reposition_dummies $newmol{} {}\n\n'.format(alias, distance_frames(action))
         setups['add'] += 'animate goto $currframe\n\n' \
                          'display resetview\n'
         setups['add'] += 'retr_vp 1\n'  # re-align all after display resetview
@@ -298,47 +355,30 @@ def gen_setup(action):
                               'mol addrep top\n'.format(*style_params[style], cl, lb, sel)
     if 'fit_trajectory' in action.action_type:
         sel = action.parameters['selection']
-        try:
-            axis = action.parameters['axis']
-        except KeyError:
-            axis = None
-            setups['ftr'] = ''
+        axis = fit_axis(action)
+        plan = fit_moves(action)
+        if plan is not None:
+            setups['ftr'] = fit_apply()
+            if action.framenum == 0:
+                setups['ftr'] += 'fit_apply {{{}}}\n'.format(plan['setup'])
         else:
-            if axis.lower() == 'z':
-                axis = '0 0 1'
-            elif axis.lower() == 'y':
-                axis = '0 1 0'
-            elif axis.lower() == 'x':
-                axis = '1 0 0'
-            elif len(axis.split()) == 3:
-                axis = np.array([float(q) for q in axis.split()])
-                axis = ' '.join(str(q) for q in axis/np.linalg.norm(axis))
+            if axis is None:
+                setups['ftr'] = ''
             else:
-                raise RuntimeError("The 'axis' keyword in fit_trajectory could not be understood")
-            setups['ftr'] = sel_it()
-            setups['ftr'] += geom_center()
-            setups['ftr'] += mevsvd()
-            setups['ftr'] += calc_principalaxes()
-            setups['ftr'] += set_orientation()
-        setups['ftr'] += fit_slow(sel, axis)
-        setups['ftr'] += scale_fit()
-        if action.framenum == 0:
-            setups['ftr'] += "fit_slow 1.0\n"
-    if 'rotate' in action.action_type:
-        if action.framenum == 0:  # TODO not from params
-            angle = action.parameters['angle']
-            check_if_convertible(angle, float, 'angle')
-            axis = action.parameters['axis']
-            if axis.lower() not in 'xyz':
-                raise RuntimeError("'axis' must be either 'x', 'y' or 'z', {} was given instead".format(axis))
-            setups['rot'] = 'rotate {} by {}\n'.format(axis.lower(), angle)
-    if 'zoom_in' in action.action_type or 'zoom_out' in action.action_type:
+                setups['ftr'] = sel_it()
+                setups['ftr'] += geom_center()
+                setups['ftr'] += mevsvd()
+                setups['ftr'] += calc_principalaxes()
+                setups['ftr'] += set_orientation()
+            setups['ftr'] += fit_slow(sel, axis)
+            setups['ftr'] += scale_fit()
+            if action.framenum == 0:
+                setups['ftr'] += "fit_slow 1.0\n"
+    if 'rotate' in action.action_type or 'zoom_in' in action.action_type or 'zoom_out' in action.action_type:
         if action.framenum == 0:
-            scale = action.parameters['scale']
-            check_if_convertible(scale, float, 'scale')
-            prefix = 'zin' if 'zoom_in' in action.action_type else 'zou'
-            scale = scale if 'zoom_in' in action.action_type else str(1/float(scale))
-            setups[prefix] = 'scale by {}\n'.format(scale)
+            prefix = 'rot' if 'rotate' in action.action_type else 'zin' if 'zoom_in' in action.action_type else 'zou'
+            setups[prefix] = 'apply_view {{{}}} {}\n'.format(tcl_matrix(action.setup_state.rotation),
+                                                            round(action.setup_state.scale, 8))
     return setups
 
 
@@ -346,12 +386,39 @@ def gen_iterators(action):
     """
     to serve both Action and SimultaneousAction, we return
     a dictionary with three-letter labels and a list of
-    values already formatted as a string
+    values already formatted as a string; rotations and
+    zooms are not iterated incrementally, but instead
+    expressed through absolute per-frame views (see keyframes.py)
     :param action: Action or SimultaneousAction, object to extract info from
     :return: dict, formatted as label: iterator
     """
     iterators = {}
     num_precision = 5
+    arrays = gen_arrays(action)
+    for lb in arrays.keys():
+        if lb == 'ani':
+            iterators[lb] = ' '.join([str(int(el)) for el in arrays[lb]])
+        elif not (lb in action.rots.keys() or lb in ['zin', 'zou']):
+            iterators[lb] = ' '.join([str(round(el, num_precision)) for el in arrays[lb]])
+    if 'ftr' in iterators.keys() and fit_moves(action) is not None:
+        iterators['ftr'] = ' '.join(['{{{}}}'.format(moves) for moves in fit_moves(action)['frames']])
+    if changes_view(action):
+        states = action.scene.keyframes[action.initframe:action.initframe + action.framenum]
+        iterators['vie'] = ' '.join(['{{{}}}'.format(tcl_matrix(st.rotation)) for st in states])
+        iterators['vsc'] = ' '.join([str(round(st.scale, 8)) for st in states])
+    return iterators
+
+
+def gen_arrays(action):
+    """
+    Calculates the per-frame values (increments for rotations
+    and zooms, absolute values for opacities, trajectory frames
+    and fitting) of all actions that evolve over time
+    :param action: Action or SimultaneousAction, object to extract info from
+    :return: dict, formatted as label: numpy.array
+    """
+    import numpy as np
+    arrays = {}
     sigmoid, sls, abruptness = check_sigmoid(action.parameters)
     if 'rotate' in action.action_type:
         if action.framenum > 0:
@@ -364,7 +431,7 @@ def gen_iterators(action):
                     arr = sigmoid_norm_sum_linear_mid(float(angle), action.framenum, abruptness)
                 else:
                     arr = np.ones(action.framenum) * float(angle)/action.framenum
-                iterators[rkey] = ' '.join([str(round(el, num_precision)) for el in arr])
+                arrays[rkey] = arr
     if 'zoom_in' in action.action_type:
         if action.framenum > 0:
             scale = action.parameters['scale']
@@ -373,7 +440,7 @@ def gen_iterators(action):
                 arr = sigmoid_norm_prod(float(scale), action.framenum, abruptness)
             else:
                 arr = np.ones(action.framenum) * float(scale)**(1/action.framenum)
-            iterators['zin'] = ' '.join([str(round(el, num_precision)) for el in arr])
+            arrays['zin'] = arr
     if 'zoom_out' in action.action_type:
         if action.framenum > 0:
             scale = action.parameters['scale']
@@ -382,7 +449,7 @@ def gen_iterators(action):
                 arr = sigmoid_norm_prod(1/float(scale), action.framenum, abruptness)
             else:
                 arr = np.ones(action.framenum) * 1/(float(scale)**(1/action.framenum))
-            iterators['zou'] = ' '.join([str(round(el, num_precision)) for el in arr])
+            arrays['zou'] = arr
     if 'fit_trajectory' in action.action_type:
         if action.framenum > 0:
             if sigmoid:
@@ -391,7 +458,7 @@ def gen_iterators(action):
                 arr = np.ones(action.framenum)/action.framenum
             carr = np.cumsum(arr)[::-1]
             arr /= carr
-            iterators['ftr'] = ' '.join([str(round(el, num_precision)) for el in arr])
+            arrays['ftr'] = arr
     if 'make_transparent' in action.action_type or 'make_opaque' in action.action_type:
         for t_ch in action.transp_changes.keys():
             try:
@@ -416,13 +483,13 @@ def gen_iterators(action):
                     arr = start + np.cumsum(sigmoid_norm_sum(until-start, action.framenum, abruptness))
             else:
                 arr = np.linspace(start, until, action.framenum)
-            iterators[t_ch] = ' '.join([str(round(el, num_precision)) for el in arr])
+            arrays[t_ch] = arr
     if 'animate' in action.action_type:
         animation_frames = [x for x in action.parameters['frames'].split(':')]
         for val in animation_frames:
             check_if_convertible(val, int, 'frames')
         arr = np.linspace(int(animation_frames[0]), int(animation_frames[1]), action.framenum).astype(int)
-        iterators['ani'] = ' '.join([str(int(el)) for el in arr])
+        arrays['ani'] = arr
     if 'highlight' in action.action_type:
         hls = [action.highlights[x] for x in action.highlights.keys()]
         hl_labels = list(action.highlights.keys())
@@ -441,8 +508,8 @@ def gen_iterators(action):
                 arr = np.concatenate((arr, np.ones(action.framenum - 2*margin), arr[::-1]))
             else:
                 raise RuntimeError('"mode" should be "u", "d" or "ud"')
-            iterators[lb] = ' '.join([str(round(el, num_precision)) for el in arr])
-    return iterators
+            arrays[lb] = arr
+    return arrays
 
 
 def gen_command(action):
@@ -455,34 +522,24 @@ def gen_command(action):
     :return: dict, formatted as label: TCL command
     """
     commands = {}
-    if 'rotate' in action.action_type:
-        if action.framenum > 0:
-            for rkey in action.rots.keys():
-                axis = action.rots[rkey]['axis']
-                if axis.lower() not in 'xyz':
-                    raise RuntimeError("'axis' must be either 'x', 'y' or 'z', {} was given instead".format(axis))
-                commands[rkey] = "set t [lindex ${} $i]\n" \
-                                 "  rotate {} by $t\n".format(rkey, axis.lower())
+    if changes_view(action):
+        commands['vie'] = "set t [lindex $vie $i]\n" \
+                          "  apply_view $t [lindex $vsc $i]\n"
     if 'make_transparent' in action.action_type or 'make_opaque' in action.action_type:
         for t_ch in action.transp_changes.keys():
             material = action.transp_changes[t_ch]['material']
             commands[t_ch] = "set t [lindex ${} $i]\n" \
                              "  material change opacity {} $t\n".format(t_ch, material)
-    if 'zoom_in' in action.action_type:
-        if action.framenum > 0:
-            commands['zin'] = "set t [lindex $zin $i]\n" \
-                              "  scale by $t\n"
-    elif 'zoom_out' in action.action_type:
-        if action.framenum > 0:
-            commands['zou'] = "set t [lindex $zou $i]\n" \
-                              "  scale by $t\n"
     if 'animate' in action.action_type:
         commands['ani'] = "set t [lindex $ani $i]\n" \
-                          "  animate goto $t\n"
+                          "  {}\n".format(goto(action.scene, '$t'))
     if 'fit_trajectory' in action.action_type:
         if action.framenum > 0:
-            commands['ftr'] = "set t [lindex $ftr $i]\n" \
-                              "  fit_slow $t\n"
+            if fit_moves(action) is not None:
+                commands['ftr'] = "fit_apply [lindex $ftr $i]\n"
+            else:
+                commands['ftr'] = "set t [lindex $ftr $i]\n" \
+                                  "  fit_slow $t\n"
     if 'highlight' in action.action_type:
         hls = [action.highlights[x] for x in action.highlights.keys()]
         hl_labels = list(action.highlights.keys())
@@ -501,18 +558,364 @@ def gen_command(action):
 
 def gen_cleanup(action):
     cleanups = {}
-    if 'fit_trajectory' in action.action_type:
-        flag = False
-        current = action.scene.actions.index(action)
-        for ac in action.scene.actions[current+1:]:
-            if 'animate' in ac.action_type:
-                flag = True
-        if flag:
+    if 'fit_trajectory' in action.action_type and fit_cleanup(action):
+        if fit_moves(action) is not None:
+            cleanups['ftr'] = 'fit_apply {{{}}}\n\n'.format(fit_moves(action)['cleanup'])
+        else:
             cleanups['ftr'] = fit_slow(action.parameters['selection'], None)
             cleanups['ftr'] += "fit_slow 1 1\n\n"
     return cleanups
 
 
+def fit_cleanup(action):
+    """
+    After fit_trajectory, the whole trajectory is fitted
+    once more if it is going to be animated later on
+    :param action: Action or SimultaneousAction, the fit_trajectory action
+    :return: bool
+    """
+    current = action.scene.actions.index(action)
+    return any('animate' in ac.action_type for ac in action.scene.actions[current+1:])
+
+
+def fit_axis(action):
+    """
+    :param action: Action or SimultaneousAction, the fit_trajectory action
+    :return: str, the normalized axis as a TCL vector, or None if no axis was given
+    """
+    import numpy as np
+    try:
+        axis = action.parameters['axis']
+    except KeyError:
+        return None
+    if axis.lower() == 'z':
+        return '0 0 1'
+    elif axis.lower() == 'y':
+        return '0 1 0'
+    elif axis.lower() == 'x':
+        return '1 0 0'
+    elif len(axis.split()) == 3:
+        axis = np.array([float(q) for q in axis.split()])
+        return ' '.join(str(q) for q in axis/np.linalg.norm(axis))
+    raise RuntimeError("The 'axis' keyword in fit_trajectory could not be understood")
+
+
+def fit_moves(action):
+    """
+    :param action: Action or SimultaneousAction, the fit_trajectory action
+    :return: dict with the precomputed moves of the action (see fit_plan), formatted for fit_apply,
+    or None if fitting is done in VMD
+    """
+    plan = getattr(action.scene, 'fit_plan', None)
+    if plan is None:
+        return None
+    return plan[action.scene.actions.index(action)]
+
+
+def loaded_frames(span, base, total):
+    """
+    Frames present in the molecule when the trajectory
+    is loaded by load_trajectory (or in full)
+    :param span: tuple, (first, last, step) as returned by trajectory_span, or None
+    :param base: int, number of frames in the structure file
+    :param total: int, number of frames in the structure and trajectory files
+    :return: list of ints, frame numbers in the full trajectory, in the order they are loaded
+    """
+    if span is None:
+        return list(range(total))
+    first, last, step = span
+    traj_first, traj_step = (0, 1) if first < base else (first - base, step)
+    return list(range(base)) + list(range(base + traj_first, min(last, total - 1) + 1, traj_step))
+
+
+def fit_plan(scene):
+    """
+    Works out in advance what every fit_slow call of the
+    scene would do: with the coordinates read in Python,
+    the least-squares fits (or principal axes) are computed
+    for all frames at once, the progressive scaling of
+    scale_fit is applied to the resulting matrices, and
+    only the moves of each frame have to be applied in VMD
+    :param scene: Scene, the scene to be rendered (keyframes, traj_span and precompute have to be set)
+    :return: dict, action index: {'setup': moves, 'frames': list of moves, 'cleanup': moves}, with moves
+    formatted for fit_apply; None if there is nothing to fit or it has to be done in VMD
+    """
+    import numpy as np
+    fits = [n for n, ac in enumerate(scene.actions) if 'fit_trajectory' in ac.action_type]
+    if scene.precompute is None or not fits:
+        return None
+    coordinates = scene.precompute.coordinates
+    loaded = loaded_frames(scene.traj_span, len(coordinates.models), len(coordinates))
+    smooth = 0
+    if scene.visualization:
+        match = re.search(r'^mol smoothrep \S+ 0 (\d+)', open(scene.visualization).read(), re.M)
+        smooth = int(match.group(1)) if match else 0
+    calls = []  # (action index, stage, current frame, smoothing, fraction, whole trajectory)
+    for n in fits:
+        action = scene.actions[n]
+        if action.framenum == 0:
+            calls.append((n, 'setup', action.setup_state, 1.0, False))
+        arrays = gen_arrays(action)
+        for i in range(action.framenum):
+            calls.append((n, i, scene.keyframes[action.initframe + i], arrays['ftr'][i], False))
+        if fit_cleanup(action):
+            last = scene.keyframes[action.initframe + action.framenum - 1] if action.framenum else action.setup_state
+            calls.append((n, 'cleanup', last, 1.0, True))
+    currents, windows = [], []
+    for n, stage, state, fraction, whole in calls:
+        if state.traj_frame is None:
+            current = len(loaded) - 1  # VMD shows the last frame after loading
+        elif int(state.traj_frame) in loaded:
+            current = loaded.index(int(state.traj_frame))
+        else:
+            return None
+        width = smooth if state.smooth is None else state.smooth
+        currents.append(current)
+        windows.append(list(range(len(loaded))) if whole else
+                       list(range(max(current - width, 0), min(current + width + 1, len(loaded)))))
+    try:
+        pairs, oriented = {}, {}
+        for (n, stage, state, fraction, whole), current, window in zip(calls, currents, windows):
+            sel = scene.actions[n].parameters['selection']
+            if whole or fit_axis(scene.actions[n]) is None:
+                pairs.setdefault(sel, set()).update((loaded[fr], loaded[current]) for fr in window)
+            else:
+                oriented.setdefault(sel, set()).update(loaded[fr] for fr in window)
+        fitted, centers, axes = {}, {}, {}
+        for sel, selected in pairs.items():
+            selected = sorted(selected)
+            matrices = scene.precompute.fit_matrices(sel, [p[0] for p in selected], [p[1] for p in selected])
+            fitted.update({(sel,) + pair: matrix for pair, matrix in zip(selected, matrices)})
+        for sel, selected in oriented.items():
+            selected = sorted(selected)
+            centers.update({(sel, fr): c for fr, c in zip(selected, scene.precompute.centers(sel, selected))})
+            axes.update({(sel, fr): a[0] for fr, a in zip(selected, scene.precompute.principal_axes(sel, selected))})
+    except trajectory.UnsupportedInput:
+        return None
+    transforms = np.tile(np.identity(4), (len(loaded), 1, 1))  # current coordinates = transform x original ones
+    plan = {n: {'setup': '', 'frames': [], 'cleanup': ''} for n in fits}
+    for (n, stage, state, fraction, whole), current, window in zip(calls, currents, windows):
+        sel = scene.actions[n].parameters['selection']
+        axis = None if whole else fit_axis(scene.actions[n])
+        if axis is None:
+            # fitting transformed coordinates equals transforming the fit of the original ones
+            original = np.array([fitted[(sel, loaded[fr], loaded[current])] for fr in window])
+            matrices = transforms[current] @ original @ np.linalg.inv(transforms[window])
+        else:
+            rotations = transforms[window][:, :3, :3]
+            moved_centers = np.einsum('fij,fj->fi', rotations, np.array([centers[(sel, loaded[fr])]
+                                                                         for fr in window]))
+            moved_centers += transforms[window][:, :3, 3]
+            moved_axes = np.einsum('fij,fj->fi', rotations, np.array([axes[(sel, loaded[fr])] for fr in window]))
+            matrices = trajectory.orientation_matrices(moved_centers, moved_axes, [float(q) for q in axis.split()])
+        matrices = trajectory.scale_fit(matrices, fraction)
+        transforms[window] = matrices @ transforms[window]
+        moves = ' '.join('{} {{{}}}'.format(fr, tcl_matrix(matrix)) for fr, matrix in zip(window, matrices)
+                         if not np.allclose(matrix, np.identity(4), atol=1e-7))
+        if stage in ['setup', 'cleanup']:
+            plan[n][stage] = moves
+        else:
+            plan[n]['frames'].append(moves)
+    return plan
+
+
+def changes_view(action):
+    """
+    Checks whether the camera (rotation or scale)
+    is modified by the action in the course of its frames
+    :param action: Action or SimultaneousAction, object to extract info from
+    :return: bool
+    """
+    return action.framenum > 0 and bool(set(action.action_type).intersection({'rotate', 'zoom_in', 'zoom_out'}))
+
+
+def tcl_matrix(matrix, precision=6):
+    """
+    Formats a 4x4 numpy array as a TCL list of rows,
+    as accepted e.g. by molinfo ... set rotate_matrix
+    :param matrix: numpy.array, the 4x4 transformation matrix
+    :param precision: int, number of decimal places
+    :return: str, formatted TCL list
+    """
+    return ' '.join(['{{{}}}'.format(' '.join([str(round(el, precision)) for el in row])) for row in matrix])
+
+
+def gen_state(state, scene=None):
+    """
+    Produces TCL code that sets the full (absolute) state
+    of the scene, so that rendering can start at any frame
+    :param state: keyframes.FrameState, the state to be set
+    :param scene: Scene, the scene the state belongs to (needed if only part of the trajectory is loaded)
+    :return: str, formatted TCL code
+    """
+    code = 'apply_view {{{}}} {}\n'.format(tcl_matrix(state.rotation), round(state.scale, 8))
+    for material in sorted(state.opacities.keys()):
+        code += 'material change opacity {} {}\n'.format(material, round(state.opacities[material], 5))
+    if state.traj_frame is not None:
+        code += goto(scene, state.traj_frame) + '\n'
+    return code
+
+
+def goto(scene, frame):
+    """
+    TCL command that displays a given trajectory frame;
+    if only part of the trajectory was loaded, the frame
+    number is translated by traj_index (see load_trajectory)
+    :param scene: Scene, the scene being animated
+    :param frame: int or str, frame number (or TCL variable) in the full trajectory
+    :return: str, TCL code
+    """
+    if getattr(scene, 'traj_span', None):
+        return 'animate goto [traj_index {}]'.format(frame)
+    return 'animate goto {}'.format(frame)
+
+
+def trajectory_span(scene):
+    """
+    Finds the span of trajectory frames the scene actually
+    visits (values of animate iterators, extended by the
+    smoothing window), so that only these have to be loaded;
+    the step is the largest one that still hits all of them
+    (scene.keyframes have to be computed beforehand)
+    :param scene: Scene, the scene being animated
+    :return: tuple, (first, last, step) in VMD frame numbering, or None if all frames are needed
+    """
+    visited = sorted({int(kf.traj_frame) for kf in scene.keyframes if kf.traj_frame is not None})
+    if not visited or scene.keyframes[0].traj_frame is None:
+        return None  # frames shown before the first animate display the last frame of the trajectory
+    smooth = max([int(ac.parameters['smooth']) for ac in scene.actions
+                  if 'animate' in ac.action_type and 'smooth' in ac.parameters.keys()] + [0])
+    step = reduce(gcd, [b - a for a, b in zip(visited[:-1], visited[1:])], 0) or 1
+    if smooth:
+        step = 1  # smoothing averages over neighboring frames, so none can be skipped
+    return max(0, visited[0] - smooth), visited[-1] + smooth, step
+
+
+def load_trajectory(filename, filetype, span, options='filebonds 1 autobonds 1 waitfor all'):
+    """
+    Loads a part of a trajectory into the top molecule, and
+    defines traj_index that translates frame numbers of the
+    full trajectory; frames already present in the molecule
+    (e.g. read from the structure file) are kept and counted
+    :param filename: str, path to the trajectory file
+    :param filetype: str, VMD file type
+    :param span: tuple, (first, last, step) as returned by trajectory_span
+    :param options: str, remaining options of mol addfile
+    :return: str, TCL code
+    """
+    first, last, step = span
+    return 'set traj_base [molinfo top get numframes]\n' \
+           'if {{{first} < $traj_base}} {{\n  set traj_first 0\n  set traj_step 1\n}} else {{\n' \
+           '  set traj_first [expr {{{first} - $traj_base}}]\n  set traj_step {step}\n}}\n' \
+           'set traj_last [expr {{{last} - $traj_base}}]\n' \
+           'if {{$traj_last >= 0}} {{\n  mol addfile {fname} type {ftype} first $traj_first last $traj_last ' \
+           'step $traj_step {opts}\n}}\n' \
+           'proc traj_index {{frame}} {{\n  global traj_base traj_first traj_step\n' \
+           '  if {{$frame < $traj_base}} {{return $frame}}\n' \
+           '  return [expr {{$traj_base + ($frame - $traj_base - $traj_first) / $traj_step}}]\n}}\n' \
+           ''.format(first=first, last=last, step=step, fname=filename, ftype=filetype, opts=options)
+
+
+def restrict_trajectory(code, span):
+    """
+    Rewrites a VMD visualization state so that only a span
+    of the trajectory is loaded; this is only done for the
+    usual single molecule with a single trajectory file
+    loaded in full, other states are left untouched
+    :param code: str, contents of the visualization state
+    :param span: tuple, (first, last, step) as returned by trajectory_span
+    :return: tuple, (TCL code, bool whether the state was rewritten)
+    """
+    lines = code.split('\n')
+    addfiles = [n for n, line in enumerate(lines) if line.startswith('mol addfile ')]
+    if span is None or len(addfiles) != 1 or len([ln for ln in lines if ln.startswith('mol new ')]) != 1:
+        return code, False
+    match = re.match(r'mol addfile (\S+) type (\S+) first 0 last -1 step 1 (.*)$', lines[addfiles[0]])
+    if not match:
+        return code, False
+    lines[addfiles[0]] = load_trajectory(match.group(1), match.group(2), span, match.group(3)).rstrip('\n')
+    return '\n'.join(lines), True
+
+
+def precomputed_center(action, selection):
+    """
+    Geometric center of a selection in the trajectory frame
+    shown when the action starts, computed in Python; frames
+    moved by fit_trajectory are left to VMD
+    :param action: Action or SimultaneousAction, the center_view action
+    :param selection: str, VMD-compatible selection
+    :return: numpy.array of shape (3,), or None if it has to be calculated in VMD
+    """
+    precompute = getattr(action.scene, 'precompute', None)
+    index = action.scene.actions.index(action)
+    if precompute is None or any('fit_trajectory' in ac.action_type for ac in action.scene.actions[:index + 1]):
+        return None
+    frame = action.setup_state.traj_frame
+    try:
+        return precompute.centers(selection, [-1 if frame is None else int(frame)])[0]
+    except trajectory.UnsupportedInput:
+        return None
+
+
+def shown_frames(action):
+    """
+    Trajectory frames displayed while the distance label
+    added by the action exists (None stands for the frame
+    shown before the trajectory is first animated)
+    :param action: Action or SimultaneousAction, the add_distance action
+    :return: list of ints or None
+    """
+    label = [lb for lb in action.setup_state.labels if lb[0] == 'Bonds'][-1]
+    states = [action.setup_state] + [st for st in action.scene.keyframes[action.initframe:] if label in st.labels]
+    return sorted({st.traj_frame for st in states}, key=lambda fr: -1 if fr is None else fr)
+
+
+def distance_frames(action):
+    """
+    Frames (as numbered in the loaded molecule) for which
+    reposition_dummies has to place the dummy atoms
+    :param action: Action or SimultaneousAction, the add_distance action
+    :return: str, TCL list
+    """
+    frames = []
+    for fr in shown_frames(action):
+        if fr is None:
+            frames.append('[expr {[molinfo 0 get numframes] - 1}]')
+        elif getattr(action.scene, 'traj_span', None):
+            frames.append('[traj_index {}]'.format(fr))
+        else:
+            frames.append(str(fr))
+    return '[list {}]'.format(' '.join(frames))
+
+
+def precomputed_dummies(action, sel1, sel2):
+    """
+    Positions of the dummy atoms of a distance label (the
+    centers of both selections) in all frames where the label
+    is shown, computed in Python; frames moved by fit_trajectory
+    are left to VMD
+    :param action: Action or SimultaneousAction, the add_distance action
+    :param sel1: str, VMD-compatible selection
+    :param sel2: str, VMD-compatible selection
+    :return: str, frames and positions formatted for load_dummies, or None if they have to be calculated in VMD
+    """
+    precompute = getattr(action.scene, 'precompute', None)
+    index = action.scene.actions.index(action)
+    if precompute is None or any('fit_trajectory' in ac.action_type for ac in action.scene.actions[:index + 1]):
+        return None
+    coordinates = precompute.coordinates
+    loaded = loaded_frames(action.scene.traj_span, len(coordinates.models), len(coordinates))
+    frames = [loaded[-1] if fr is None else int(fr) for fr in shown_frames(action)]
+    if any(fr not in loaded for fr in frames):
+        return None
+    try:
+        first, second = precompute.centers(sel1, frames), precompute.centers(sel2, frames)
+    except trajectory.UnsupportedInput:
+        return None
+    return ' '.join('{} {{{{{:.4f} {:.4f} {:.4f}}} {{{:.4f} {:.4f} {:.4f}}}}}'.format(loaded.index(fr), *a, *b)
+                    for fr, a, b in zip(frames, first, second))
+
+
 def check_if_convertible(string, object_type, param_name):
     try:
         _ = object_type(string)
@@ -539,15 +942,46 @@ def check_sigmoid(params_dict):
 
 # ---------------------------- TCL function definitions ---------------------------- #
 
+def apply_view():
+    code = 'set init_rot [lindex [molinfo top get rotate_matrix] 0]\n' \
+           'set init_scale [lindex [molinfo top get scale_matrix] 0]\n' \
+           'proc apply_view {rel scl} {\n' \
+           '  global init_rot init_scale\n' \
+           '  set rot [transmult $rel $init_rot]\n' \
+           '  set scale [transmult [list [list $scl 0 0 0] [list 0 $scl 0 0] [list 0 0 $scl 0] [list 0 0 0 1]] ' \
+           '$init_scale]\n' \
+           '  foreach mol [molinfo list] {\n' \
+           '    molinfo $mol set rotate_matrix [list $rot]\n' \
+           '    molinfo $mol set scale_matrix [list $scale]\n' \
+           '  }\n' \
+           '}\n\n'
+    return code
+
+
 def reposition_dummies(sel1, sel2):
-    code = 'proc reposition_dummies {{molind}} {{  animate dup $molind\n' \
-           '  set sel [atomselect $molind "index 0"]\n  set ssel [atomselect 0 "{}"]\n' \
-           '  $sel set {{x y z}} [list [geom_center $ssel]]\n  set ssel [atomselect 0 "{}"]\n' \
-           '  set sel [atomselect $molind "index 1"]\n  $sel set {{x y z}} [list [geom_center $ssel]]\n' \
+    code = 'proc reposition_dummies {{molind frames}} {{\n' \
+           '  for {{set i 0}} {{$i <= [tcl::mathfunc::max {{*}}$frames]}} {{incr i}} {{animate dup $molind}}\n' \
+           '  set sel [atomselect $molind "all"]\n  set ssel1 [atomselect 0 "{}"]\n' \
+           '  set ssel2 [atomselect 0 "{}"]\n' \
+           '  foreach frame $frames {{\n    $sel frame $frame\n    $ssel1 frame $frame\n    $ssel2 frame $frame\n' \
+           '    $sel set {{x y z}} [list [geom_center $ssel1] [geom_center $ssel2]]}}\n' \
+           '  $sel delete\n  $ssel1 delete\n  $ssel2 delete\n' \
            '}}\n\n'.format(sel1, sel2)
     return code
 
 
+def load_dummies():
+    code = 'proc load_dummies {molind positions} {\n' \
+           '  set last 0\n' \
+           '  foreach {frame coords} $positions {if {$frame > $last} {set last $frame}}\n' \
+           '  for {set i 0} {$i <= $last} {incr i} {animate dup $molind}\n' \
+           '  set sel [atomselect $molind "all"]\n' \
+           '  foreach {frame coords} $positions {\n    $sel frame $frame\n    $sel set {x y z} $coords}\n' \
+           '  $sel delete\n' \
+           '}\n\n'
+    return code
+
+
 def retr_vp():
     code = 'proc retr_vp {view_num} {\n  global viewpoints  \n  foreach mol [molinfo list] {\n' \
            '    molinfo $mol set rotate_matrix   $viewpoints($view_num,0,0)\n' \
@@ -568,6 +1002,17 @@ def geom_center():
     return code
 
 
+def fit_apply():
+    code = 'proc fit_apply {moves} {\n' \
+           '  set fit_system [atomselect top "all"]\n' \
+           '  foreach {frame matrix} $moves {\n' \
+           '    $fit_system frame $frame\n' \
+           '    $fit_system move $matrix}\n' \
+           '  $fit_system delete\n' \
+           '}\n\n'
+    return code
+
+
 def fit_slow(selection, axis):
     if axis:
         extra = '[set_orientation $fit_compare [list {}]]'.format(axis)
@@ -595,6 +1040,9 @@ def fit_slow(selection, axis):
            '    set fit_matrix {}\n' \
            '    set scaled_fit [scale_fit $fit_matrix $frac]\n' \
            '    $fit_system move $scaled_fit}}\n' \
+           '  $fit_reference delete\n' \
+           '  $fit_compare delete\n' \
+           '  $fit_system delete\n' \
            '}}\n\n'.format(selection, selection, extra)
     return code
 
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    Records timed spans of the rendering pipeline (stages,
+    scenes and single frames) together with the CPU time,
+    the number of subprocesses spawned and the bytes written
+    while each span was open; spans can be exported in the
+    Chrome trace-event format (chrome://tracing, Perfetto)
+    and summarized per stage; frame spans only count what
+    their own thread did, as frames are processed concurrently
+    """
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.subprocesses = 0
+        self.bytes_written = 0
+        self.threads = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def counters(self, thread=False):
+        """
+        Current values of everything a span measures;
+        CPU time includes our own threads and the
+        subprocesses that have already finished
+        :param thread: bool, whether to only use the CPU time and counts of the current thread
+        :return: tuple, (wall, cpu, subprocesses, bytes written)
+        """
+        if thread:
+            return (time.perf_counter(), time.thread_time(), getattr(self.local, 'subprocesses', 0),
+                    getattr(self.local, 'bytes_written', 0))
+        times = os.times()
+        return (time.perf_counter(), time.process_time() + times.children_user + times.children_system,
+                self.subprocesses, self.bytes_written)
+
+    @contextmanager
+    def span(self, name, category='stage', **args):
+        """
+        Measures the enclosed block of code
+        :param name: str, name of the span (e.g. stage)
+        :param category: str, 'stage', 'scene' or 'frame'
+        :param args: extra (JSON-serializable) information, e.g. scene=..., frame=...
+        :return: None
+        """
+        start = self.counters(category == 'frame')
+        try:
+            yield
+        finally:
+            self.record(name, category, start, self.counters(category == 'frame'), **args)
+
+    def record(self, name, category, start, end, **args):
+        """
+        Stores a complete span
+        :param name: str, name of the span
+        :param category: str, 'stage', 'scene' or 'frame'
+        :param start: tuple, counters() when the span started
+        :param end: tuple, counters() when the span ended
+        :param args: extra information
+        :return: None
+        """
+        args.update(cpu=round(end[1] - start[1], 6), subprocesses=end[2] - start[2],
+                    bytes_written=end[3] - start[3])
+        with self.lock:
+            tid = self.threads.setdefault(threading.get_ident(), len(self.threads))
+            self.events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                                'ts': round((start[0] - self.origin) * 1e6, 1),
+                                'dur': round((end[0] - start[0]) * 1e6, 1), 'args': args})
+
+    def count(self, subprocesses=0, files=()):
+        """
+        Registers spawned subprocesses and written files
+        :param subprocesses: int, number of subprocesses started
+        :param files: iterable of str, paths to files that were written (missing ones are skipped)
+        :return: None
+        """
+        written = sum(os.path.getsize(fname) for fname in files if os.path.isfile(fname))
+        self.local.subprocesses = getattr(self.local, 'subprocesses', 0) + subprocesses
+        self.local.bytes_written = getattr(self.local, 'bytes_written', 0) + written
+        with self.lock:
+            self.subprocesses += subprocesses
+            self.bytes_written += written
+
+    def chrome_trace(self):
+        """
+        All spans as a Chrome trace-event document
+        :return: dict, JSON-serializable
+        """
+        with self.lock:
+            return {'traceEvents': sorted(self.events, key=lambda ev: ev['ts']), 'displayTimeUnit': 'ms'}
+
+    def summary(self, frames=None):
+        """
+        Totals per stage (and per scene) of wall time,
+        CPU time, subprocesses and bytes written; frame
+        spans are aggregated by name
+        :param frames: int, number of movie frames, used to report the cost per frame
+        :return: dict, JSON-serializable
+        """
+        stages, scenes = {}, {}
+        with self.lock:
+            events = list(self.events)
+        for event in events:
+            totals = stages.setdefault(event['name'], {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'subprocesses': 0,
+                                                       'bytes_written': 0})
+            totals['count'] += 1
+            totals['wall'] += event['dur'] / 1e6
+            for key in ['cpu', 'subprocesses', 'bytes_written']:
+                totals[key] += event['args'][key]
+            if 'scene' in event['args'] and event['cat'] != 'frame':
+                scene = scenes.setdefault(event['args']['scene'], {})
+                scene[event['name']] = scene.get(event['name'], 0.0) + event['dur'] / 1e6
+        for totals in stages.values():
+            totals['wall'], totals['cpu'] = round(totals['wall'], 6), round(totals['cpu'], 6)
+        result = {'stages': stages, 'scenes': scenes}
+        if 'render' in stages:
+            result['wall'] = stages['render']['wall']
+            if frames:
+                result['frames'] = frames
+                result['wall_per_frame'] = round(stages['render']['wall'] / frames, 6)
+        return result
+
+    def save(self, name, frames=None):
+        """
+        Writes {name}.trace.json (Chrome trace events)
+        and {name}.summary.json
+        :param name: str, prefix of the output files
+        :param frames: int, number of movie frames
+        :return: None
+        """
+        with open('{}.trace.json'.format(name), 'w') as out:
+            json.dump(self.chrome_trace(), out)
+        with open('{}.summary.json'.format(name), 'w') as out:
+            json.dump(self.summary(frames), out, indent=2, sort_keys=True)
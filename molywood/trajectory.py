@@ -0,0 +1,633 @@
+import os
+import re
+import json
+import struct
+import hashlib
+import operator
+
+# from xdrfile.c (GROMACS): integer sizes used by the XTC compression of small coordinate differences
+MAGICINTS = [0, 0, 0, 0, 0, 0, 0, 0, 0, 8, 10, 12, 16, 20, 25, 32, 40, 50, 64, 80, 101, 128, 161, 203, 256, 322, 406,
+             512, 645, 812, 1024, 1290, 1625, 2048, 2580, 3250, 4096, 5060, 6501, 8192, 10321, 13003, 16384, 20642,
+             26007, 32768, 41285, 52015, 65536, 82570, 104031, 131072, 165140, 208063, 262144, 330280, 416127, 524287,
+             660561, 832255, 1048576, 1321122, 1664510, 2097152, 2642245, 3329021, 4194304, 5284491, 6658042, 8388607,
+             10568983, 13316085, 16777216]
+FIRSTIDX = 9
+
+# keywords of the VMD selection language that only depend on the structure file
+SELECTION_KEYWORDS = {'name': str, 'type': str, 'resname': str, 'chain': str, 'segname': str, 'segid': str,
+                      'element': str, 'resid': int, 'residue': int, 'index': int, 'serial': int, 'beta': float,
+                      'occupancy': float}
+COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq,
+               '!=': operator.ne, 'lt': operator.lt, 'le': operator.le, 'gt': operator.gt, 'ge': operator.ge,
+               'eq': operator.eq, 'ne': operator.ne}  # applied elementwise to numpy arrays
+
+
+class UnsupportedInput(Exception):
+    """
+    Raised when a file format or a selection cannot be
+    handled in Python; the calculation is then left to VMD
+    """
+    pass
+
+
+class BitReader:
+    """
+    Reads consecutive big-endian bit fields from
+    the compressed part of an XTC frame
+    """
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def bits(self, nbits):
+        start, end = self.position // 8, (self.position + nbits + 7) // 8
+        chunk = int.from_bytes(self.data[start:end], 'big')
+        self.position += nbits
+        return (chunk >> (8 * (end - start) - self.position + 8 * start)) & ((1 << nbits) - 1)
+
+    def ints(self, nbits, sizes):
+        """
+        Unpacks three integers stored together as a single
+        number in mixed radix (see receiveints in xdrfile.c)
+        :param nbits: int, number of bits holding the packed number
+        :param sizes: list of ints, ranges of the three integers
+        :return: list of ints
+        """
+        nbytes, packed = 0, 0
+        while nbits > 8:
+            packed |= self.bits(8) << (8 * nbytes)
+            nbytes += 1
+            nbits -= 8
+        if nbits > 0:
+            packed |= self.bits(nbits) << (8 * nbytes)
+        packed, third = divmod(packed, sizes[2])
+        first, second = divmod(packed, sizes[1])
+        return [first, second, third]
+
+
+def decompress(natoms, precision, minint, maxint, smallidx, data):
+    """
+    Decodes the compressed coordinates of an XTC frame,
+    following xdr3dfcoord from the GROMACS xdrfile library
+    :param natoms: int, number of atoms
+    :param precision: float, coordinates were stored as integers in units of 1/precision nm
+    :param minint: list of ints, lower bounds of the integer coordinates
+    :param maxint: list of ints, upper bounds of the integer coordinates
+    :param smallidx: int, initial index into MAGICINTS for the small differences
+    :param data: bytes, the compressed stream
+    :return: numpy.array of shape (natoms, 3), coordinates in nm
+    """
+    import numpy as np
+    sizeint = [maxint[k] - minint[k] + 1 for k in range(3)]
+    if any(size > 0xffffff for size in sizeint):
+        bitsizeint, bitsize = [size.bit_length() for size in sizeint], 0
+    else:
+        bitsizeint, bitsize = None, (sizeint[0] * sizeint[1] * sizeint[2]).bit_length()
+    smaller = MAGICINTS[max(FIRSTIDX, smallidx - 1)] // 2
+    smallnum = MAGICINTS[smallidx] // 2
+    sizesmall = [MAGICINTS[smallidx]] * 3
+    reader = BitReader(data)
+    coords = np.empty((natoms, 3), dtype=np.int64)
+    i, n, run = 0, 0, 0
+    while i < natoms:
+        if bitsize == 0:
+            thiscoord = [reader.bits(bitsizeint[k]) for k in range(3)]
+        else:
+            thiscoord = reader.ints(bitsize, sizeint)
+        i += 1
+        prevcoord = [thiscoord[k] + minint[k] for k in range(3)]
+        is_smaller = 0
+        if reader.bits(1):
+            run = reader.bits(5)
+            is_smaller = run % 3
+            run -= is_smaller
+            is_smaller -= 1
+        if run > 0:
+            for k in range(0, run, 3):
+                small = reader.ints(smallidx, sizesmall)
+                i += 1
+                thiscoord = [small[j] + prevcoord[j] - smallnum for j in range(3)]
+                if k == 0:  # the first two atoms of a run are swapped, which compresses water better
+                    thiscoord, prevcoord = prevcoord, thiscoord
+                    coords[n] = prevcoord
+                    n += 1
+                else:
+                    prevcoord = thiscoord
+                coords[n] = thiscoord
+                n += 1
+        else:
+            coords[n] = prevcoord
+            n += 1
+        smallidx += is_smaller
+        if is_smaller < 0:
+            smallnum = smaller
+            smaller = MAGICINTS[smallidx - 1] // 2 if smallidx > FIRSTIDX else 0
+        elif is_smaller > 0:
+            smaller = smallnum
+            smallnum = MAGICINTS[smallidx] // 2
+        sizesmall = [MAGICINTS[smallidx]] * 3
+    return coords / precision
+
+
+class XTCReader:
+    """
+    Random-access reader of GROMACS XTC trajectories:
+    frame offsets are found by skipping over the
+    compressed data, and frames are only decompressed
+    when requested, so memory use does not grow with
+    the length of the trajectory
+    """
+    def __init__(self, filename):
+        """
+        :param filename: str, path to the .xtc file
+        """
+        self.filename = filename
+        self._offsets = None
+        with open(filename, 'rb') as xtc:
+            magic, self.natoms = struct.unpack('>ii', xtc.read(8))
+        if magic not in (1995, 2023):
+            raise UnsupportedInput('{} is not a valid XTC file'.format(filename))
+
+    @property
+    def offsets(self):
+        """
+        Byte offsets of all frames, read from the
+        frame headers on first use
+        :return: list of ints
+        """
+        if self._offsets is None:
+            self._offsets = []
+            size = os.path.getsize(self.filename)
+            with open(self.filename, 'rb') as xtc:
+                offset = 0
+                while offset + 56 <= size:
+                    self._offsets.append(offset)
+                    xtc.seek(offset)
+                    magic, natoms = struct.unpack('>ii', xtc.read(8))
+                    if natoms <= 9:
+                        offset += 56 + 12 * natoms
+                        continue
+                    xtc.seek(offset + 88)
+                    nbytes = struct.unpack('>q' if magic == 2023 else '>i', xtc.read(8 if magic == 2023 else 4))[0]
+                    offset += 92 + (4 if magic == 2023 else 0) + 4 * ((nbytes + 3) // 4)
+        return self._offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read(self, index):
+        """
+        Reads a single frame
+        :param index: int, frame number (0-based)
+        :return: numpy.array of shape (natoms, 3), coordinates in Angstrom
+        """
+        import numpy as np
+        with open(self.filename, 'rb') as xtc:
+            xtc.seek(self.offsets[index])
+            header = xtc.read(56)
+            magic, natoms = struct.unpack('>ii', header[:8])
+            if natoms <= 9:
+                return 10 * np.array(struct.unpack('>{}f'.format(3 * natoms), xtc.read(12 * natoms))).reshape(-1, 3)
+            params = struct.unpack('>f7i', xtc.read(32))
+            large = magic == 2023
+            nbytes = struct.unpack('>q' if large else '>i', xtc.read(8 if large else 4))[0]
+            data = xtc.read(nbytes)
+        precision, minint, maxint, smallidx = params[0], list(params[1:4]), list(params[4:7]), params[7]
+        return 10 * decompress(natoms, precision, minint, maxint, smallidx, data)
+
+
+def read_pdb(filename):
+    """
+    Reads atoms and coordinates from a PDB file;
+    each MODEL becomes a separate frame, as in VMD
+    :param filename: str, path to the .pdb file
+    :return: tuple, (dict of per-atom numpy.arrays, numpy.array of shape (nframes, natoms, 3))
+    """
+    import numpy as np
+    fields = {key: [] for key in ['name', 'resname', 'chain', 'resid', 'segname', 'element', 'serial', 'beta',
+                                  'occupancy']}
+    frames, current = [], []
+    for line in open(filename):
+        if line.startswith(('ATOM', 'HETATM')):
+            current.append([float(line[30:38]), float(line[38:46]), float(line[46:54])])
+            if frames:
+                continue  # atom properties are only read from the first model
+            fields['serial'].append(len(fields['serial']) + 1)
+            fields['name'].append(line[12:16].strip())
+            fields['resname'].append(line[17:21].strip())
+            fields['chain'].append(line[21:22].strip() or 'X')
+            fields['resid'].append(int(line[22:26]))
+            fields['occupancy'].append(float(line[54:60] or 1))
+            fields['beta'].append(float(line[60:66] or 0))
+            fields['segname'].append(line[72:76].strip())
+            fields['element'].append(line[76:78].strip() or 'X')
+        elif line.startswith('ENDMDL') and current:
+            frames.append(current)
+            current = []
+    if current:
+        frames.append(current)
+    if not frames:
+        raise UnsupportedInput('No atoms found in {}'.format(filename))
+    atoms = {key: np.array(val) for key, val in fields.items()}
+    atoms['type'] = atoms['name']
+    atoms['segid'] = atoms['segname']
+    atoms['index'] = np.arange(len(atoms['name']))
+    change = np.concatenate(([True], (atoms['resid'][1:] != atoms['resid'][:-1]) |
+                             (atoms['chain'][1:] != atoms['chain'][:-1]) |
+                             (atoms['segname'][1:] != atoms['segname'][:-1])))
+    atoms['residue'] = np.cumsum(change) - 1
+    return atoms, np.array(frames)
+
+
+def tokenize(selection):
+    tokens = re.findall(r'"[^"]*"|\'[^\']*\'|<=|>=|==|!=|[()<>]|[^\s()<>=!"\']+', selection)
+    if ''.join(tokens).replace(' ', '') != re.sub(r'\s', '', selection):
+        raise UnsupportedInput('Could not parse selection "{}"'.format(selection))
+    return tokens
+
+
+def select(atoms, selection):
+    """
+    Evaluates the structural subset of the VMD selection
+    language ('and', 'or', 'not', parentheses, 'all', 'none',
+    keyword value lists, 'to' ranges, quoted regexes and
+    comparisons such as 'resid > 410'); selections using
+    anything else (e.g. 'protein', 'within') raise
+    UnsupportedInput so that they can be left to VMD
+    :param atoms: dict of per-atom numpy.arrays, as returned by read_pdb
+    :param selection: str, VMD-compatible selection
+    :return: numpy.array of bools, one per atom
+    """
+    import numpy as np
+    tokens = tokenize(selection)
+    natoms = len(atoms['index'])
+
+    def peek():
+        return tokens[0].lower() if tokens else None
+
+    def parse_or():
+        mask = parse_and()
+        while peek() == 'or':
+            tokens.pop(0)
+            mask = mask | parse_and()
+        return mask
+
+    def parse_and():
+        mask = parse_not()
+        while peek() == 'and':
+            tokens.pop(0)
+            mask = mask & parse_not()
+        return mask
+
+    def parse_not():
+        if peek() == 'not':
+            tokens.pop(0)
+            return ~parse_not()
+        return parse_primary()
+
+    def parse_primary():
+        token = peek()
+        if token is None:
+            raise UnsupportedInput('Selection "{}" ended unexpectedly'.format(selection))
+        tokens.pop(0)
+        if token == '(':
+            mask = parse_or()
+            if peek() != ')':
+                raise UnsupportedInput('Unbalanced parentheses in selection "{}"'.format(selection))
+            tokens.pop(0)
+            return mask
+        if token in ['all', 'none']:
+            return np.full(natoms, token == 'all')
+        if token not in SELECTION_KEYWORDS:
+            raise UnsupportedInput('Keyword "{}" is not supported in Python'.format(token))
+        values, kind = atoms[token], SELECTION_KEYWORDS[token]
+        if peek() in COMPARISONS:
+            compare = COMPARISONS[tokens.pop(0).lower()]
+            try:
+                return compare(values, kind(tokens.pop(0)))
+            except (ValueError, IndexError):
+                raise UnsupportedInput('Could not parse selection "{}"'.format(selection))
+        mask = np.zeros(natoms, dtype=bool)
+        matched = False
+        while tokens and peek() not in ['and', 'or', 'not', '(', ')'] + list(SELECTION_KEYWORDS):
+            value = tokens.pop(0)
+            matched = True
+            try:
+                if value[0] in '"\'':
+                    mask |= np.array([re.fullmatch(value[1:-1], str(val)) is not None for val in values])
+                elif peek() == 'to':
+                    tokens.pop(0)
+                    mask |= (values >= kind(value)) & (values <= kind(tokens.pop(0)))
+                else:
+                    mask |= values == kind(value)
+            except (ValueError, IndexError, re.error):
+                raise UnsupportedInput('Could not parse selection "{}"'.format(selection))
+        if not matched:
+            raise UnsupportedInput('Keyword "{}" requires a value'.format(token))
+        return mask
+
+    result = parse_or()
+    if tokens:
+        raise UnsupportedInput('Could not parse selection "{}"'.format(selection))
+    return result
+
+
+class Trajectory:
+    """
+    Coordinates of a molecule as loaded by VMD: frames
+    of the structure file (PDB models) followed by the
+    frames of the trajectory file (XTC); frames are read
+    one at a time, keeping only the selected atoms
+    """
+    def __init__(self, structure, trajectory=None):
+        """
+        :param structure: str, path to the .pdb file
+        :param trajectory: str, path to the .xtc file (optional)
+        """
+        if structure.split('.')[-1].lower() != 'pdb':
+            raise UnsupportedInput('Only PDB structures can be read in Python, got {}'.format(structure))
+        if trajectory and trajectory.split('.')[-1].lower() != 'xtc':
+            raise UnsupportedInput('Only XTC trajectories can be read in Python, got {}'.format(trajectory))
+        self.atoms, self.models = read_pdb(structure)
+        self.xtc = XTCReader(trajectory) if trajectory else None
+        if self.xtc and self.xtc.natoms != len(self.atoms['index']):
+            raise RuntimeError('{} has {} atoms, while {} has {}'.format(trajectory, self.xtc.natoms, structure,
+                                                                          len(self.atoms['index'])))
+
+    def __len__(self):
+        return len(self.models) + (len(self.xtc) if self.xtc else 0)
+
+    def frame(self, index):
+        """
+        :param index: int, frame number as in VMD (negative values count from the end)
+        :return: numpy.array of shape (natoms, 3)
+        """
+        index = index % len(self)
+        if index < len(self.models):
+            return self.models[index]
+        return self.xtc.read(index - len(self.models))
+
+    def selected(self, mask, frames):
+        """
+        Coordinates of the selected atoms in the requested frames
+        :param mask: numpy.array of bools, the selection
+        :param frames: list of ints, frame numbers
+        :return: numpy.array of shape (len(frames), number of selected atoms, 3)
+        """
+        import numpy as np
+        return np.array([self.frame(fr)[mask] for fr in frames]).reshape(len(frames), int(mask.sum()), 3)
+
+
+def geom_centers(coords):
+    """
+    :param coords: numpy.array of shape (nframes, natoms, 3)
+    :return: numpy.array of shape (nframes, 3), geometric centers (as geom_center in TCL)
+    """
+    return coords.mean(axis=1)
+
+
+def principal_axes(coords):
+    """
+    Principal axes of inertia (unit masses), ordered from
+    the smallest to the largest moment as in calc_principalaxes;
+    each axis is oriented so that not all of its components
+    are negative, following the convention of mevsvd_br
+    :param coords: numpy.array of shape (nframes, natoms, 3)
+    :return: numpy.array of shape (nframes, 3, 3), axes as rows
+    """
+    import numpy as np
+    centered = coords - geom_centers(coords)[:, None, :]
+    second = np.einsum('fai,faj->fij', centered, centered)
+    inertia = np.trace(second, axis1=1, axis2=2)[:, None, None] * np.identity(3) - second
+    _, vectors = np.linalg.eigh(inertia)  # eigenvalues in ascending order
+    axes = np.transpose(vectors, (0, 2, 1))
+    flip = np.all(axes <= 0, axis=2)
+    axes[flip] *= -1
+    return axes
+
+
+def fit_matrices(mobile, reference):
+    """
+    Batched least-squares superposition (Kabsch), i.e. the
+    transformations that 'measure fit' would return for
+    each frame of the mobile selection
+    :param mobile: numpy.array of shape (nframes, natoms, 3)
+    :param reference: numpy.array of shape (natoms, 3) or (nframes, natoms, 3)
+    :return: numpy.array of shape (nframes, 4, 4), transformation matrices
+    """
+    import numpy as np
+    reference = np.broadcast_to(reference, mobile.shape)
+    mob_center, ref_center = geom_centers(mobile), geom_centers(reference)
+    covariance = np.einsum('fai,faj->fij', mobile - mob_center[:, None, :], reference - ref_center[:, None, :])
+    u, _, vt = np.linalg.svd(covariance)
+    sign = np.sign(np.linalg.det(np.einsum('fij,fjk->fik', u, vt)))
+    u[:, :, 2] *= sign[:, None]
+    rotations = np.einsum('fij,fjk->fik', u, vt).transpose(0, 2, 1)
+    matrices = np.tile(np.identity(4), (len(mobile), 1, 1))
+    matrices[:, :3, :3] = rotations
+    matrices[:, :3, 3] = ref_center - np.einsum('fij,fj->fi', rotations, mob_center)
+    return matrices
+
+
+def scale_fit(matrices, fraction):
+    """
+    Applies a fraction of each transformation by scaling
+    its Euler angles and translation, exactly as the
+    scale_fit TCL procedure does
+    :param matrices: numpy.array of shape (n, 4, 4)
+    :param fraction: float, fraction of the transformation to be applied
+    :return: numpy.array of shape (n, 4, 4)
+    """
+    import numpy as np
+    r31 = matrices[:, 2, 0]
+    gimbal = np.abs(r31) == 1
+    theta = np.where(gimbal, -np.pi / 2 * np.sign(r31), -np.arcsin(np.clip(r31, -1, 1)))
+    cos_t = np.where(gimbal, 1, np.cos(theta))
+    psi = np.where(gimbal, np.arctan2(matrices[:, 0, 1], matrices[:, 0, 2]),
+                   np.arctan2(matrices[:, 2, 1] / cos_t, matrices[:, 2, 2] / cos_t))
+    phi = np.where(gimbal, 0, np.arctan2(matrices[:, 1, 0] / cos_t, matrices[:, 0, 0] / cos_t))
+    theta, phi, psi = fraction * theta, fraction * phi, fraction * psi
+    scaled = matrices.copy()
+    scaled[:, 0, 0] = np.cos(theta) * np.cos(phi)
+    scaled[:, 0, 1] = np.sin(psi) * np.sin(theta) * np.cos(phi) - np.cos(psi) * np.sin(phi)
+    scaled[:, 0, 2] = np.cos(psi) * np.sin(theta) * np.cos(phi) + np.sin(psi) * np.sin(phi)
+    scaled[:, 1, 0] = np.cos(theta) * np.sin(phi)
+    scaled[:, 1, 1] = np.sin(psi) * np.sin(theta) * np.sin(phi) + np.cos(psi) * np.cos(phi)
+    scaled[:, 1, 2] = np.cos(psi) * np.sin(theta) * np.sin(phi) - np.sin(psi) * np.cos(phi)
+    scaled[:, 2, 0] = -np.sin(theta)
+    scaled[:, 2, 1] = np.sin(psi) * np.cos(theta)
+    scaled[:, 2, 2] = np.cos(psi) * np.cos(theta)
+    scaled[:, :3, 3] *= fraction
+    return scaled
+
+
+def orientation_matrices(centers, axes, vector):
+    """
+    Rotations about the selection centers that turn the
+    principal axes onto a given vector, as set_orientation
+    does in TCL (with 'trans center ... axis ...'); since
+    the sign of a principal axis is arbitrary, each axis
+    is taken in the direction closer to the vector, so
+    that the smaller of the two possible rotations is used
+    :param centers: numpy.array of shape (n, 3)
+    :param axes: numpy.array of shape (n, 3), the principal axes to be aligned
+    :param vector: numpy.array of shape (3,), the target direction
+    :return: numpy.array of shape (n, 4, 4)
+    """
+    import numpy as np
+    axes = axes / np.linalg.norm(axes, axis=1)[:, None]
+    vector = np.asarray(vector, dtype=float) / np.linalg.norm(vector)
+    axes = axes * np.where(axes @ vector < 0, -1, 1)[:, None]
+    rotvec = np.cross(axes, vector)
+    sine = np.linalg.norm(rotvec, axis=1)
+    angle = np.arctan2(sine, axes @ vector)
+    unit = rotvec / np.where(sine > 0, sine, 1)[:, None]
+    cross = np.zeros((len(axes), 3, 3))
+    cross[:, 0, 1], cross[:, 0, 2], cross[:, 1, 2] = -unit[:, 2], unit[:, 1], -unit[:, 0]
+    cross -= cross.transpose(0, 2, 1)
+    rotations = np.identity(3) + np.sin(angle)[:, None, None] * cross + \
+        (1 - np.cos(angle))[:, None, None] * np.einsum('fij,fjk->fik', cross, cross)
+    matrices = np.tile(np.identity(4), (len(axes), 1, 1))
+    matrices[:, :3, :3] = rotations
+    matrices[:, :3, 3] = centers - np.einsum('fij,fj->fi', rotations, centers)
+    return matrices
+
+
+class Precompute:
+    """
+    Geometric quantities (selection centers, principal
+    axes, fit matrices) computed in NumPy from the files
+    a scene loads, so that the TCL code only has to apply
+    them; results are kept in memory and, if a directory
+    is given, cached on disk, keyed by the files (path,
+    size and modification time), the selection and the frames
+    """
+    def __init__(self, structure, trajectory=None, directory=None):
+        """
+        :param structure: str, path to the .pdb file
+        :param trajectory: str, path to the .xtc file (optional)
+        :param directory: str, where computed arrays are stored (optional)
+        """
+        self.structure = structure
+        self.trajectory = trajectory
+        self.directory = directory
+        self._trajectory = None
+        self._masks = {}
+        self._results = {}
+
+    @property
+    def coordinates(self):
+        if self._trajectory is None:
+            self._trajectory = Trajectory(self.structure, self.trajectory)
+        return self._trajectory
+
+    def mask(self, selection):
+        if selection not in self._masks:
+            self._masks[selection] = select(self.coordinates.atoms, selection)
+            if not self._masks[selection].any():
+                raise RuntimeError('Selection "{}" does not contain any atoms'.format(selection))
+        return self._masks[selection]
+
+    def key(self, kind, selection, frames, extra=None):
+        files = [[os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)]
+                 for f in [self.structure, self.trajectory] if f]
+        return hashlib.sha1(json.dumps([kind, selection, list(frames), extra, files]).encode()).hexdigest()
+
+    def cached(self, kind, selection, frames, compute, extra=None):
+        """
+        Returns a stored result, or computes and stores it
+        :param kind: str, name of the quantity
+        :param selection: str, VMD-compatible selection
+        :param frames: list of ints, frame numbers
+        :param compute: callable, returns the numpy.array when there is no stored result
+        :param extra: JSON-serializable, further parameters the result depends on
+        :return: numpy.array
+        """
+        import numpy as np
+        key = self.key(kind, selection, frames, extra)
+        if key in self._results:
+            return self._results[key]
+        path = os.path.join(self.directory, key + '.npy') if self.directory else None
+        if path and os.path.isfile(path):
+            self._results[key] = np.load(path)
+            return self._results[key]
+        result = compute()
+        if path:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + '.part', 'wb') as out:
+                np.save(out, result)
+            os.replace(path + '.part', path)
+        self._results[key] = result
+        return result
+
+    def frames(self, frames):
+        return [fr % len(self.coordinates) for fr in frames]
+
+    def centers(self, selection, frames):
+        """
+        :param selection: str, VMD-compatible selection
+        :param frames: list of ints, frame numbers (negative values count from the end)
+        :return: numpy.array of shape (len(frames), 3)
+        """
+        frames = self.frames(frames)
+        return self.cached('centers', selection, frames,
+                           lambda: geom_centers(self.coordinates.selected(self.mask(selection), frames)))
+
+    def principal_axes(self, selection, frames):
+        """
+        :param selection: str, VMD-compatible selection
+        :param frames: list of ints, frame numbers (negative values count from the end)
+        :return: numpy.array of shape (len(frames), 3, 3)
+        """
+        frames = self.frames(frames)
+        return self.cached('axes', selection, frames,
+                           lambda: principal_axes(self.coordinates.selected(self.mask(selection), frames)))
+
+    def fit_matrices(self, selection, frames, references):
+        """
+        :param selection: str, VMD-compatible selection
+        :param frames: list of ints, frame numbers to be fitted (negative values count from the end)
+        :param references: int or list of ints, frame(s) the selection is fitted to (one per fitted frame)
+        :return: numpy.array of shape (len(frames), 4, 4)
+        """
+        import numpy as np
+        frames = self.frames(frames)
+        references = self.frames([references] * len(frames) if isinstance(references, int) else references)
+        mask = self.mask(selection)
+
+        def compute():
+            needed = sorted(set(frames + references))
+            coords = dict(zip(needed, self.coordinates.selected(mask, needed)))
+            return fit_matrices(np.array([coords[fr] for fr in frames]), np.array([coords[fr] for fr in references]))
+        return self.cached('fit', selection, frames, compute, extra=references)
+
+
+def scene_precompute(scene):
+    """
+    Sets up the precompute stage for a scene, if the
+    molecule it shows can be read in Python: a PDB
+    structure, optionally with a single XTC trajectory
+    loaded in full, given either as scene directives
+    or in the visualization state
+    :param scene: Scene instance, the scene to be rendered
+    :return: Precompute instance, or None if the files can not be handled
+    """
+    structure, trajectory = scene.structure, scene.trajectory
+    if scene.visualization:
+        code = open(scene.visualization).read()
+        new = re.findall(r'^mol new \{?([^\s}]+)\}? type \{?(\w+)\}? first 0 last -1 step 1', code, re.M)
+        addfile = re.findall(r'^mol addfile \{?([^\s}]+)\}? type \{?(\w+)\}? first 0 last -1 step 1', code, re.M)
+        if len(new) != 1 or len(addfile) > 1 or len(re.findall(r'^mol (new|addfile) ', code, re.M)) \
+                != len(new) + len(addfile):
+            return None
+        structure = new[0][0] if new[0][1] == 'pdb' else None
+        trajectory = None if not addfile else addfile[0][0] if addfile[0][1] == 'xtc' else ''
+    if not structure or trajectory == '' or structure.split('.')[-1].lower() != 'pdb' or \
+            (trajectory and trajectory.split('.')[-1].lower() != 'xtc'):
+        return None
+    try:
+        structure = scene.script.check_path(structure)
+        trajectory = scene.script.check_path(trajectory) if trajectory else None
+    except RuntimeError:
+        return None
+    return Precompute(structure, trajectory, scene.script.precompute_dir)
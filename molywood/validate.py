@@ -0,0 +1,42 @@
+import sys
+
+if __package__:
+    from . import moly
+    from . import graphics_actions
+else:
+    import moly
+    import graphics_actions
+
+
+def validate(scriptfile):
+    """
+    Parses a movie script and checks its directives,
+    scenes, layout and actions without generating TCL
+    code, looking for external programs or importing
+    NumPy and matplotlib, so that many scripts can be
+    checked quickly (e.g. in CI)
+    :param scriptfile: str, path to the input script
+    :return: str, description of the error, or None if the script is valid
+    """
+    try:
+        script = moly.Script(scriptfile)
+        if len(script.scenes) > 1 and 'layout' in script.directives:
+            graphics_actions.layout_matrix(script)
+    except Exception as err:
+        return '{}: {}'.format(type(err).__name__, str(err).strip())
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("To check input files without rendering them, run "
+              "'python path/to/validate.py script.txt [another.txt ...]'")
+        sys.exit(1)
+    failed = 0
+    for filename in sys.argv[1:]:
+        error = validate(filename)
+        if error:
+            failed += 1
+            print('{}: {}'.format(filename, error))
+    print('{} of {} scripts are valid'.format(len(sys.argv) - 1 - failed, len(sys.argv) - 1))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,303 @@
+import os
+import re
+import sys
+import hashlib
+import tempfile
+import itertools
+import threading
+from subprocess import Popen, PIPE, TimeoutExpired
+
+# Loaded into every worker once; exit is redefined so that generated scripts
+# return control to the console instead of terminating VMD, and the molecule
+# context kept between jobs (including the center set by center_view) is reset
+# to the state right after loading
+BOOTSTRAP = r'''rename exit molywood_exit
+proc exit {args} {return -code error molywood_exit}
+set molywood_reuse 0
+set molywood_base 0
+set molywood_molid -1
+set molywood_view {}
+set molywood_center {}
+set molywood_materials [material list]
+set molywood_display {}
+foreach prop {projection depthcue cuestart cueend cuedensity cuemode eyesep focallength height distance
+              nearclip farclip shadows ambientocclusion aoambient aodirect dof dof_fnumber dof_focaldist} {
+  if {![catch {display get $prop} value]} {lappend molywood_display $prop $value}
+}
+proc molywood_load {command} {
+  global molywood_reuse molywood_base molywood_molid molywood_view molywood_center
+  if {$molywood_reuse} {return}
+  uplevel #0 $command
+  if {[string match "mol new *" $command]} {
+    set molywood_molid [molinfo top]
+    set molywood_base [molinfo top get numframes]
+    set molywood_view [molinfo top get {center_matrix rotate_matrix scale_matrix global_matrix}]
+    set molywood_center [molinfo top get center]
+  }
+}
+proc molywood_base {} {
+  global molywood_base
+  return $molywood_base
+}
+proc molywood_reset {} {
+  global molywood_molid molywood_view molywood_center molywood_materials molywood_display
+  foreach mol [molinfo list] {if {$mol != $molywood_molid} {mol delete $mol}}
+  mol top $molywood_molid
+  while {[molinfo $molywood_molid get numreps] > 0} {mol delrep 0 $molywood_molid}
+  mol representation Lines
+  mol color Name
+  mol selection all
+  mol material Opaque
+  mol addrep $molywood_molid
+  graphics $molywood_molid delete all
+  label delete Atoms all
+  label delete Bonds all
+  foreach mat [material list] {
+    if {[lsearch -exact $molywood_materials $mat] < 0} {
+      catch {material delete $mat}
+    } else {
+      catch {material default $mat}
+    }
+  }
+  foreach {prop value} $molywood_display {
+    if {$prop in {nearclip farclip}} {catch {display $prop set $value}} else {catch {display $prop $value}}
+  }
+  display resetview
+  molinfo $molywood_molid set center $molywood_center
+  molinfo $molywood_molid set {center_matrix rotate_matrix scale_matrix global_matrix} $molywood_view
+  animate goto end
+}
+proc molywood_run {id directory script reuse} {
+  global molywood_reuse molywood_globals
+  foreach var [info globals] {
+    if {[lsearch -exact $molywood_globals $var] < 0} {uplevel #0 [list unset $var]}
+  }
+  cd $directory
+  set molywood_reuse $reuse
+  if {$reuse} {molywood_reset}
+  set status [catch {uplevel #0 [list source $script]} msg]
+  set failed [expr {$status == 1 && $msg ne "molywood_exit"}]
+  if {$failed} {puts "molywood_failed $id $msg"}
+  puts "molywood_done $id $failed"
+  flush stdout
+}
+set molywood_globals [concat [info globals] molywood_globals]
+'''
+
+
+def script_context(code):
+    """
+    Digest of the molecule context a generated script
+    sets up, i.e. of everything it runs before the first
+    action (structure, trajectory and visualization state),
+    together with sizes and modification times of the files
+    it loads; only single-molecule scripts can be reused
+    :param code: str, TCL code as produced by Scene.tcl
+    :return: str, hex digest, or None if the context cannot be reused
+    """
+    end = code.find('axes location off')
+    loader = code[:end]
+    loads = [line.split() for line in loader.split('\n') if re.match(r'\s*mol (new|addfile) ', line)]
+    if end < 0 or len([words for words in loads if words[1] == 'new']) != 1:
+        return None
+    digest = hashlib.sha1(os.getcwd().encode())
+    digest.update(loader.encode())
+    for words in loads:
+        if len(words) > 2 and os.path.isfile(words[2]):
+            stat = os.stat(words[2])
+            digest.update('{} {} {}'.format(words[2], stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()
+
+
+def pooled_script(code):
+    """
+    Adapts a generated script to run in a pool worker:
+    mol new/addfile commands that set up the scene are
+    skipped when the worker already holds the molecule
+    :param code: str, TCL code as produced by Scene.tcl
+    :return: str, TCL code
+    """
+    end = code.find('axes location off')
+    if end < 0:
+        return code
+    lines = code[:end].split('\n')
+    for n, line in enumerate(lines):
+        stripped = line.lstrip()
+        if stripped.startswith('mol new ') or stripped.startswith('mol addfile '):
+            lines[n] = line[:len(line) - len(stripped)] + 'molywood_load {' + stripped + '}'
+        elif stripped == 'set traj_base [molinfo top get numframes]':  # as loaded by mol new
+            lines[n] = line.replace('[molinfo top get numframes]', '[molywood_base]')
+    return '\n'.join(lines) + code[end:]
+
+
+class PoolJob:
+    """
+    Handle of a script submitted to the pool; it mimics
+    the poll/wait/returncode interface of subprocess.Popen,
+    so that pooled jobs are monitored like VMD processes
+    """
+    def __init__(self):
+        self.returncode = None
+        self.done = threading.Event()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        self.done.wait()
+        return self.returncode
+
+    def finish(self, returncode):
+        self.returncode = returncode
+        self.done.set()
+
+
+class VMDWorker:
+    """
+    A headless VMD process reading commands from its
+    text console (stdin); it runs one script at a time,
+    and remembers the molecule context it has loaded
+    """
+    def __init__(self, vmd, bootstrap):
+        self.process = Popen('{} -dispdev none -startup ""'.format(vmd), shell=True, stdin=PIPE, stdout=PIPE,
+                             universal_newlines=True, bufsize=1)
+        self.context = None
+        self.jobs = 0
+        self.send('source {{{}}}'.format(bootstrap))
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def send(self, command):
+        self.process.stdin.write(command + '\n')
+        self.process.stdin.flush()
+
+    def run(self, job_id, script, reuse):
+        """
+        Sources a script in the worker and waits until it is
+        done; VMD output is passed through to our stdout
+        :param job_id: int, unique job number
+        :param script: str, path to the TCL script
+        :param reuse: bool, whether the loaded molecule should be reused
+        :return: int, 0 on success
+        """
+        self.jobs += 1
+        try:
+            self.send('molywood_run {} {{{}}} {{{}}} {}'.format(job_id, os.getcwd(), os.path.abspath(script),
+                                                               int(reuse)))
+            for line in self.process.stdout:
+                match = re.search(r'molywood_done {} (\d)'.format(job_id), line)
+                if match:
+                    return int(match.group(1))
+                sys.stdout.write(line)
+        except (OSError, ValueError):  # the worker is gone
+            pass
+        return 1
+
+    def close(self):
+        try:
+            self.send('molywood_exit')
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, ValueError, TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class VMDPool:
+    """
+    A pool of long-lived headless VMD processes that
+    scripts of consecutive scenes (and movies) are sent
+    to; a worker that has already loaded the structure,
+    trajectory and visualization state of a script only
+    resets reps, labels, materials and the view instead
+    of loading everything again, and a worker holding a
+    different molecule is replaced by a fresh process
+    """
+    def __init__(self, vmd, size=1):
+        self.vmd = vmd
+        self.size = max(1, size)
+        self.idle = []
+        self.started = 0
+        self.reused = 0
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        handle, self.bootstrap = tempfile.mkstemp(prefix='molywood_pool_', suffix='.tcl')
+        with os.fdopen(handle, 'w') as out:
+            out.write(BOOTSTRAP)
+
+    def submit(self, script, context=None, reusable=True):
+        """
+        Runs a script in the first suitable worker
+        :param script: str, path to the TCL script, as adapted by pooled_script
+        :param context: str, digest returned by script_context (None if it cannot be reused)
+        :param reusable: bool, False if the script modifies the loaded coordinates (e.g. fit_trajectory)
+        :return: PoolJob, handle of the job
+        """
+        job = PoolJob()
+        threading.Thread(target=self.run, args=(job, script, context, reusable), daemon=True).start()
+        return job
+
+    def run(self, job, script, context, reusable):
+        worker, reuse = self.acquire(context)
+        returncode = 1
+        try:
+            returncode = worker.run(next(self.counter), script, reuse)
+        finally:
+            worker.context = context if reusable and returncode == 0 else ''  # '' never matches
+            self.release(worker)
+            job.finish(returncode)
+
+    def acquire(self, context):
+        """
+        Picks an idle worker holding the requested molecule
+        context, or else a fresh one, waiting if all of them
+        are busy
+        :param context: str, digest returned by script_context
+        :return: tuple, (VMDWorker, bool whether its molecule can be reused)
+        """
+        stale = None
+        with self.condition:
+            while True:
+                matching = [wk for wk in self.idle if context and wk.context == context and wk.alive]
+                if matching:
+                    self.idle.remove(matching[0])
+                    self.reused += 1
+                    return matching[0], True
+                fresh = [wk for wk in self.idle if not wk.jobs and wk.alive]
+                if fresh:
+                    self.idle.remove(fresh[0])
+                    return fresh[0], False
+                if self.started < self.size:
+                    self.started += 1
+                    break
+                if self.idle:  # the least recently used worker is replaced
+                    stale = self.idle.pop(0)
+                    break
+                self.condition.wait()
+        if stale:
+            stale.close()
+        return VMDWorker(self.vmd, self.bootstrap), False
+
+    def release(self, worker):
+        with self.condition:
+            if worker.alive:
+                self.idle.append(worker)
+            else:
+                self.started -= 1
+            self.condition.notify()
+
+    def close(self):
+        """
+        Terminates all idle workers; should be called
+        once no more jobs are running
+        :return: None
+        """
+        with self.condition:
+            workers, self.idle = self.idle, []
+            self.started -= len(workers)
+        for worker in workers:
+            worker.close()
+        if os.path.isfile(self.bootstrap):
+            os.remove(self.bootstrap)
@@ -7,5 +7,5 @@ setup(name='pyvmd_movies',
       author='Milosz Wieczor',
       author_email='milafternoon@gmail.com',
       license='GNU GPLv3',
-      packages=['pyvmd_movies'],
+      packages=['molywood'],
       zip_safe=False)
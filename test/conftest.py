@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import molywood from this checkout, wherever pytest is started from
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
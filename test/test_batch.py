@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from molywood import batch, moly, image_io, planner
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+import bench
+import stubs
+
+
+def test_scripts_share_caches_but_not_registries(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    tools = stubs.install(str(tmp_path))
+    scripts = []
+    for job in ['first', 'second']:
+        os.makedirs(job)
+        image_io.write_png(os.path.join(job, 'figure.png'), np.full((30, 40, 3), 200, dtype=np.uint8))
+        scripts.append(os.path.join(job, 'movie.txt'))
+        with open(scripts[-1], 'w') as out:
+            out.write(bench.synthetic_script(10, 1, (8, 6)).replace('trace=t', 'jobs=1 workers=4'))
+    renderer = batch.Batch(scripts, workers=2, jobs=2, pool=False)
+    renderer.tools = dict(vmd=tools['vmd'], remove='rm', compose=tools['composite'], convert=tools['convert'],
+                          tachyon=tools['tachyon'], ffmpeg=tools['ffmpeg'])
+    assert renderer.render() == {os.path.abspath(script): None for script in scripts}
+    assert all(os.path.isfile(os.path.join(job, 'bench.mp4')) for job in ['first', 'second'])
+    assert 'Scene scene_0: 10 of 10 frames found in the cache' in capsys.readouterr().out  # rendered by the first
+    assert len(os.listdir(os.path.join('.molywood_cache', 'figures'))) == 1
+    # measured costs are recorded next to each script, where single runs of the same script record them too
+    assert all(len(planner.load_history(os.path.join(job, '.molywood_cache', planner.HISTORY))) == 1
+               for job in ['first', 'second'])
+    assert not os.path.exists(os.path.join('.molywood_cache', planner.HISTORY))
+    assert moly.Script.allowed_globals == ['global', 'layout'] and 'scene_0' not in moly.Script.allowed_params
+    with open('leak.txt', 'w') as out:  # scene names of other scripts are not valid directives
+        out.write('$ global fps=10\n$ scene_0 resolution=8,6\n\n# other\ndo_nothing t=1s\n')
+    with pytest.raises(RuntimeError):
+        moly.Script('leak.txt')
+
+
+def test_internal_defaults_are_not_a_directive(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('default.txt', 'w') as out:
+        out.write('$ global fps=10\n$ _default resolution=8,6\n$ scene resolution=8,6\n\n# scene\ndo_nothing t=1s\n')
+    with pytest.raises(RuntimeError, match="'_default' is not an allowed global directive"):
+        moly.Script('default.txt')
@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+import bench
+import stubs
+
+
+def test_stub_vmd_renders_the_requested_frames(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bench.StubScript.tools = stubs.install(str(tmp_path))
+    with open('bench.txt', 'w') as out:
+        out.write(bench.synthetic_script(20, 1, (8, 6)))
+    scene = bench.StubScript('bench.txt').scenes[0]
+    assert stubs.rendered_frames(scene.tcl()) == list(range(20))
+    assert stubs.rendered_frames(scene.tcl((5, 15), [6, 7, 12])) == [6, 7, 12]
+
+
+def test_benchmark_reports_all_stages():
+    result = bench.run(10, 2, (8, 6))
+    assert result['frames'] == 10 and result['panels'] == 2
+    assert all(result[stage] >= 0 for stage in ['parse'] + bench.STAGES)
+    assert result['vmd'] > 0 and result['compose'] > 0 and result['subprocesses'] >= 3  # 2 x VMD, ffmpeg
+    assert abs(result['per_frame'] * 10 - result['total']) < 1e-9
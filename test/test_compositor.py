@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+from molywood import compositor, image_io
+
+
+def test_resize_keeps_aspect_ratio():
+    image = np.full((100, 200, 3), 80, dtype=np.uint8)
+    resized = compositor.resize(image, 50, 50)
+    assert resized.shape == (25, 50, 3)
+    assert (resized == 80).all()
+    assert compositor.resize(image, 400, 400).shape == (200, 400, 3)
+
+
+def test_overlay_southwest_with_opacity():
+    base = np.zeros((10, 10, 3), dtype=np.uint8)
+    ovl = np.full((2, 3, 4), 200, dtype=np.uint8)
+    ovl[:, :, 3] = 255
+    compositor.overlay(base, ovl, (1, 2), opacity=0.5)
+    assert (base[6:8, 1:4] == 100).all()
+    base[6:8, 1:4] = 0
+    assert (base == 0).all()
+
+
+def test_tile_fills_gaps():
+    a = np.zeros((2, 2, 3), dtype=np.uint8)
+    b = np.zeros((1, 3, 3), dtype=np.uint8)
+    canvas = compositor.tile([[a, b], [None, a]])
+    assert canvas.shape == (4, 5, 3)
+    assert (canvas[2:4, 0:2] == 0).all() and (canvas[2:4, 2:] == 255).all()
+    assert (canvas[1, 2:] == 255).all()
+
+
+def test_frames_with_same_inputs_are_linked(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name, value in [('a-0', 10), ('a-2', 20), ('b-0', 30)]:
+        image_io.write_png('{}.png'.format(name), np.full((2, 2, 3), value, dtype=np.uint8))
+    os.link('a-0.png', 'a-1.png')
+    compositor.FrameCompositor('movie', {'a': 3, 'b': 1}, {}, [['a', 'b']]).run()
+    assert os.path.samefile('movie-0.png', 'movie-1.png')
+    assert not os.path.samefile('movie-1.png', 'movie-2.png')
+    assert (image_io.read_png('movie-2.png')[:, :2] == 20).all()
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+
+from molywood import encoder
+
+FAKE_FFMPEG = """import sys
+args = sys.argv[1:]
+if 'concat' in args:
+    lines = [line.split("'")[1] for line in open(args[args.index('-i') + 1])]
+    open(args[-1], 'w').write(''.join(open(seg).read() for seg in lines))
+else:
+    frames = sys.stdin.read()
+    open(args[-1], 'w').write(frames)
+    open('encoded.log', 'a').write('{}\\n'.format(frames.split()[0]))
+"""
+
+
+def encode(name, nframes, max_size=2**20):
+    segments = encoder.SegmentedEncoder('{} ffmpeg.py'.format(sys.executable), name, 2, jobs=2, seconds=3,
+                                        max_size=max_size)
+    for fr in range(nframes):
+        segments.push(fr, 'composed-{}.png'.format(fr))
+    segments.close()
+    encoded = sorted(int(x) for x in open('encoded.log').read().split()) if os.path.isfile('encoded.log') else []
+    if encoded:
+        os.remove('encoded.log')
+    return encoded
+
+
+def test_only_changed_segments_are_encoded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('ffmpeg.py', 'w') as fake:
+        fake.write(FAKE_FFMPEG)
+    for fr in range(14):
+        with open('composed-{}.png'.format(fr), 'w') as frame:
+            frame.write('{}\n'.format(fr))
+    assert encode('movie', 14) == [0, 6, 12]
+    assert open('movie.mp4').read().split() == [str(fr) for fr in range(14)]
+    assert encode('movie', 14) == []
+    assert encode('copy', 14) == []  # another movie made of the same frames shares the segments
+    with open('composed-7.png', 'w') as frame:
+        frame.write('edited\n')
+    assert encode('movie', 14) == [6]
+    assert open('movie.mp4').read().split()[7] == 'edited'
+    assert len(os.listdir(os.path.join('.molywood_cache', 'segments'))) == 4 + 2  # the old one is still in copy.mp4
+    assert encode('copy', 14) == []
+    assert len(os.listdir(os.path.join('.molywood_cache', 'segments'))) == 3 + 2
+
+
+def test_unused_segments_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('ffmpeg.py', 'w') as fake:
+        fake.write(FAKE_FFMPEG)
+    for version in ['old', 'new']:
+        for fr in range(14):
+            with open('composed-{}.png'.format(fr), 'w') as frame:
+                frame.write('{} {}\n'.format(fr, version))
+        assert encode(version, 14, max_size=100) == [0, 6, 12]
+    directory = os.path.join('.molywood_cache', 'segments')
+    kept = sorted(os.path.join(directory, x) for x in os.listdir(directory) if x.endswith('.mp4'))
+    assert kept == sorted(json.load(open(os.path.join(directory, 'new.json'))))  # the abandoned movie is gone
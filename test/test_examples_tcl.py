@@ -1,18 +1,25 @@
-from pyvmd_movies import *
-
 import os
 
-examples = ['../examples/' + x for x in os.listdir('../examples') if os.path.isdir('../examples/' + x)]
-examples += ['../examples/primitives/' + x for x in os.listdir('../examples/primitives/')
-             if os.path.isdir('../examples/primitives/' + x)]
+import pytest
 
-for ex in examples:
-    txt_files = [x for x in os.listdir(ex) if x.endswith('txt')]
-    for script in txt_files:
-        script_file = ex + '/' + script
-        print("Testing {}  ...".format(script_file))
-        scr = Script(script_file)
-        for scene in scr.scenes:
-            _ = scene.tcl()
+from molywood import Script
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+PRIMITIVES = os.path.join(EXAMPLES, 'primitives')
+DIRECTORIES = [os.path.join(EXAMPLES, x) for x in sorted(os.listdir(EXAMPLES))] + \
+              [os.path.join(PRIMITIVES, x) for x in sorted(os.listdir(PRIMITIVES))]
+SCRIPTS = [os.path.join(ex, x) for ex in DIRECTORIES if os.path.isdir(ex) for x in sorted(os.listdir(ex))
+           if x.endswith('txt')]
 
-print("\n\n\n\t\tSuccess - all input files parsed without errors!\n\n\n")
\ No newline at end of file
+
+@pytest.mark.parametrize('script_file', SCRIPTS, ids=[os.path.relpath(x, EXAMPLES) for x in SCRIPTS])
+def test_example_parses(script_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # e.g. structures fetched by pdb_code are saved in the working directory
+    try:
+        scr = Script(script_file)
+    except RuntimeError as err:
+        if 'Download failed' in str(err):
+            pytest.skip('the structure could not be downloaded from the PDB')
+        raise
+    for scene in scr.scenes:
+        scene.tcl()
@@ -0,0 +1,57 @@
+import os
+import time
+import types
+
+from molywood import frame_cache, keyframes
+
+
+def make_scene(structure, color):
+    actions = [types.SimpleNamespace(action_type=['rotate'], parameters={'angle': '90', 't': '1s'}, initframe=0),
+               types.SimpleNamespace(action_type=['highlight'], parameters={'selection': 'protein', 'color': color},
+                                     initframe=2)]
+    return types.SimpleNamespace(visualization=None, structure=structure, trajectory=None, resolution=(100, 100),
+                                 total_frames=4, actions=actions, keyframes=[keyframes.FrameState() for _ in range(4)])
+
+
+def test_keys_follow_changed_actions(tmp_path):
+    with open(str(tmp_path / 'a.pdb'), 'w') as pdb:
+        pdb.write('ATOM\n')
+    cache = frame_cache.FrameCache(str(tmp_path / 'cache'), 1e6)
+    red = cache.frame_keys(make_scene(str(tmp_path / 'a.pdb'), 'red'))
+    blue = cache.frame_keys(make_scene(str(tmp_path / 'a.pdb'), 'blue'))
+    assert red[:2] == blue[:2] and red[2] != blue[2] and len(set(red)) == 2
+    with open(str(tmp_path / 'a.pdb'), 'w') as pdb:
+        pdb.write('HETATM\n')
+    os.utime(str(tmp_path / 'a.pdb'), (time.time() + 10, time.time() + 10))
+    assert cache.frame_keys(make_scene(str(tmp_path / 'a.pdb'), 'red'))[0] != red[0]
+
+
+def test_lru_eviction(tmp_path):
+    cache = frame_cache.FrameCache(str(tmp_path / 'cache'), 250)
+    for n, key in enumerate(['aa1', 'bb2', 'cc3']):
+        with open(str(tmp_path / 'frame{}.png'.format(n)), 'wb') as png:
+            png.write(b'0' * 100)
+        cache.store(key, str(tmp_path / 'frame{}.png'.format(n)))
+        os.utime(cache.path(key), (n, n))
+    assert cache.fetch('aa1', str(tmp_path / 'restored.png'))
+    cache.evict()
+    assert os.path.isfile(cache.path('aa1')) and os.path.isfile(cache.path('cc3'))
+    assert not os.path.isfile(cache.path('bb2'))
+
+
+def test_keys_follow_each_highlight_of_a_simultaneous_action(tmp_path, monkeypatch):
+    from molywood import moly
+    monkeypatch.chdir(tmp_path)
+    with open('a.pdb', 'w') as pdb:
+        pdb.write('ATOM\n')
+    cache = frame_cache.FrameCache('cache', 1e6)
+    keys = []
+    for first in ['resid 1 to 100', 'resid 1 to 50']:
+        with open('hl.txt', 'w') as script:
+            script.write('$ global fps=2\n$ scene structure=a.pdb resolution=10,10\n\n# scene\n'
+                         '{{ highlight selection="{}" color=red t=1s;\n'
+                         ' highlight selection="resid 200" color=blue }}\n'.format(first))
+        scene = moly.Script('hl.txt').scenes[0]
+        scene.tcl()
+        keys.append(cache.frame_keys(scene))
+    assert all(a != b for a, b in zip(*keys))
@@ -0,0 +1,53 @@
+import os
+import types
+
+import numpy as np
+
+from molywood import graphics_actions, image_io, moly
+
+
+def test_static_figure_resized_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    script = types.SimpleNamespace(compositor='numpy', convert='convert')
+    image_io.write_png('fig.png', np.full((40, 80, 3), 120, dtype=np.uint8))
+    cached = graphics_actions.cached_figure(script, 'fig.png', [20, 20])
+    assert graphics_actions.cached_figure(script, 'fig.png', [20.0, 20.0]) == cached
+    graphics_actions.link_frames(cached, ['s-{}.png'.format(fr) for fr in range(3)])
+    assert os.stat(cached).st_nlink == 4
+    assert image_io.read_png('s-2.png').shape == (10, 20, 3)
+    graphics_actions.detach('s-1.png')
+    assert os.stat(cached).st_nlink == 3
+
+
+def plot_frames(jobs, nframes):
+    np.savetxt('data.dat', np.c_[np.arange(100), np.sin(np.arange(100) / 10)])
+    scene = types.SimpleNamespace(name='s', resolution=[500, 500], script=types.SimpleNamespace(jobs=jobs))
+    action = types.SimpleNamespace(scene=scene, initframe=2, framenum=nframes, parameters={},
+                                   overlays={'overlay0': {'datafile': 'data.dat', 'dataframes': '0:99'}})
+    graphics_actions.data_simple_plot(action, 'data.dat', 'overlay0')
+    return [image_io.read_png('overlay0-s-{}.png'.format(fr)) for fr in range(2, 2 + nframes)]
+
+
+def test_plot_frames_differ_only_by_marker(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frames = plot_frames(1, 3)
+    assert frames[0].shape == (480, 480, 4)
+    changed = (frames[0] != frames[2]).any(axis=2)
+    assert changed.any() and changed.mean() < 0.05
+
+
+def test_plot_frames_independent_of_jobs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    serial = plot_frames(1, 41)
+    parallel = plot_frames(3, 41)
+    assert all((a == b).all() for a, b in zip(serial, parallel))
+
+
+def test_standalone_datafile_figure(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    np.savetxt('data.dat', np.c_[np.arange(20), np.arange(20) ** 2])
+    with open('plot.txt', 'w') as script:
+        script.write('$ global fps=2\n$ plot resolution=200,100\n\n# plot\nshow_figure t=2s datafile=data.dat\n')
+    action = moly.Script('plot.txt').scenes[0].actions[0]
+    graphics_actions.gen_fig(action)
+    assert [image_io.read_png('plot-{}.png'.format(fr)).shape[:2] for fr in range(4)] == [(100, 200)] * 4
@@ -0,0 +1,25 @@
+import struct
+
+import numpy as np
+
+from molywood import image_io
+
+
+def test_png_roundtrip(tmp_path):
+    image = (np.random.rand(30, 40, 4) * 255).astype(np.uint8)
+    image_io.write_png(str(tmp_path / 'a.png'), image)
+    assert (image_io.read_png(str(tmp_path / 'a.png')) == image).all()
+
+
+def test_tga_bottom_left_bgr(tmp_path):
+    image = (np.random.rand(5, 7, 3) * 255).astype(np.uint8)
+    header = struct.pack('<BBB5sHHHHBB', 0, 0, 2, b'\x00' * 5, 0, 0, 7, 5, 24, 0)
+    with open(str(tmp_path / 'a.tga'), 'wb') as tga:
+        tga.write(header + image[::-1, :, ::-1].tobytes())
+    assert (image_io.read_tga(str(tmp_path / 'a.tga')) == image).all()
+
+
+def test_to_rgb_flattens_alpha():
+    image = np.zeros((1, 2, 4), dtype=np.uint8)
+    image[0, 1] = [0, 0, 0, 255]
+    assert image_io.to_rgb(image).tolist() == [[[255, 255, 255], [0, 0, 0]]]
@@ -0,0 +1,69 @@
+import os
+import shutil
+
+from molywood import moly, frame_cache, incremental
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'examples', 'twopanel_movie')
+SCRIPT = """$ global          fps=10
+$ layout          rows=1  columns=2
+$ scene_1         visualization=vis.vmd  position=0,0 resolution=500,500
+$ scene_2         position=0,1 resolution=500,500
+
+# scene_1
+rotate            t=2s angle=90 axis=y
+zoom_in           t=1s scale={}
+
+# scene_2
+show_figure       t=2s figure=logo_big.png
+"""
+
+
+def plan(scale):
+    with open('inc.txt', 'w') as out:
+        out.write(SCRIPT.format(scale))
+    script = moly.Script('inc.txt')
+    script.frame_cache = frame_cache.FrameCache('cache', 1e6)
+    layout = [['scene_1', 'scene_2']]
+    dirty, needed, manifest = incremental.plan(script, layout, 'manifest.json')
+    incremental.save(manifest, 'manifest.json')
+    for fr in range(len(manifest['frames'])):
+        open('movie-{}.png'.format(fr), 'w').close()
+    return dirty, needed
+
+
+def test_only_changed_frames_are_planned(tmp_path, monkeypatch):
+    for f in ['vis.vmd', 'logo_big.png']:
+        shutil.copy(os.path.join(EXAMPLE, f), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    dirty, needed = plan(1.5)
+    assert dirty == list(range(30)) and needed['scene_2'] == list(range(20))
+    assert plan(1.5) == ([], {'scene_1': [], 'scene_2': []})
+    dirty, needed = plan(2)
+    assert dirty == list(range(20, 30))
+    assert needed == {'scene_1': list(range(20, 30)), 'scene_2': [19]}
+    os.remove('movie-3.png')
+    assert plan(2)[0] == [3]
+    assert incremental.frame_ranges([0, 1, 2, 5, 7, 8]) == '0-2, 5, 7-8'
+
+
+def test_changed_highlight_of_a_simultaneous_action_is_planned(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pdb = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'tubulin.pdb')
+    plans = []
+    for first in ['resid 1 to 100', 'resid 1 to 50', 'resid 1 to 50']:
+        with open('hl.txt', 'w') as out:
+            out.write('$ global fps=2\n$ scene structure={} resolution=10,10\n\n# scene\n'
+                      'fit_trajectory selection="resid > 410"\n'  # not stateless, so all previous actions count
+                      'rotate t=1s angle=90 axis=y\n'
+                      '{{ highlight selection="{}" color=red t=1s;\n'
+                      ' highlight selection="resid 200" color=blue }}\n'.format(pdb, first))
+        script = moly.Script('hl.txt')
+        script.frame_cache = frame_cache.FrameCache('cache', 1e6)
+        dirty, _, manifest = incremental.plan(script, [['scene']], 'manifest.json')
+        assert not script.scenes[0].stateless
+        incremental.save(manifest, 'manifest.json')
+        for fr in range(len(manifest['frames'])):
+            open('movie-{}.png'.format(fr), 'w').close()
+        plans.append((dirty, incremental.describe(script)))
+    assert plans[1][0] == [2, 3] and plans[2][0] == []
+    assert plans[0][1] != plans[1][1] == plans[2][1]
@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pytest
+
+from molywood import journal, moly, graphics_actions, encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+import bench
+import stubs
+
+
+def test_resume_trusts_only_intact_frames(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log = journal.Journal('movie.journal')
+    log.start('abc')
+    for fr in range(3):
+        with open('scene-{}.png'.format(fr), 'w') as frame:
+            frame.write('frame {}'.format(fr))
+        log.record('render', 'scene', fr, 'scene-{}.png'.format(fr))
+    with open('movie.journal', 'a') as truncated:
+        truncated.write('{"stage": "ren')
+    with open('scene-1.png', 'w') as frame:
+        frame.write('frame X')
+    os.utime('scene-1.png', ns=(0, os.stat('scene-0.png').st_mtime_ns + 10**9))  # modified later
+    resumed = journal.Journal('movie.journal')
+    resumed.start('abc', resume=True)
+    assert resumed.completed('render', 'scene') == {0, 2}
+    assert resumed.completed('compose', 'movie') == set()
+    resumed.record('render', 'scene', 1, 'scene-1.png')
+    again = journal.Journal('movie.journal')
+    again.start('abc', resume=True)
+    assert again.completed('render', 'scene') == {0, 1, 2}
+    with pytest.raises(RuntimeError):
+        journal.Journal('movie.journal').start('other', resume=True)
+    again.close()
+    assert not (tmp_path / 'movie.journal').exists()
+
+
+def test_resumed_stream_includes_completed_frames(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tools = stubs.install(str(tmp_path))
+    postprocessor = graphics_actions.postprocessor
+    with open('movie.txt', 'w') as out:
+        out.write('$ global fps=10 name=movie stream=t compositor=imagemagick tachyon_jobs=2 vmd_pool=f keepframes=t\n'
+                  '$ scene_0 structure={} resolution=8,6\n\n# scene_0\n'
+                  'rotate axis=y angle=90 t=1s\n'.format(os.path.join(bench.EXAMPLES, 'tubulin.pdb')))
+
+    def render(resume, postprocessor):
+        script = moly.Script('movie.txt')
+        script.vmd, script.remove, script.compose, script.convert = tools['vmd'], 'rm', tools['composite'], \
+            tools['convert']
+        script.tachyon, script.ffmpeg = tools['tachyon'], tools['ffmpeg']
+        script.resume = resume
+        monkeypatch.setattr(graphics_actions, 'postprocessor', postprocessor)
+        script.render()
+
+    def interrupt(*args):
+        raise RuntimeError('interrupted')
+    with pytest.raises(RuntimeError, match='interrupted'):
+        render(False, interrupt)
+    for fr in range(5, 10):  # as if the job was killed halfway
+        os.remove('scene_0-{}.png'.format(fr))
+    pushed = []
+    monkeypatch.setattr(encoder.StreamingEncoder, 'push', lambda self, index, frame: pushed.append(index))
+    monkeypatch.setattr(encoder.StreamingEncoder, 'close', lambda self: None)
+    render(True, postprocessor)
+    assert pushed == list(range(10))
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+from molywood import keyframes, tcl_actions
+from molywood.moly import Script
+
+examples = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+
+def test_rotation_matrix_composition():
+    rot = keyframes.rotation_matrix('y', 90).dot(keyframes.rotation_matrix('y', -90))
+    assert np.allclose(rot, np.identity(4))
+    assert np.allclose(keyframes.rotation_matrix('z', 90)[:3, :3].dot([1, 0, 0]), [0, 1, 0])
+
+
+def test_absolute_states_do_not_drift():
+    scr = Script(os.path.join(examples, 'primitives', 'zoom', 'zoom2.txt'))
+    scene = scr.scenes[0]
+    scene.tcl()
+    assert len(scene.keyframes) == scene.total_frames
+    assert np.isclose(scene.keyframes[39].scale, 3.0)
+    assert np.allclose(scene.keyframes[-1].rotation, np.identity(4))
+    assert np.isclose(scene.keyframes[-1].scale, 1.0)
+
+
+def test_labels_and_opacities():
+    scr = Script(os.path.join(examples, 'primitives', 'label', 'label2.txt'))
+    scene = scr.scenes[0]
+    scene.tcl()
+    assert scene.keyframes[0].labels == (('Atoms', 'label1'), ('Atoms', 'hY'))
+    assert scene.keyframes[-1].labels == ()
+    assert np.isclose(scene.keyframes[39].opacities['$mathl_404'], 1.0)
+
+
+def test_render_range_starts_from_absolute_state():
+    scr = Script(os.path.join(examples, 'primitives', 'rotate', 'rotate2.txt'))
+    scene = scr.scenes[0]
+    code = scene.tcl((50, 90))
+    assert 'set fr 50\napply_view' in code
+    assert 'for {set i 10} {$i < 40} {incr i}' in code
+
+
+def test_only_visited_trajectory_frames_are_loaded():
+    scr = Script(os.path.join(examples, 'primitives', 'overlay', 'overlay1.txt'))
+    scene = scr.scenes[0]
+    code = scene.tcl()
+    assert scene.traj_span == (0, 80, 1)
+    assert 'last $traj_last step $traj_step' in code and 'xtc type xtc first 0 last -1' not in code
+    assert 'animate goto [traj_index $t]' in code
+    scr = Script(os.path.join(examples, 'twopanel_movie', 'twopanel.txt'))
+    scene = scr.scenes[0]
+    assert 'traj_index' not in scene.tcl() and scene.traj_span is None  # zoom_in shows the last frame first
+    scene.keyframes = [keyframes.FrameState() for _ in range(3)]
+    for kf, fr in zip(scene.keyframes, [100, 150, 200]):
+        kf.traj_frame = fr
+    scene.actions = []
+    assert tcl_actions.trajectory_span(scene) == (100, 200, 50)
@@ -0,0 +1,65 @@
+import os
+import json
+import shutil
+
+from molywood import moly, planner
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'examples', 'twopanel_movie')
+SCRIPT = """$ global          fps=10 workers=2 {}
+$ layout          rows=1  columns=2
+$ scene_1         position=0,0 resolution=300,400
+$ scene_2         visualization=vis.vmd  position=0,1 resolution=500,400
+
+# scene_1
+show_figure       t=2s figure=logo_big.png
+
+# scene_2
+rotate            t=2s angle=90 axis=y
+do_nothing        t=1s
+"""
+
+
+def script(options=''):
+    with open('plan.txt', 'w') as out:
+        out.write(SCRIPT.format(options))
+    return moly.Script('plan.txt')
+
+
+def test_frames_and_subprocesses_are_counted(tmp_path, monkeypatch):
+    for f in ['vis.vmd', 'logo_big.png']:
+        shutil.copy(os.path.join(EXAMPLE, f), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    result = planner.plan(script())
+    figure, molecule = result['scenes']['scene_1'], result['scenes']['scene_2']
+    assert result['frames'] == 30 and result['resolution'] == [800, 400]
+    assert molecule['frames'] == 30 and molecule['rendered'] + molecule['repeated'] == 30 and molecule['repeated'] >= 9
+    assert molecule['vmd_processes'] == 1  # two scenes share the two workers
+    assert figure == dict(figure, frames=20, rendered=0, vmd_processes=0)
+    assert result['stages']['tachyon'] == molecule['rendered'] and result['stages']['figures'] == 1
+    # ffmpeg encodes a single segment and then concatenates the segments
+    assert result['subprocesses'] == {'vmd': 1, 'tachyon': molecule['rendered'], 'imagemagick': 0, 'ffmpeg': 2}
+    assert result['disk']['peak'] == sum(v for k, v in result['disk'].items() if k != 'peak') > 0
+    assert result['wall_total'] is None and 'no previous runs' in planner.report(result)
+    result = planner.plan(script('compositor=imagemagick draft=t'))
+    assert result['subprocesses']['tachyon'] == 0 and result['subprocesses']['imagemagick'] == 30 + 1
+
+
+def test_wall_time_is_estimated_from_history(tmp_path, monkeypatch):
+    for f in ['vis.vmd', 'logo_big.png']:
+        shutil.copy(os.path.join(EXAMPLE, f), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    scr = script()
+    amounts = planner.quantities(scr, {'scene_1': 0, 'scene_2': 10})
+    assert amounts['rendered_mpx'] == 10 * 0.2 and amounts['movie_frames'] == 30
+    history = [{'settings': ['other'], 'quantities': dict(amounts, rendered_mpx=1.0),
+                'stages': {stage: 1.0 for stage in planner.COSTS}},
+               {'settings': planner.settings(scr), 'quantities': amounts,
+                'stages': {stage: 2.0 for stage in planner.COSTS}}]
+    os.makedirs('.molywood_cache')
+    with open(os.path.join('.molywood_cache', planner.HISTORY), 'w') as out:
+        json.dump(history, out)
+    result = planner.plan(scr)
+    assert result['history_runs'] == 1  # only the run with the same settings is used
+    rendered = result['scenes']['scene_2']['rendered']
+    assert result['wall'] == dict({stage: 2.0 for stage in planner.COSTS}, vmd=2.0 * rendered / 10)
+    assert 'Estimated wall time' in planner.report(result)
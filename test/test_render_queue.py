@@ -0,0 +1,90 @@
+import os
+import sys
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from molywood import render_queue, image_io, encoder
+
+
+class FinishedProcess:
+    def poll(self):
+        return 0
+
+
+def write_frame(name, image):
+    height, width = image.shape[:2]
+    header = struct.pack('<BBB5sHHHHBB', 0, 0, 2, b'\x00' * 5, 0, 0, width, height, 24, 0)
+    with open(name, 'wb') as tga:
+        tga.write(header + image[::-1, :, ::-1].tobytes())
+
+
+def test_converter_replaces_tga_and_dat(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    images = [(np.random.rand(4, 5, 3) * 255).astype(np.uint8) for _ in range(4)]
+    for fr, image in enumerate(images):
+        write_frame('sc-{}.tga'.format(fr), image)
+        open('sc-{}.dat'.format(fr), 'w').close()
+    converter = render_queue.FrameConverter(2)
+    converter.watch('sc', [range(0, 2), range(2, 4)], [FinishedProcess()])
+    converter.finish()
+    assert sorted(os.listdir('.')) == ['sc-{}.png'.format(fr) for fr in range(4)]
+    assert all((image_io.read_png('sc-{}.png'.format(fr)) == image).all() for fr, image in enumerate(images))
+
+
+STUB_TACHYON = """#!{python}
+import sys, time, struct
+args = sys.argv[1:]
+output = args[args.index('-o') + 1]
+if output == 'sc-0.tga':
+    time.sleep(0.5)  # later frames fill the reorder buffer meanwhile
+    sys.exit(1)
+width, height = (int(x) for x in args[args.index('-res') + 1:])
+header = struct.pack('<BBB5sHHHHBB', 0, 0, 2, b'\\x00' * 5, 0, 0, width, height, 24, 0)
+open(output, 'wb').write(header + bytes(3 * width * height))
+"""
+
+
+def test_failed_frame_aborts_the_stream(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('tachyon', 'w') as stub:
+        stub.write(STUB_TACHYON.format(python=sys.executable))
+    os.chmod('tachyon', 0o755)
+    with open('ffmpeg.py', 'w') as sink:
+        sink.write('import sys\nsys.stdin.buffer.read()\n')
+    for fr in range(8):
+        open('sc-{}.dat'.format(fr), 'w').close()
+    stream = encoder.StreamingEncoder('{} ffmpeg.py'.format(sys.executable), 'sc', 10, buffer_size=2)
+    queue = render_queue.TachyonQueue(os.path.abspath('tachyon'), 4, 1)
+    queue.on_frame = lambda name, fr: stream.push(fr, '{}-{}.tga'.format(name, fr))
+    queue.on_failure = lambda name, fr: stream.abort('Tachyon failed to render {}-{}'.format(name, fr))
+    with pytest.raises(RuntimeError, match='sc-0'):
+        queue.run(SimpleNamespace(name='sc', resolution=(5, 4)), range(8), [FinishedProcess()])
+    assert 'sc-0 (Tachyon exited with code 1)' in queue.failed
+    assert len(os.listdir('.')) == 3 + 7  # all other frames were ray-traced
+    with pytest.raises(RuntimeError, match='was not encoded'):
+        stream.close()
+
+
+def test_failed_callback_aborts_the_stream(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('tachyon', 'w') as stub:
+        stub.write(STUB_TACHYON.format(python=sys.executable))
+    os.chmod('tachyon', 0o755)
+    with open('ffmpeg.py', 'w') as sink:
+        sink.write('import sys\nsys.stdin.buffer.read()\n')
+    for fr in range(8):
+        open('mv-{}.dat'.format(fr), 'w').close()
+    stream = encoder.StreamingEncoder('{} ffmpeg.py'.format(sys.executable), 'mv', 10, buffer_size=2)
+
+    def on_frame(name, fr):
+        if fr == 0:
+            raise OSError('truncated image')
+        stream.push(fr, '{}-{}.tga'.format(name, fr))
+    queue = render_queue.TachyonQueue(os.path.abspath('tachyon'), 4, 1)
+    queue.on_frame = on_frame
+    queue.on_failure = lambda name, fr: stream.abort('frame {}-{} could not be rendered'.format(name, fr))
+    with pytest.raises(RuntimeError, match='truncated image'):
+        queue.run(SimpleNamespace(name='mv', resolution=(5, 4)), range(8), [FinishedProcess()])
@@ -0,0 +1,41 @@
+import json
+import threading
+
+from molywood import tracing
+
+
+def test_spans_are_exported_and_summarized(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tracer = tracing.Tracer()
+    with tracer.span('render'):
+        with tracer.span('scene', 'scene', scene='sc1'):
+            with tracer.span('vmd', scene='sc1'):
+                with open('sc1-0.png', 'wb') as out:
+                    out.write(b'x' * 100)
+                tracer.count(2, ['sc1-0.png', 'missing.png'])
+
+        def trace(fr):
+            with tracer.span('tachyon', 'frame', scene='sc1', frame=fr):
+                tracer.count(1)
+
+        workers = [threading.Thread(target=trace, args=(fr,)) for fr in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for fr in range(3):
+            with tracer.span('convert', 'frame', scene='sc1', frame=fr):
+                tracer.count(files=['sc1-0.png'])
+    tracer.save('movie', frames=3)
+    events = json.load(open('movie.trace.json'))['traceEvents']
+    assert [ev['name'] for ev in events][:3] == ['render', 'scene', 'vmd']
+    assert all(ev['ph'] == 'X' and ev['dur'] >= 0 for ev in events)
+    vmd = [ev for ev in events if ev['name'] == 'vmd'][0]
+    assert vmd['args']['subprocesses'] == 2 and vmd['args']['bytes_written'] == 100
+    assert vmd['ts'] >= events[0]['ts'] and vmd['ts'] + vmd['dur'] <= events[0]['ts'] + events[0]['dur']
+    summary = json.load(open('movie.summary.json'))
+    assert summary['stages']['convert']['count'] == 3 and summary['stages']['convert']['bytes_written'] == 300
+    assert summary['stages']['tachyon']['count'] == summary['stages']['tachyon']['subprocesses'] == 3
+    assert summary['stages']['render']['subprocesses'] == 5 and summary['stages']['render']['bytes_written'] == 400
+    assert set(summary['scenes']['sc1']) == {'scene', 'vmd'}  # frame spans are only aggregated per stage
+    assert summary['frames'] == 3 and abs(summary['wall_per_frame'] * 3 - summary['wall']) < 1e-5
@@ -0,0 +1,169 @@
+import os
+import re
+
+import numpy as np
+import pytest
+
+from molywood import trajectory
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+
+def test_xtc_frames_decompress_to_valid_geometry():
+    xtc = trajectory.XTCReader(os.path.join(EXAMPLES, 'tubulin_a.xtc'))
+    atoms, models = trajectory.read_pdb(os.path.join(EXAMPLES, 'tubulin.pdb'))
+    assert xtc.natoms == len(atoms['name']) == models.shape[1]
+    assert len(xtc) == 101
+    for fr in [0, 50, 100]:
+        coords = xtc.read(fr)
+        bonds = np.linalg.norm(coords[atoms['name'] == 'N'] - coords[atoms['name'] == 'CA'], axis=1)
+        assert 1.4 < bonds.min() and bonds.max() < 1.5
+
+
+def test_selections():
+    atoms, _ = trajectory.read_pdb(os.path.join(EXAMPLES, 'tubulin.pdb'))
+    assert set(atoms['resid'][trajectory.select(atoms, 'resid > 410')]) == set(range(411, 437))
+    ca = trajectory.select(atoms, 'resid 1 to 3 5 and name CA')
+    assert list(atoms['resid'][ca]) == [1, 2, 3, 5]
+    assert trajectory.select(atoms, 'not (all)').sum() == 0
+    assert trajectory.select(atoms, 'name "C.*" and index < 10').sum() == 3
+    with pytest.raises(trajectory.UnsupportedInput):
+        trajectory.select(atoms, 'protein and within 5 of resid 3')
+
+
+def test_fit_matrices_and_axes():
+    rng = np.random.default_rng(0)
+    reference = rng.normal(size=(20, 3)) * [5, 2, 1]
+    angle = 0.7
+    rotation = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+    mobile = np.array([reference @ rotation.T + [1, 2, 3], reference])
+    matrices = trajectory.fit_matrices(mobile, reference)
+    for frame, matrix in zip(mobile, matrices):
+        fitted = frame @ matrix[:3, :3].T + matrix[:3, 3]
+        assert np.allclose(fitted, reference)
+    axes = trajectory.principal_axes(mobile)
+    assert np.allclose(np.abs(axes[0][0]), np.abs(rotation @ np.linalg.svd(reference - reference.mean(0))[2][0]),
+                       atol=1e-6)
+
+
+def test_precompute_is_cached(tmp_path):
+    precompute = trajectory.Precompute(os.path.join(EXAMPLES, 'tubulin.pdb'), os.path.join(EXAMPLES, 'tubulin_a.xtc'),
+                                       directory=str(tmp_path))
+    centers = precompute.centers('resid 410', [0, 1, -1])
+    assert centers.shape == (3, 3)
+    manual = precompute.coordinates.frame(-1)[precompute.mask('resid 410')].mean(axis=0)
+    assert np.allclose(centers[2], manual)
+    assert len(os.listdir(str(tmp_path))) == 1
+    again = trajectory.Precompute(os.path.join(EXAMPLES, 'tubulin.pdb'), os.path.join(EXAMPLES, 'tubulin_a.xtc'),
+                                  directory=str(tmp_path))
+    assert np.allclose(again.centers('resid 410', [0, 1, 101]), centers)  # same frames, read from the cache
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_scale_fit_and_orientation():
+    rng = np.random.default_rng(1)
+    matrix = trajectory.fit_matrices(rng.normal(size=(1, 10, 3)), rng.normal(size=(10, 3)))
+    assert np.allclose(trajectory.scale_fit(matrix, 1.0), matrix)
+    assert np.allclose(trajectory.scale_fit(matrix, 0.0), np.identity(4))
+    oriented = trajectory.orientation_matrices(np.array([[1., 2., 3.]]), np.array([[0., -1., 0.]]), [1, 0, 0])[0]
+    assert np.allclose(oriented[:3, :3] @ [0, 1, 0], [-1, 0, 0])  # the smaller rotation is used
+    assert np.allclose(oriented[:3, :3] @ [1, 2, 3] + oriented[:3, 3], [1, 2, 3])
+
+
+def write_models(filename, models):
+    with open(filename, 'w') as pdb:
+        for coords in models:
+            pdb.write('MODEL\n')
+            for n, (x, y, z) in enumerate(coords):
+                pdb.write('ATOM  {:5d}  CA  ALA A{:4d}    {:8.3f}{:8.3f}{:8.3f}  1.00  0.00           C\n'
+                          ''.format(n + 1, n // 2 + 1, x, y, z))
+            pdb.write('ENDMDL\n')
+
+
+def test_fit_plan_reproduces_progressive_fitting(tmp_path, monkeypatch):
+    from molywood import tcl_actions
+    from molywood.moly import Script
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(2)
+    base = rng.normal(size=(12, 3)) * [6, 3, 1]
+    models = []
+    for fr in range(8):
+        rotation = trajectory.orientation_matrices(np.zeros((1, 3)), rng.normal(size=(1, 3)), [0, 0, 1])[0, :3, :3]
+        models.append(base @ rotation.T + rng.normal(size=3) * 5 + rng.normal(size=(12, 3)) * 0.3)
+    write_models('models.pdb', models)
+    with open('script.txt', 'w') as script:
+        script.write('$ global fps=4 name=fit\n$ scene1 structure=models.pdb resolution=10,10\n\n# scene1\n\n'
+                     'animate frames=1:3 t=1s smooth=1\n'
+                     '{\n fit_trajectory selection="resid 1 to 4" axis=z t=1s;\n animate frames=3:5\n}\n'
+                     'fit_trajectory selection="index 0 to 9"\nanimate frames=5:7 t=1s\n')
+    scene = Script('script.txt').scenes[0]
+    scene.tcl()
+    original = np.array(models)
+    expected, replayed = original.copy(), original.copy()
+
+    def fit_slow(selection, axis, fraction, current, smooth, calc_all=False):
+        mask = trajectory.select(scene.precompute.coordinates.atoms, selection)
+        for fr in range(len(models)) if calc_all else range(max(current - smooth, 0), current + smooth + 1):
+            if axis is None:
+                matrix = trajectory.fit_matrices(expected[fr][mask][None], expected[current][mask])
+            else:
+                selected = expected[fr][mask][None]
+                matrix = trajectory.orientation_matrices(selected.mean(axis=1),
+                                                         trajectory.principal_axes(selected)[:, 0], axis)
+            matrix = trajectory.scale_fit(matrix, fraction)[0]
+            expected[fr] = expected[fr] @ matrix[:3, :3].T + matrix[:3, 3]
+
+    def apply(moves):
+        words = moves.replace('{', ' ').replace('}', ' ').split()
+        for n in range(0, len(words), 17):
+            matrix = np.array([float(w) for w in words[n + 1:n + 17]]).reshape(4, 4)
+            replayed[int(words[n])] = replayed[int(words[n])] @ matrix[:3, :3].T + matrix[:3, 3]
+
+    for index, action in enumerate(scene.actions):
+        if 'fit_trajectory' not in action.action_type:
+            continue
+        plan = scene.fit_plan[index]
+        selection = action.parameters['selection']
+        if action.framenum == 0:
+            fit_slow(selection, None, 1.0, scene.keyframes[action.initframe - 1].traj_frame, 1)
+            apply(plan['setup'])
+        for i, fraction in enumerate(tcl_actions.gen_arrays(action).get('ftr', [])):
+            state = scene.keyframes[action.initframe + i]
+            fit_slow(selection, [0, 0, 1], fraction, state.traj_frame, state.smooth)
+            apply(plan['frames'][i])
+        fit_slow(selection, None, 1.0, scene.keyframes[action.initframe + max(action.framenum, 1) - 1].traj_frame,
+                 0, calc_all=True)
+        apply(plan['cleanup'])
+        assert np.allclose(replayed, expected, atol=1e-3)
+    code = scene.tcl()
+    assert 'fit_apply' in code and 'measure fit' not in code
+
+
+def test_distance_dummies_only_for_shown_frames(tmp_path, monkeypatch):
+    from molywood.moly import Script
+    monkeypatch.chdir(tmp_path)
+    scene = Script(os.path.join(EXAMPLES, 'primitives', 'distance', 'distance1.txt')).scenes[0]
+    code = scene.tcl()
+    assert 'animate goto $frame' not in code
+    positions = code.split('load_dummies $newmollabel1 {')[1].split('\n')[0]
+    frames = [int(fr) for fr in re.findall(r'(\d+) \{\{', positions)]
+    assert sorted(frames) == sorted(set(np.linspace(0, 40, 40).astype(int))) + [101]  # shown while the label exists
+    center = scene.precompute.coordinates.frame(5)[trajectory.select(scene.precompute.coordinates.atoms,
+                                                                     'resid 429 and name CE')][0]
+    assert '5 {{{{{:.4f} {:.4f} {:.4f}}}'.format(*center) in positions
+
+
+def test_precompute_cache_next_to_script(tmp_path, monkeypatch):
+    from molywood.moly import Script
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('movie')
+    with open(os.path.join('movie', 'script.txt'), 'w') as script:
+        script.write('$ global fps=4\n$ scene1 structure={} resolution=10,10\n\n# scene1\n\n'
+                     'center_view selection="resid 410"\n'.format(os.path.join(EXAMPLES, 'tubulin.pdb')))
+    scr = Script(os.path.join('movie', 'script.txt'))
+    scr.scenes[0].tcl()  # generating the TCL code alone leaves no files behind
+    assert os.listdir('.') == ['movie'] and os.listdir('movie') == ['script.txt']
+    scr.precompute_dir = scr.cache_path('precompute')  # as set by Script.render
+    scr.scenes[0].precompute = None
+    scr.scenes[0].tcl()
+    assert len(os.listdir(os.path.join('movie', '.molywood_cache', 'precompute'))) == 1
@@ -0,0 +1,21 @@
+import os
+import sys
+import shutil
+import subprocess
+
+from molywood import validate
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+EXAMPLE = os.path.join(ROOT, 'examples', 'simple_movie', 'script.txt')
+
+
+def test_scripts_are_validated_without_heavy_imports(tmp_path):
+    code = 'import sys, molywood.validate as v; print(v.validate({!r}), "numpy" in sys.modules, ' \
+           '"matplotlib" in sys.modules)'.format(EXAMPLE)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, universal_newlines=True)
+    assert output.split() == ['None', 'False', 'False']
+    shutil.copy(os.path.join(os.path.dirname(EXAMPLE), 'test.vmd'), str(tmp_path))
+    broken = tmp_path / 'broken.txt'
+    broken.write_text(open(EXAMPLE).read() + 'spin t=1s\n')
+    assert validate.validate(str(broken)).startswith("RuntimeError: 'spin' is not a valid action")
+    assert validate.validate(str(tmp_path / 'missing.txt')).startswith('FileNotFoundError')
@@ -0,0 +1,83 @@
+import os
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+from molywood import vmd_pool
+
+# stands in for VMD's text console: reports its pid and whether the molecule was reused
+FAKE_VMD = '''import os, sys
+for line in sys.stdin:
+    words = line.split()
+    if words and words[0] == 'molywood_run':
+        failed = 'error' in open(words[3].strip('{}')).read()
+        print('Info) {} {}'.format(os.getpid(), words[4]), file=open('jobs.log', 'a'))
+        print('vmd > molywood_done {} {}'.format(words[1], int(failed)), flush=True)
+    elif words and words[0] == 'molywood_exit':
+        break
+'''
+
+SCRIPT = 'mol new {} type pdb first 0 last -1 step 1 waitfor all\nset traj_base [molinfo top get numframes]\n' \
+         'if {{$traj_last >= 0}} {{\n  mol addfile traj.xtc type xtc first $traj_first\n}}\n' \
+         'axes location off\nmol new atoms 2\n{}\nexit\n'
+
+
+def test_script_is_adapted_for_pool():
+    code = SCRIPT.format('a.pdb', '')
+    pooled = vmd_pool.pooled_script(code)
+    assert pooled.startswith('molywood_load {mol new a.pdb')
+    assert '  molywood_load {mol addfile traj.xtc' in pooled and 'set traj_base [molywood_base]' in pooled
+    assert 'axes location off\nmol new atoms 2\n' in pooled  # only the molecule set up before the actions
+    assert vmd_pool.script_context(code) == vmd_pool.script_context(SCRIPT.format('a.pdb', 'rotate'))
+    assert vmd_pool.script_context(code) != vmd_pool.script_context(SCRIPT.format('b.pdb', ''))
+    assert vmd_pool.script_context('mol new a.pdb\nmol new b.pdb\naxes location off\n') is None
+
+
+def test_workers_are_reused_for_the_same_molecule(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('fake_vmd.py', 'w') as out:
+        out.write(FAKE_VMD)
+    pool = vmd_pool.VMDPool('"{}" fake_vmd.py'.format(sys.executable), size=1)
+    scripts = [('a.pdb', '', True), ('a.pdb', '', False), ('a.pdb', '', True), ('a.pdb', '', True),
+               ('b.pdb', 'error', True), ('b.pdb', '', True)]
+    returncodes = []
+    for n, (structure, body, reusable) in enumerate(scripts):
+        code = SCRIPT.format(structure, body)
+        with open('script_{}.tcl'.format(n), 'w') as out:
+            out.write(vmd_pool.pooled_script(code))
+        returncodes.append(pool.submit('script_{}.tcl'.format(n), vmd_pool.script_context(code), reusable).wait())
+    pool.close()
+    assert returncodes == [0, 0, 0, 0, 1, 0]
+    jobs = [line.split()[1:] for line in open('jobs.log')]
+    # fit_trajectory-like (non-reusable) and failed jobs leave the molecule dirty, so it is loaded again
+    assert [reuse for _, reuse in jobs] == ['0', '1', '0', '1', '0', '0']
+    assert len({pid for pid, _ in jobs}) == 4
+    assert pool.reused == 2
+    assert not os.path.isfile(pool.bootstrap)
+
+
+# minimal stand-ins for the VMD commands used by the bootstrap code, keeping the center of the molecule
+FAKE_VMD_COMMANDS = r'''set center {{0 0 0}}
+proc material {args} {return Opaque}
+proc display {args} {if {[lindex $args 0] eq "resetview"} {set ::center {{9 9 9}}}; return 0}
+proc molinfo {args} {
+  if {[llength $args] == 1} {return 0}
+  lassign $args mol op key value
+  if {$op eq "set" && $key eq "center"} {set ::center $value}
+  if {$op eq "get"} {
+    switch -- $key {center {return $::center} numframes {return 1} numreps {return 0} default {return {a b c d}}}
+  }
+}
+foreach command {mol graphics label animate} {proc $command {args} {}}
+'''
+
+
+@pytest.mark.skipif(shutil.which('tclsh') is None, reason='requires tclsh')
+def test_reset_restores_the_center(tmp_path):
+    code = FAKE_VMD_COMMANDS + vmd_pool.BOOTSTRAP + 'molywood_load {mol new a.pdb}\n' \
+        'molinfo top set center {{1 2 3}}\nmolywood_reset\nputs [molinfo top get center]\n'
+    with open(str(tmp_path / 'reset.tcl'), 'w') as out:
+        out.write(code)
+    assert subprocess.check_output(['tclsh', str(tmp_path / 'reset.tcl')], universal_newlines=True).strip() == '{0 0 0}'